@@ -0,0 +1,82 @@
+"""
+Бенчмарк пропускной способности: N отдельных POST /sync против тех же N
+элементов в POST /sync/batch. Приложение запускается в процессе через
+ASGI-транспорт httpx, хранилище - SQLite (WAL) во временном каталоге.
+
+Запуск: python benchmarks/bench_batch_sync.py --items 10000 --batch-size 500
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+import httpx  # noqa: E402
+import sync_api  # noqa: E402
+from storage import SQLiteStorage, WriteBehindStore  # noqa: E402
+
+
+def _item(i: int, users: int) -> dict:
+    user_id = i % users
+    return {
+        "userId": user_id,
+        "settings": {"reminderTime": "09:00"},
+        "tasks": [{"id": f"{user_id}-{i % 5}", "title": f"Импорт {i}", "completedPomodoros": i % 4}],
+        "stats": {"totalSessions": i},
+    }
+
+
+async def _single(client: httpx.AsyncClient, items: list) -> float:
+    started = time.perf_counter()
+    for item in items:
+        r = await client.post("/sync", json=item)
+        r.raise_for_status()
+    await sync_api.sync_storage.flush()
+    return time.perf_counter() - started
+
+
+async def _batched(client: httpx.AsyncClient, items: list, batch_size: int) -> float:
+    started = time.perf_counter()
+    for i in range(0, len(items), batch_size):
+        r = await client.post("/sync/batch", json={"items": items[i:i + batch_size]})
+        r.raise_for_status()
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    items = [_item(i, args.users) for i in range(args.items)]
+    transport = httpx.ASGITransport(app=sync_api.app)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = []
+        for name in ("single", "batch"):
+            store = WriteBehindStore(SQLiteStorage(os.path.join(tmp, f"{name}.db")))
+            sync_api.sync_storage = sync_api.user_store.storage = store
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                if name == "single":
+                    elapsed = await _single(client, items)
+                else:
+                    elapsed = await _batched(client, items, args.batch_size)
+            sync_api.sync_storage.backend.close()
+            results.append((name, elapsed))
+
+    for name, elapsed in results:
+        print(f"{name:8} {args.items} элементов за {elapsed:7.2f} с  ->  {args.items / elapsed:9.0f} элементов/с")
+    print(f"ускорение пакетного режима: x{results[0][1] / results[1][1]:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
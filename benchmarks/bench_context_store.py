@@ -0,0 +1,98 @@
+"""
+Накладные расходы на контекст диалога за одно обновление: MemoryContext
+(список контекстов в Dispatcher) против ContextStore в памяти и в SQLite.
+
+На каждое обновление - то же, что делают диспетчер и обработчик диалога:
+найти контекст пользователя, прочитать состояние и данные, записать
+черновик и новое состояние. Обновления приходят от --users пользователей
+случайно. Для ContextStore фоновая запись идёт как в боте (раз в
+--flush-ms), её время входит в общее; после прогона выводится, сколько
+контекстов записано и сколько заняла последняя запись.
+
+Запуск: python benchmarks/bench_context_store.py --users 10000 --updates 50000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+from maxapi import Dispatcher  # noqa: E402
+
+from context_store import (  # noqa: E402
+    ContextDispatcher,
+    ContextStore,
+    MemoryContextBackend,
+    SQLiteContextBackend,
+)
+from states import UserStates  # noqa: E402
+
+STATES = [UserStates.waiting_task_description, UserStates.waiting_deadline, UserStates.editing_subtask, None]
+
+
+async def _run(dp: Dispatcher, args) -> float:
+    """Прогнать обновления; возвращает мкс на обновление"""
+    rng = random.Random(1)
+    users = [rng.randrange(args.users) for _ in range(args.updates)]
+    lookup = dp._Dispatcher__get_memory_context
+    t0 = time.perf_counter()
+    for i, user_id in enumerate(users):
+        context = lookup(user_id, user_id)
+        await context.get_state()
+        data = await context.get_data()
+        await context.update_data(current_task={"title": f"Задача {i}", "subtasks": data.get("subtasks", [])})
+        await context.set_state(STATES[i % len(STATES)])
+        if i % 1000 == 0:
+            await asyncio.sleep(0)  # дать сработать фоновой записи
+    return (time.perf_counter() - t0) / len(users) * 1e6
+
+
+async def _store(dp: ContextDispatcher, args) -> str:
+    store = dp.context_store
+    store.start()
+    per_update = await _run(dp, args)
+    t0 = time.perf_counter()
+    written = await store.flush()
+    last_flush = time.perf_counter() - t0
+    await store.stop()
+    return f"{per_update:8.1f} мкс/обновление, последняя запись {written} контекстов за {last_flush * 1000:.1f} мс"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--updates", type=int, default=50000)
+    parser.add_argument("--flush-ms", type=int, default=1000)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    print(f"пользователей {args.users}, обновлений {args.updates}")
+
+    per_update = await _run(Dispatcher(), args)
+    print(f"  MemoryContext:        {per_update:8.1f} мкс/обновление (в памяти, теряется при перезапуске)")
+
+    dp = ContextDispatcher(ContextStore(
+        MemoryContextBackend(), states=[UserStates], flush_interval_ms=args.flush_ms, max_cached=args.cache_size,
+    ))
+    print(f"  ContextStore, память: {await _store(dp, args)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dp = ContextDispatcher(ContextStore(
+            SQLiteContextBackend(os.path.join(tmp, "contexts.db")),
+            states=[UserStates],
+            flush_interval_ms=args.flush_ms,
+            max_cached=args.cache_size,
+        ))
+        print(f"  ContextStore, SQLite: {await _store(dp, args)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
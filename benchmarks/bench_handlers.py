@@ -0,0 +1,113 @@
+"""
+Процессорное время обработчиков статических экранов бота на одно обновление.
+
+Обработчики вызываются напрямую с фейковым Bot, который только
+сериализует вложения (как SendMessage) и ничего не отправляет.
+Модель для handle_ai_question подменена потоком из готовых кусков.
+
+Сравнить с другой версией router.py (например, до изменения):
+    git show <ревизия>:bot/router.py > /tmp/router_before.py
+    python benchmarks/bench_handlers.py --router /tmp/router_before.py
+    python benchmarks/bench_handlers.py
+"""
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+from maxapi.context import MemoryContext  # noqa: E402
+from maxapi.types.attachments.attachment import Attachment  # noqa: E402
+
+
+class FakeBot:
+    """Bot без сети: сериализует вложения и возвращает mid"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, attachments=None, **kwargs):
+        for attachment in attachments or []:
+            if isinstance(attachment, Attachment):
+                attachment.model_dump()
+        self.sent += 1
+        return SimpleNamespace(message=SimpleNamespace(body=SimpleNamespace(mid=f"mid-{self.sent}")))
+
+    async def edit_message(self, attachments=None, **kwargs):
+        for attachment in attachments or []:
+            attachment.model_dump()
+
+
+def _load_router(path):
+    if path is None:
+        import router
+        return router
+    spec = importlib.util.spec_from_file_location("router_under_test", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _event(bot, text=None):
+    return SimpleNamespace(
+        bot=bot,
+        chat=SimpleNamespace(chat_id=1),
+        message=SimpleNamespace(
+            text=text,
+            body=SimpleNamespace(text=text),
+            recipient=SimpleNamespace(chat_id=1),
+            sender=SimpleNamespace(user_id=1),
+        ),
+        get_ids=lambda: (1, 1),
+    )
+
+
+async def _cpu_per_call(handler, make_args, iterations: int) -> float:
+    for _ in range(min(50, iterations)):
+        await handler(*make_args())
+    t0 = time.process_time()
+    for _ in range(iterations):
+        await handler(*make_args())
+    return (time.process_time() - t0) / iterations
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--router", help="путь к другой версии router.py")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    router = _load_router(args.router)
+    router.AI_STREAM_EDIT_INTERVAL = 0.0
+
+    async def fake_stream(question):
+        for chunk in ("Разбейте ", "задачу ", "на шаги ", "по 25 минут."):
+            yield chunk
+
+    router.ask_openrouter_stream = fake_stream
+    bot = FakeBot()
+    context = MemoryContext(1, 1)
+
+    cases = [
+        ("back_to_main", router.back_to_main, lambda: (_event(bot), context)),
+        ("how_it_works", router.how_it_works, lambda: (_event(bot),)),
+        ("help_command", router.help_command, lambda: (_event(bot, "/help"), context)),
+        ("start_command", router.start_command, lambda: (_event(bot, "/start"), context)),
+        ("handle_ai_question", router.handle_ai_question, lambda: (_event(bot, "Как планировать день?"), context)),
+    ]
+    print(f"router: {args.router or 'текущий'}")
+    for name, handler, make_args in cases:
+        seconds = await _cpu_per_call(handler, make_args, args.iterations)
+        print(f"  {name:<20} {seconds * 1e6:8.1f} мкс CPU на обновление")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Проверка и замер общего пула соединений к LM: N последовательных вызовов
+_call_lm с общим клиентом против нового httpx.AsyncClient на каждый запрос
+(как было раньше). Заглушка LM считает TCP-соединения: с пулом должно быть
+одно соединение на все запросы.
+
+Задержку установки соединения через туннель можно имитировать
+параметром --connect-delay-ms.
+
+Запуск: python benchmarks/bench_lm_pool.py --requests 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+import httpx  # noqa: E402
+import sync_api  # noqa: E402
+from lm_stub import LMStub  # noqa: E402
+
+
+class _SlowConnectTransport(httpx.AsyncHTTPTransport):
+    """Транспорт, добавляющий задержку на каждое новое соединение (имитация TLS через туннель)"""
+
+    def __init__(self, connect_delay: float, **kwargs):
+        super().__init__(**kwargs)
+        self._pool._network_backend = _DelayedBackend(self._pool._network_backend, connect_delay)
+
+
+class _DelayedBackend:
+    def __init__(self, backend, delay: float):
+        self._backend = backend
+        self._delay = delay
+
+    async def connect_tcp(self, *args, **kwargs):
+        await asyncio.sleep(self._delay)
+        return await self._backend.connect_tcp(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+
+async def _measure(requests: int, make_client, shared: bool) -> list:
+    messages = sync_api._build_prompt("Подготовиться к экзамену", None)
+    latencies = []
+    if shared:
+        sync_api.lm_client = make_client()
+    for _ in range(requests):
+        if not shared:
+            sync_api.lm_client = make_client()
+        t0 = time.perf_counter()
+        await sync_api._call_lm(messages)
+        latencies.append(time.perf_counter() - t0)
+        if not shared:
+            await sync_api.lm_client.aclose()
+    if shared:
+        await sync_api.lm_client.aclose()
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="задержка ответа заглушки")
+    parser.add_argument("--connect-delay-ms", type=float, default=0.0, help="задержка нового соединения")
+    args = parser.parse_args()
+
+    stub = LMStub(latency_ms=args.latency_ms)
+    await stub.start()
+    os.environ["LM_BASE_URL"] = stub.base_url
+
+    def make_client():
+        client = sync_api._create_lm_client()
+        if args.connect_delay_ms:
+            client._transport = _SlowConnectTransport(args.connect_delay_ms / 1000)
+        return client
+
+    try:
+        rows = []
+        for name, shared in (("новый клиент на запрос", False), ("общий пул", True)):
+            stub.connections.clear()
+            latencies = await _measure(args.requests, make_client, shared)
+            rows.append((name, statistics.mean(latencies) * 1000, statistics.median(latencies) * 1000, len(stub.connections)))
+    finally:
+        await stub.stop()
+
+    print(f"{'режим':26} {'среднее, мс':>12} {'p50, мс':>10} {'соединений':>11}")
+    for name, mean, p50, conns in rows:
+        print(f"{name:26} {mean:12.2f} {p50:10.2f} {conns:11d}")
+    print(f"экономия на запрос: {rows[0][1] - rows[1][1]:.2f} мс")
+
+    if rows[1][3] != 1:
+        raise SystemExit(f"ожидалось одно переиспользуемое соединение, получено {rows[1][3]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
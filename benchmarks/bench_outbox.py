@@ -0,0 +1,112 @@
+"""
+Поток ответов бота через очередь исходящих и напрямую.
+
+--chats чатов одновременно получают по --messages сообщений (как при
+наплыве обновлений: обработчики отправляют, не дожидаясь друг друга).
+Фейковый API отвечает за случайное время, возвращает 429 на запросы сверх
+--quota в секунду и с вероятностью --error-rate отвечает 503. Для каждого
+режима выводятся: доставлено, нарушения порядка внутри чата, пиковый темп
+запросов за секунду, сколько ответов 429 получено, и время ожидания в
+очереди.
+
+Запуск: python benchmarks/bench_outbox.py --chats 200 --messages 5
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+from maxapi.types.errors import Error  # noqa: E402
+
+from outbox import Outbox  # noqa: E402
+
+
+class FakeApi:
+    """send_message со случайной задержкой, квотой и долей ответов 503; запоминает порядок доставки"""
+
+    def __init__(self, rng: random.Random, latency: float, quota: int, error_rate: float):
+        self.rng = rng
+        self.latency = latency
+        self.quota = quota
+        self.error_rate = error_rate
+        self.delivered = defaultdict(list)
+        self.per_second = Counter()
+        self.throttled = 0
+
+    async def send_message(self, chat_id=None, user_id=None, text=None, **kwargs):
+        second = int(time.perf_counter())
+        self.per_second[second] += 1
+        await asyncio.sleep(self.rng.uniform(0, 2 * self.latency))
+        if self.per_second[second] > self.quota:
+            self.throttled += 1
+            return Error(code=429, raw={"code": "too.many.requests"})
+        if self.rng.random() < self.error_rate:
+            return Error(code=503, raw={"code": "service.unavailable"})
+        self.delivered[chat_id].append(int(text))
+        return text
+
+
+def _summary(api: FakeApi, elapsed: float) -> str:
+    delivered = sum(len(seq) for seq in api.delivered.values())
+    disorder = sum(1 for seq in api.delivered.values() for a, b in zip(seq, seq[1:]) if b < a)
+    return (
+        f"доставлено {delivered}, не по порядку {disorder}, 429 {api.throttled}, "
+        f"пик {max(api.per_second.values())} запр./с, за {elapsed:.1f} с"
+    )
+
+
+async def _direct(args, api: FakeApi) -> str:
+    t0 = time.perf_counter()
+    sends = [
+        api.send_message(chat_id=chat_id, text=str(seq))
+        for seq in range(args.messages)
+        for chat_id in range(args.chats)
+    ]
+    await asyncio.gather(*sends)
+    return _summary(api, time.perf_counter() - t0)
+
+
+async def _queued(args, api: FakeApi) -> str:
+    outbox = Outbox(rate=args.rate, chat_rate=args.chat_rate, chat_burst=args.chat_burst, backoff=0.2)
+    t0 = time.perf_counter()
+    futures = [
+        outbox.send_message(api, chat_id=chat_id, text=str(seq))
+        for seq in range(args.messages)
+        for chat_id in range(args.chats)
+    ]
+    await asyncio.gather(*futures)
+    stats = outbox.stats()
+    return (
+        f"{_summary(api, time.perf_counter() - t0)}, повторов {stats['retries']}, "
+        f"ожидание в очереди p50 {stats['wait_p50']:.2f} с, p99 {stats['wait_p99']:.2f} с"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5, help="сообщений в каждый чат")
+    parser.add_argument("--latency", type=float, default=0.05, help="средняя задержка API, с")
+    parser.add_argument("--quota", type=int, default=30, help="запросов в секунду, сверх которых API отвечает 429")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="доля ответов 503")
+    parser.add_argument("--rate", type=float, default=30)
+    parser.add_argument("--chat-rate", type=float, default=1)
+    parser.add_argument("--chat-burst", type=float, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    print(f"чатов {args.chats}, сообщений {args.chats * args.messages}")
+    print(f"  напрямую: {await _direct(args, FakeApi(random.Random(1), args.latency, args.quota, args.error_rate))}")
+    print(f"  очередь:  {await _queued(args, FakeApi(random.Random(1), args.latency, args.quota, args.error_rate))}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""
+Много одновременных таймеров Pomodoro на одном цикле asyncio.
+
+Запускает --timers таймеров длительностью от --min-s до --max-s секунд
+(часть ставится на паузу и снимается с неё, часть отменяется) и меряет
+опоздание срабатывания относительно времени окончания, а также время
+операций start/pause/resume/cancel.
+
+Запуск: python benchmarks/bench_pomodoro_timers.py --timers 200000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+from pomodoro import PomodoroTimers  # noqa: E402
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--timers", type=int, default=200_000)
+    parser.add_argument("--min-s", type=float, default=2.0)
+    parser.add_argument("--max-s", type=float, default=6.0)
+    parser.add_argument("--cancel", type=float, default=0.1, help="доля отменённых таймеров")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    rng = random.Random(1)
+    lags = []
+    done = asyncio.Event()
+    expected = 0
+
+    async def on_finish(timer):
+        lags.append(time.time() - timer.ends_at)
+        if len(lags) == expected:
+            done.set()
+
+    # память - на отдельном экземпляре: tracemalloc замедляет и исказил бы опоздания
+    probe = PomodoroTimers(on_finish)
+    tracemalloc.start()
+    for chat_id in range(args.timers):
+        probe.start(chat_id, chat_id, "Фокус-сессия", args.max_s)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del probe
+
+    timers = PomodoroTimers(on_finish)
+    await timers.start_loop()
+    t0 = time.perf_counter()
+    for chat_id in range(args.timers):
+        timers.start(chat_id, chat_id, "Фокус-сессия", rng.uniform(args.min_s, args.max_s))
+    start_time = time.perf_counter() - t0
+
+    sample = rng.sample(range(args.timers), args.timers // 10)
+    t0 = time.perf_counter()
+    for chat_id in sample:
+        timers.pause(chat_id)
+    for chat_id in sample:
+        timers.resume(chat_id)
+    pause_time = time.perf_counter() - t0
+
+    cancelled = rng.sample(range(args.timers), int(args.timers * args.cancel))
+    t0 = time.perf_counter()
+    for chat_id in cancelled:
+        timers.cancel(chat_id)
+    cancel_time = time.perf_counter() - t0
+
+    expected = len(timers)
+    await asyncio.wait_for(done.wait(), timeout=args.max_s * 3 + 10)
+    await timers.stop()
+
+    print(f"таймеров: {args.timers}, сработало: {len(lags)}, отменено: {len(cancelled)}")
+    print(f"  start:        {start_time / args.timers * 1e6:6.2f} мкс, память {memory / args.timers:.0f} байт на таймер")
+    print(f"  pause+resume: {pause_time / len(sample) * 1e6:6.2f} мкс")
+    print(f"  cancel:       {cancel_time / len(cancelled) * 1e6:6.2f} мкс")
+    print(
+        f"  опоздание срабатывания: p50 {_percentile(lags, 0.5) * 1000:.1f} мс, "
+        f"p99 {_percentile(lags, 0.99) * 1000:.1f} мс, max {max(lags) * 1000:.1f} мс"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""
+Рассылка утренних напоминаний: последовательный цикл против Fanout.
+
+Фейковый Bot отвечает с задержкой --latency-ms, часть ответов - 429
+(--throttle) и chat.denied (--denied). Последовательная рассылка
+измеряется на небольшой выборке и экстраполируется на --users.
+Проверяется, что Fanout не превышает --rate отправок в секунду.
+
+Запуск: python benchmarks/bench_reminder_fanout.py --users 600 --latency-ms 100 --rate 30
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+from maxapi.types.errors import Error  # noqa: E402
+
+from fanout import Fanout  # noqa: E402
+from scheduler import ReminderScheduler  # noqa: E402
+
+
+class FakeBot:
+    """Фейковый Bot с задержкой ответа и заданной долей ошибок"""
+
+    def __init__(self, latency: float, throttle: float = 0.0, denied: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.throttle = throttle
+        self.denied = denied
+        self.random = random.Random(seed)
+        self.calls_per_second = Counter()
+        self.delivered = set()
+
+    async def send_message(self, chat_id=None, **kwargs):
+        self.calls_per_second[int(time.perf_counter())] += 1
+        await asyncio.sleep(self.latency)
+        roll = self.random.random()
+        if roll < self.denied:
+            return Error(code=403, raw={"code": "chat.denied", "message": "chat.denied"})
+        if roll < self.denied + self.throttle:
+            return Error(code=429, raw={"code": "too.many.requests", "message": "Too many requests"})
+        self.delivered.add(chat_id)
+        return object()
+
+
+def _scheduler(bot, users: int, fanout=None) -> ReminderScheduler:
+    scheduler = ReminderScheduler(bot, fanout=fanout)
+    for chat_id in range(1, users + 1):
+        scheduler.active_users.add(chat_id)
+        scheduler.update_user_data(chat_id, {
+            "tasks": [{"description": f"Задача {chat_id}", "subtasks": [{"completed": False}]}]
+        })
+    return scheduler
+
+
+async def _sequential(args, sample: int) -> float:
+    scheduler = _scheduler(FakeBot(args.latency_ms / 1000), sample)
+    t0 = time.perf_counter()
+    for chat_id in range(1, sample + 1):
+        await scheduler.send_morning_reminder(chat_id)
+    return time.perf_counter() - t0
+
+
+async def _fanout(args):
+    bot = FakeBot(args.latency_ms / 1000, args.throttle, args.denied)
+    fanout = Fanout(
+        concurrency=args.concurrency,
+        rate=args.rate,
+        max_retries=args.max_retries,
+        backoff=args.backoff,
+        progress_interval=5.0,
+    )
+    scheduler = _scheduler(bot, args.users, fanout)
+    report = await scheduler._send_reminders(sorted(scheduler.active_users))
+    return bot, scheduler, report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=600)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--rate", type=float, default=30.0, help="квота отправок в секунду")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--throttle", type=float, default=0.02, help="доля ответов 429")
+    parser.add_argument("--denied", type=float, default=0.01, help="доля ответов chat.denied")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=0.2)
+    parser.add_argument("--sample", type=int, default=50, help="выборка для последовательной рассылки")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("fanout").setLevel(logging.ERROR)
+
+    sample = min(args.sample, args.users)
+    sequential = await _sequential(args, sample) / sample * args.users
+    bot, scheduler, report = await _fanout(args)
+
+    seconds = sorted(bot.calls_per_second.items())[1:-1]  # неполные первая и последняя секунды
+    peak = max((count for _, count in seconds), default=0)
+
+    print(f"пользователей: {args.users}, задержка API: {args.latency_ms:.0f} мс, квота: {args.rate:.0f}/с")
+    print(f"  последовательно (оценка по {sample}): {sequential:8.1f} с")
+    print(f"  fanout:                           {report.duration:8.1f} с  ({sequential / report.duration:.1f}x)")
+    print(f"  {report}")
+    print(f"  пик отправок в секунду: {peak} (квота {args.rate:.0f}), в списке осталось {len(scheduler.active_users)}")
+    print(f"  оценка для 50000 пользователей: {50000 / args.rate / 60:.1f} мин против {sequential / args.users * 50000 / 3600:.1f} ч")
+
+    if peak > args.rate * 1.1:
+        raise SystemExit("превышена квота отправок")
+    if report.denied != args.users - len(scheduler.active_users):
+        raise SystemExit("пользователи с chat.denied не исключены из рассылки")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+Память планировщика напоминаний на пользователя.
+
+Сравнивает прежнее хранение (копия user_data и MemoryContext на каждого
+пользователя навсегда) с индексом из __slots__ записей: без ограничения
+размера и с ограничением REMINDER_CACHE_SIZE (остальные пользователи
+перечитываются через loader при промахе). Память считается tracemalloc
+после сборки всех структур.
+
+Запуск: python benchmarks/bench_reminder_memory.py --users 10000 100000 1000000
+"""
+import argparse
+import gc
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+from maxapi.context import MemoryContext  # noqa: E402
+
+from scheduler import ReminderScheduler  # noqa: E402
+from task_index import IncompleteTaskIndex  # noqa: E402
+
+TASKS_PER_USER = 3
+SUBTASKS_PER_TASK = 3
+
+
+def _user_data(chat_id: int) -> dict:
+    """Данные пользователя как их хранит бот: одна задача выполнена, две нет"""
+    tasks = []
+    for t in range(TASKS_PER_USER):
+        tasks.append({
+            "id": f"bot-{chat_id}-{t}",
+            "description": f"Задача {t} пользователя {chat_id}",
+            "deadline": "через неделю",
+            "subtasks": [
+                {"title": f"Шаг {s} задачи {t}", "pomodoros": 2, "completed": t == 0}
+                for s in range(SUBTASKS_PER_TASK)
+            ],
+        })
+    return {"tasks": tasks, "total_sessions": 0, "level": 1, "joined_date": "2025-01-01T09:00:00"}
+
+
+def _measure(build) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    keep = build()
+    elapsed = time.perf_counter() - t0
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del keep
+    gc.collect()
+    return size, elapsed
+
+
+def _legacy(users: int):
+    """Прежнее хранение: user_data_cache и user_contexts без вытеснения"""
+    active_users, user_contexts, user_data_cache = set(), {}, {}
+    for chat_id in range(users):
+        active_users.add(chat_id)
+        user_contexts[chat_id] = MemoryContext(chat_id, chat_id)
+        user_data_cache[chat_id] = _user_data(chat_id)
+    return active_users, user_contexts, user_data_cache
+
+
+def _scheduler(users: int, maxsize: int):
+    async def loader(chat_id):
+        return _user_data(chat_id)["tasks"]
+
+    index = IncompleteTaskIndex(maxsize=maxsize, loader=loader)
+    scheduler = ReminderScheduler(None, task_index=index)
+    for chat_id in range(users):
+        scheduler.add_user(chat_id, MemoryContext(chat_id, chat_id))
+        scheduler.update_user_data(chat_id, _user_data(chat_id))
+    return scheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--cache-size", type=int, default=100_000)
+    parser.add_argument("--legacy-max", type=int, default=100_000, help="прежнее хранение не строить больше этого числа")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    print(f"{'пользователей':>14} {'вариант':<28} {'всего, МБ':>10} {'байт/польз.':>12} {'сборка, с':>10}")
+    for users in args.users:
+        variants = [
+            ("индекс без ограничения", lambda: _scheduler(users, users)),
+            (f"индекс, кэш {args.cache_size}", lambda: _scheduler(users, args.cache_size)),
+        ]
+        if users <= args.legacy_max:
+            variants.insert(0, ("прежнее (dict + контекст)", lambda: _legacy(users)))
+        for name, build in variants:
+            size, elapsed = _measure(build)
+            print(f"{users:>14} {name:<28} {size / 2**20:>10.1f} {size / users:>12.0f} {elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
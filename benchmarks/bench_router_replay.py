@@ -0,0 +1,306 @@
+"""
+Прогон сценария обновлений через настоящие Dispatcher и router.py с
+фейковым Bot: обновлений в секунду, гистограммы задержки по обработчикам
+и выделения памяти на обновление.
+
+Сценарий - обновления MAX (message_created / message_callback) в формате
+API, по одному JSON в строке. Его можно записать (--script) или
+сгенерировать: --users пользователей проходят --sessions раз путь
+/start -> создать задачу -> описание -> дедлайн -> шаг плана -> сохранить
+-> Pomodoro (старт, пауза, продолжить, завершить) -> вопрос AI -> меню ->
+/help; шаги разных пользователей чередуются. Сгенерированный сценарий
+можно сохранить (--dump) и прогонять на разных ревизиях.
+
+Обновления разбираются в модели maxapi и проходят enrich_event и
+dp.handle по одному, как при long polling. Bot ничего не отправляет:
+сериализует вложения (как SendMessage) и запоминает отправленное. Модель
+AI подменена потоком из готовых кусков. Время - от входа в dp.handle до
+выхода, с фильтрами и поиском контекста. Память считается отдельным
+прогоном под tracemalloc (он замедляет код): пик выделенного за
+обновление и сколько осталось после него.
+
+--trace ставит UpdateTracer (tracing.py) и уровень лога диспетчера, как в
+main.py, и печатает среднее время этапов. Логи по умолчанию выключены; --log-level INFO пишет их в
+никуда с форматированием - видно, сколько стоит логирование обработчиков.
+
+Запуск: python benchmarks/bench_router_replay.py --users 200 --sessions 3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+from maxapi.methods.types.getted_updates import UPDATE_MODEL_MAPPING  # noqa: E402
+from maxapi.types.attachments.attachment import Attachment  # noqa: E402
+from maxapi.utils.updates import enrich_event  # noqa: E402
+
+import router  # noqa: E402
+import tracing  # noqa: E402
+from context_store import ContextDispatcher, ContextStore, MemoryContextBackend  # noqa: E402
+from pomodoro import PomodoroTimers  # noqa: E402
+from scheduler import ReminderScheduler  # noqa: E402
+from states import UserStates  # noqa: E402
+from storage import MemoryStorage, WriteBehindStore  # noqa: E402
+from user_store import UserStore  # noqa: E402
+
+# границы корзин гистограммы, мкс
+BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+UNHANDLED = "(не обработано)"
+
+
+class FakeBot:
+    """Bot без сети: сериализует вложения, запоминает отправленное и возвращает mid"""
+
+    auto_requests = True
+
+    def __init__(self):
+        self.me = SimpleNamespace(username="focus_helper_bot", user_id=1)
+        self.sent = []
+        self.edited = 0
+
+    async def get_chat_by_id(self, chat_id):
+        return SimpleNamespace(chat_id=chat_id, type="dialog")
+
+    async def send_message(self, chat_id=None, user_id=None, text=None, attachments=None, **kwargs):
+        for attachment in attachments or []:
+            if isinstance(attachment, Attachment):
+                attachment.model_dump()
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(message=SimpleNamespace(body=SimpleNamespace(mid=f"mid-{len(self.sent)}")))
+
+    async def edit_message(self, message_id=None, text=None, attachments=None, **kwargs):
+        for attachment in attachments or []:
+            attachment.model_dump()
+        self.edited += 1
+
+
+class TimedDispatcher(ContextDispatcher):
+    """Запоминает, какой обработчик вызван для последнего обновления, и считает их ошибки"""
+
+    last_handler = UNHANDLED
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.errors = defaultdict(int)
+
+    async def call_handler(self, handler, event_object, data):
+        self.last_handler = handler.func_event.__name__
+        try:
+            await super().call_handler(handler, event_object, data)
+        except Exception:
+            self.errors[self.last_handler] += 1
+            raise
+
+
+def _user(user_id: int) -> dict:
+    return {"user_id": user_id, "first_name": "Тест", "is_bot": False, "last_activity_time": 0}
+
+
+def _message(user_id: int, seq: int, text: str) -> dict:
+    return {
+        "update_type": "message_created",
+        "timestamp": seq,
+        "message": {
+            "sender": _user(user_id),
+            "recipient": {"chat_id": user_id, "chat_type": "dialog"},
+            "timestamp": seq,
+            "body": {"mid": f"mid-{user_id}-{seq}", "seq": seq, "text": text},
+        },
+    }
+
+
+def _callback(user_id: int, seq: int, payload: str) -> dict:
+    return {
+        "update_type": "message_callback",
+        "timestamp": seq,
+        "callback": {"timestamp": seq, "callback_id": f"cb-{user_id}-{seq}", "payload": payload, "user": _user(user_id)},
+        "message": {
+            "sender": {"user_id": 1, "first_name": "FocusHelper", "is_bot": True, "last_activity_time": 0},
+            "recipient": {"chat_id": user_id, "chat_type": "dialog"},
+            "timestamp": seq,
+            "body": {"mid": f"bot-{user_id}-{seq}", "seq": seq, "text": "меню"},
+        },
+    }
+
+
+def _session(n: int) -> list:
+    """Шаги одной сессии пользователя: (message|callback, текст или payload)"""
+    return [
+        ("message", "/start"),
+        ("callback", "create_task"),
+        ("message", f"Подготовиться к экзамену {n}"),
+        ("message", "через неделю"),
+        ("callback", "view_step_0"),
+        ("callback", "save_task"),
+        ("callback", "start_first_step"),
+        ("callback", "pomodoro_pause"),
+        ("callback", "pomodoro_resume"),
+        ("callback", "complete_session"),
+        ("callback", "ai_assistant"),
+        ("message", "Как не отвлекаться во время учёбы?"),
+        ("callback", "back_to_main"),
+        ("message", "/help"),
+    ]
+
+
+def _generate(users: int, sessions: int) -> list:
+    updates = []
+    seq = 0
+    for n in range(sessions):
+        steps = {user_id: _session(n) for user_id in range(1000, 1000 + users)}
+        for i in range(len(next(iter(steps.values())))):
+            for user_id, user_steps in steps.items():
+                kind, value = user_steps[i]
+                seq += 1
+                updates.append(_message(user_id, seq, value) if kind == "message" else _callback(user_id, seq, value))
+    return updates
+
+
+def _setup(tracer=None):
+    """Свежие диспетчер, бот и сервисы роутера"""
+    bot = FakeBot()
+
+    async def fake_stream(question):
+        for chunk in ("Разбейте ", "задачу ", "на шаги ", "по 25 минут."):
+            yield chunk
+
+    async def on_finish(timer):
+        pass
+
+    router.AI_STREAM_EDIT_INTERVAL = 0.0
+    router.ask_openrouter_stream = fake_stream
+    router.set_outbox(None)
+    router.set_user_store(UserStore(WriteBehindStore(MemoryStorage())))
+    router.set_pomodoro(PomodoroTimers(on_finish))
+    router.set_scheduler(ReminderScheduler(bot))
+
+    dp = TimedDispatcher(ContextStore(MemoryContextBackend(), states=[UserStates]))
+    dp.include_routers(router.router)
+    # роутер - модульный объект: middleware прошлого прогона снимаем
+    router.router.middlewares.clear()
+    if tracer is not None:
+        tracer.install(dp, [router.router])
+    return dp, bot
+
+
+async def _replay(raw_updates: list, measure_memory: bool, tracer=None):
+    """Прогнать обновления; по обработчикам - список (время, пик памяти, осталось памяти)"""
+    dp, bot = _setup(tracer)
+    samples = defaultdict(list)
+    if measure_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    for raw in raw_updates:
+        event = UPDATE_MODEL_MAPPING[raw["update_type"]](**raw)
+        event = await enrich_event(event, bot)
+        dp.last_handler = UNHANDLED
+        if measure_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        await dp.handle(event)
+        elapsed = time.perf_counter() - t0
+        if measure_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            samples[dp.last_handler].append((elapsed, peak - before, current - before))
+        else:
+            samples[dp.last_handler].append((elapsed, 0, 0))
+    total = time.perf_counter() - started
+    if measure_memory:
+        tracemalloc.stop()
+    return samples, total, bot, dp.errors
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def _histogram(times_us: list) -> list:
+    counts = [0] * len(BUCKETS)
+    for value in times_us:
+        counts[next(i for i, bound in enumerate(BUCKETS) if value <= bound)] += 1
+    return counts
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=3, help="сколько раз каждый пользователь проходит сценарий")
+    parser.add_argument("--script", help="сценарий: обновления MAX по одному JSON в строке")
+    parser.add_argument("--dump", help="сохранить сгенерированный сценарий в файл")
+    parser.add_argument("--no-memory", action="store_true", help="не делать прогон под tracemalloc")
+    parser.add_argument("--trace", action="store_true", help="замерять обновления UpdateTracer, как в main.py")
+    parser.add_argument("--log-level", help="писать логи этого уровня (в никуда); по умолчанию логи выключены")
+    args = parser.parse_args()
+
+    if args.log_level:
+        logging.basicConfig(
+            level=args.log_level,
+            stream=open(os.devnull, "w"),
+            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        )
+    else:
+        logging.disable(logging.CRITICAL)
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            raw_updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        raw_updates = _generate(args.users, args.sessions)
+    if args.dump:
+        with open(args.dump, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(raw, ensure_ascii=False) + "\n" for raw in raw_updates)
+
+    tracer = None
+    if args.trace:
+        tracer = tracing.UpdateTracer(slow_ms=float("inf"), log_every=100)
+        logging.getLogger("dispatcher").setLevel(logging.WARNING)
+    samples, total, bot, errors = await _replay(raw_updates, measure_memory=False, tracer=tracer)
+    memory = {} if args.no_memory else (await _replay(raw_updates, measure_memory=True))[0]
+
+    print(
+        f"обновлений {len(raw_updates)} за {total:.2f} с -> {len(raw_updates) / total:.0f} обновлений/с, "
+        f"отправлено {len(bot.sent)}, правок {bot.edited}, ошибок в обработчиках {sum(errors.values())}"
+    )
+    bounds = " ".join(f"{'≤' + format(b, 'g') if b != float('inf') else '>' + format(BUCKETS[-2], 'g'):>7}" for b in BUCKETS)
+    print(f"\n{'обработчик':<22} {'n':>6} {'ошибок':>6} {'p50':>7} {'p99':>7} {'max':>7}  мкс | гистограмма, мкс: {bounds}")
+    for name, rows in sorted(samples.items(), key=lambda item: -sum(r[0] for r in item[1])):
+        times_us = [r[0] * 1e6 for r in rows]
+        histogram = " ".join(f"{count:>7}" for count in _histogram(times_us))
+        print(
+            f"{name:<22} {len(rows):>6} {errors.get(name, 0):>6} {_percentile(times_us, 0.5):7.0f} {_percentile(times_us, 0.99):7.0f} "
+            f"{max(times_us):7.0f}      |                   {histogram}"
+        )
+
+    if tracer is not None:
+        print(f"\nэтапы (UpdateTracer), среднее на обновление, мкс:")
+        for stage in ("context", "handler", "send"):
+            value = tracing.STAGE_SECONDS.labels(stage)
+            print(f"  {stage:<10} {value.sum / len(raw_updates) * 1e6:8.1f}  (наблюдений {value.count})")
+        updates = tracing.UPDATE_SECONDS
+        total_sum = sum(value.sum for value in updates._values.values())
+        print(f"  {'всего':<10} {total_sum / len(raw_updates) * 1e6:8.1f}")
+
+    if memory:
+        print(f"\n{'обработчик':<22} {'пик, КиБ':>9} {'осталось, Б':>12}  (среднее на обновление, tracemalloc)")
+        all_rows = [row for rows in memory.values() for row in rows]
+        for name, rows in sorted(memory.items(), key=lambda item: -sum(r[1] for r in item[1]) / len(item[1])):
+            print(f"{name:<22} {sum(r[1] for r in rows) / len(rows) / 1024:9.1f} {sum(r[2] for r in rows) / len(rows):12.0f}")
+        print(
+            f"{'все обновления':<22} {sum(r[1] for r in all_rows) / len(all_rows) / 1024:9.1f} "
+            f"{sum(r[2] for r in all_rows) / len(all_rows):12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
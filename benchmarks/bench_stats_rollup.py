@@ -0,0 +1,166 @@
+"""
+Бенчмарк статистики по дням (stats_rollup): запросы за диапазон по дням
+и неделям, запись сессий и память при истории за годы у многих
+пользователей.
+
+База SQLite заполняется --users пользователями с историей за --days дней
+(сессии в ~40% дней; десятки разных рядов, чтобы заполнение было быстрым).
+Потом:
+- холодные запросы: 90 дней по дням и год по неделям для случайных
+  пользователей - с загрузкой ряда из базы и вытеснением под бюджет;
+- горячие запросы: те же запросы к пользователям, уже лежащим в памяти,
+  и для сравнения - сумма тех же дней по массиву дневных значений;
+- запись: сессия за сегодня для случайных пользователей.
+Печатается время на запрос и на корзину, байты рядов в памяти против
+бюджета --cache-mb и пиковая память процесса.
+
+Запуск: python benchmarks/bench_stats_rollup.py --users 100000 --days 1095
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from array import array
+from datetime import timedelta
+from itertools import accumulate
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+
+from stats_rollup import DailySeries, SQLiteStatsBackend, StatsRollups, _pack  # noqa: E402
+
+PATTERNS = 64
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def _patterns(days: int, rng: random.Random) -> tuple:
+    """
+    Сжатые ряды (префиксные суммы сессий и секунд фокуса), общие для многих пользователей,
+    и дневные значения сессий каждого ряда
+    """
+    patterns, daily = [], []
+    for _ in range(PATTERNS):
+        sessions = array("I", (rng.randint(1, 8) if rng.random() < 0.4 else 0 for _ in range(days)))
+        focus = (s * 25 * 60 for s in sessions)
+        patterns.append((_pack(array("I", accumulate(sessions, initial=0))), _pack(array("I", accumulate(focus, initial=0)))))
+        daily.append(sessions)
+    return patterns, daily
+
+
+def _fill(path: str, users: int, start_day: int, patterns: list) -> float:
+    backend = SQLiteStatsBackend(path)
+    started = time.perf_counter()
+    batch = 5000
+    for first in range(0, users, batch):
+        backend.write_many(
+            (user_id, start_day, *patterns[user_id % PATTERNS])
+            for user_id in range(first, min(first + batch, users))
+        )
+    backend.close()
+    return time.perf_counter() - started
+
+
+def _timed(rollups: StatsRollups, user_ids, first, last, bucket) -> list:
+    latencies = []
+    for user_id in user_ids:
+        t0 = time.perf_counter()
+        rollups.query(user_id, first, last, bucket)
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def _report(name: str, latencies: list, buckets: int) -> None:
+    p50 = _percentile(latencies, 0.5) * 1e6
+    p99 = _percentile(latencies, 0.99) * 1e6
+    print(f"{name:<34} p50 {p50:8.1f} мкс  p99 {p99:8.1f} мкс  ({p50 / buckets:6.2f} мкс на корзину из {buckets})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=1095, help="длина истории каждого пользователя")
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--cache-mb", type=float, default=64)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stats.db")
+        rollups = StatsRollups(
+            SQLiteStatsBackend(path), tz="UTC", max_bytes=int(args.cache_mb * 1024 * 1024), max_days=args.days + 366
+        )
+        today = rollups.today()
+        start_day = today.toordinal() - args.days + 1
+
+        patterns, daily = _patterns(args.days, rng)
+        fill = _fill(path, args.users, start_day, patterns)
+        print(
+            f"пользователей {args.users}, история {args.days} дней, база {os.path.getsize(path) / 2**20:.1f} МиБ "
+            f"(заполнение {fill:.1f} с)"
+        )
+        # после полной загрузки ряд одного пользователя занимает столько
+        series_bytes = DailySeries.from_row((0, start_day, *patterns[0])).nbytes
+        print(
+            f"ряд в памяти {series_bytes / 1024:.1f} КиБ; все пользователи заняли бы "
+            f"{series_bytes * args.users / 2**20:.0f} МиБ, бюджет {args.cache_mb:g} МиБ\n"
+        )
+
+        month_first, year_first = today - timedelta(days=89), today - timedelta(days=364)
+        cold = [rng.randrange(args.users) for _ in range(args.queries)]
+        _report("90 дней по дням, холодные", _timed(rollups, cold, month_first, today, "day"), 90)
+        cold = [rng.randrange(args.users) for _ in range(args.queries)]
+        _report("год по неделям, холодные", _timed(rollups, cold, year_first, today, "week"), 53)
+        print(f"  загрузок из базы {rollups.loads}, в памяти {len(rollups)} рядов, {rollups.cached_bytes / 2**20:.1f} МиБ")
+
+        hot = cold[-200:]
+        _report("90 дней по дням, горячие", _timed(rollups, hot * 10, month_first, today, "day"), 90)
+        _report("год по неделям, горячие", _timed(rollups, hot * 10, year_first, today, "week"), 53)
+        history_first = today - timedelta(days=args.days - 1)
+        _report("3 года по дням, горячие", _timed(rollups, hot, history_first, today, "day"), args.days)
+        _report("3 года по неделям, горячие", _timed(rollups, hot, history_first, today, "week"), args.days // 7)
+
+        # то же без префиксных сумм: сумма дневных значений за каждую корзину
+        for name, span, step, buckets in (
+            ("год по неделям, сумма дневных", 364, 7, 53),
+            ("3 года по дням, сумма дневных", args.days, 1, args.days),
+            ("3 года по неделям, сумма дневных", args.days, 7, args.days // 7),
+        ):
+            latencies = []
+            for user_id in hot:
+                values = daily[user_id % PATTERNS]
+                t0 = time.perf_counter()
+                [sum(values[i:i + step]) for i in range(args.days - span, args.days, step)]
+                latencies.append(time.perf_counter() - t0)
+            _report(name, latencies, buckets)
+
+        writers = [rng.randrange(args.users) for _ in range(args.queries)]
+        latencies = []
+        for user_id in writers:
+            t0 = time.perf_counter()
+            rollups.add(user_id, 1, 25)
+            latencies.append(time.perf_counter() - t0)
+        p50, p99 = _percentile(latencies, 0.5) * 1e6, _percentile(latencies, 0.99) * 1e6
+        print(f"\n{'сессия за сегодня':<34} p50 {p50:8.1f} мкс  p99 {p99:8.1f} мкс  (ждут записи {rollups.dirty_count})")
+
+        user_id = writers[-1]
+        check = rollups.query(user_id, history_first, today, "week")
+        expected = sum(daily[user_id % PATTERNS]) + writers.count(user_id)
+        assert sum(row[1] for row in check) == expected, "сумма по дням не совпала с исходным рядом"
+
+        print(
+            f"в памяти {len(rollups)} рядов, {rollups.cached_bytes / 2**20:.1f} МиБ при бюджете {args.cache_mb:g} МиБ; "
+            f"пик памяти процесса {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МиБ"
+        )
+        rollups.backend.close()
+
+
+if __name__ == "__main__":
+    main()
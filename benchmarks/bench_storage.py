@@ -0,0 +1,92 @@
+"""
+Бенчмарк хранилища синхронизации: латентность /sync (p50/p99) и
+устойчивая скорость записи для старого dict, MemoryStorage и SQLite (WAL)
+с отложенной записью.
+
+Запуск: python benchmarks/bench_storage.py --users 2000 --requests 20000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+import sync_api  # noqa: E402
+from storage import MemoryStorage, SQLiteStorage, WriteBehindStore  # noqa: E402
+
+
+def _payload(user_id: int, i: int, tasks_per_user: int) -> sync_api.SyncData:
+    return sync_api.SyncData(
+        userId=user_id,
+        settings={"dailyHours": 4, "pomodoroLength": 25},
+        tasks=[
+            {"id": f"{user_id}-{t}", "title": f"Задача {t}", "completedPomodoros": i % 7}
+            for t in range(tasks_per_user)
+        ],
+        stats={"totalSessions": i, "level": 1 + i // 10},
+    )
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def _run(name: str, store, args) -> dict:
+    sync_api.sync_storage = sync_api.user_store.storage = store
+    if hasattr(store, "start"):
+        store.start()
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(args.requests):
+        data = _payload(i % args.users, i, args.tasks)
+        t0 = time.perf_counter()
+        await sync_api.sync_data(data)
+        latencies.append(time.perf_counter() - t0)
+        if i % 256 == 0:
+            # даём фоновой записи шанс выполниться, как между HTTP-запросами
+            await asyncio.sleep(0)
+    if hasattr(store, "stop"):
+        await store.stop()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "name": name,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "writes_per_sec": args.requests / elapsed,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--tasks", type=int, default=10, help="задач у пользователя")
+    parser.add_argument("--flush-ms", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        variants = [
+            ("dict (старый вариант)", {}),
+            ("MemoryStorage + write-behind", WriteBehindStore(MemoryStorage(), args.flush_ms)),
+            (
+                "SQLite WAL + write-behind",
+                WriteBehindStore(SQLiteStorage(os.path.join(tmp, "bench.db")), args.flush_ms),
+            ),
+        ]
+        print(f"{'вариант':32} {'p50, мс':>10} {'p99, мс':>10} {'записей/с':>12}")
+        for name, store in variants:
+            r = await _run(name, store, args)
+            print(f"{r['name']:32} {r['p50_ms']:10.3f} {r['p99_ms']:10.3f} {r['writes_per_sec']:12.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+"""
+Время до первого полезного содержимого при стриминге ответа модели.
+
+1. sync_api: POST /analyze_task (ответ целиком) против POST /analyze_task/stream
+   (первое событие subtask). API поднимается uvicorn в процессе.
+2. Бот: handle_ai_question с фейковым Bot - время до первого редактирования
+   сообщения с текстом ответа против времени полного ответа.
+
+Модель - локальная потоковая заглушка (benchmarks/lm_stub.py).
+
+Запуск: python benchmarks/bench_streaming.py --token-delay-ms 30
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+os.environ.setdefault("OPENROUTER_API_KEY", "stub")
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from maxapi.context import MemoryContext  # noqa: E402
+
+import router  # noqa: E402
+import sync_api  # noqa: E402
+from lm_stub import LMStub  # noqa: E402
+
+GOAL_SECONDS = 1.0
+
+
+async def _bench_sync_api(stub: LMStub) -> dict:
+    os.environ["LM_BASE_URL"] = stub.base_url
+    config = uvicorn.Config(sync_api.app, host="127.0.0.1", port=0, log_level="warning")
+    server = uvicorn.Server(config)
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            body = {"userId": 1, "description": f"Полный ответ {uuid.uuid4()}"}
+            t0 = time.perf_counter()
+            r = await client.post("/analyze_task", json=body)
+            r.raise_for_status()
+            full = time.perf_counter() - t0
+
+            body = {"userId": 1, "description": f"Стриминг {uuid.uuid4()}"}
+            first = done = None
+            t0 = time.perf_counter()
+            async with client.stream("POST", "/analyze_task/stream", json=body) as r:
+                async for line in r.aiter_lines():
+                    if line == "event: subtask" and first is None:
+                        first = time.perf_counter() - t0
+                    elif line == "event: done":
+                        done = time.perf_counter() - t0
+    finally:
+        server.should_exit = True
+        await serve_task
+
+    return {"full": full, "first": first, "done": done}
+
+
+class FakeBot:
+    """Фейковый Bot: запоминает отправки и редактирования с временем"""
+
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+
+    async def send_message(self, **kwargs):
+        self.sent.append((time.perf_counter(), kwargs))
+        return SimpleNamespace(message=SimpleNamespace(body=SimpleNamespace(mid=f"mid-{len(self.sent)}")))
+
+    async def edit_message(self, **kwargs):
+        self.edits.append((time.perf_counter(), kwargs))
+
+
+async def _bench_bot(stub: LMStub) -> dict:
+    router.OPENROUTER_URL = f"{stub.base_url}/chat/completions"
+    bot = FakeBot()
+    event = SimpleNamespace(
+        bot=bot,
+        message=SimpleNamespace(body=SimpleNamespace(text="Как лучше планировать задачи?")),
+        get_ids=lambda: (1, 1),
+    )
+    t0 = time.perf_counter()
+    await router.handle_ai_question(event, MemoryContext(1, 1))
+    done = time.perf_counter() - t0
+    await router.close_openrouter_session()
+
+    first_edit = bot.edits[0][0] - t0 if bot.edits else None
+    return {"first": first_edit, "done": done, "edits": len(bot.edits)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="задержка до первого токена")
+    parser.add_argument("--token-delay-ms", type=float, default=30.0)
+    parser.add_argument("--edit-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    router.AI_STREAM_EDIT_INTERVAL = args.edit_interval
+    stub = LMStub(latency_ms=args.latency_ms, token_delay_ms=args.token_delay_ms)
+    await stub.start()
+    try:
+        api = await _bench_sync_api(stub)
+        bot = await _bench_bot(stub)
+    finally:
+        await stub.stop()
+
+    print("sync_api /analyze_task:")
+    print(f"  полный ответ:            {api['full']:.3f} с")
+    print(f"  стрим, первая подзадача: {api['first']:.3f} с (весь план за {api['done']:.3f} с)")
+    print("бот, AI помощник:")
+    print(f"  первое редактирование:   {bot['first']:.3f} с (ответ целиком за {bot['done']:.3f} с, правок: {bot['edits']})")
+
+    slow = [name for name, value in (("sync_api", api["first"]), ("бот", bot["first"])) if value is None or value > GOAL_SECONDS]
+    if slow:
+        raise SystemExit(f"время до первого содержимого больше {GOAL_SECONDS} с: {', '.join(slow)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
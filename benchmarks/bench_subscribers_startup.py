@@ -0,0 +1,76 @@
+"""
+Время старта планировщика напоминаний с сохранённым реестром подписчиков.
+
+Записывает снимок на --users подписчиков (часть - с собственным поясом и
+временем) и журнал из --log-entries изменений, затем замеряет
+ReminderScheduler.load_subscribers() в новом планировщике.
+
+Запуск: python benchmarks/bench_subscribers_startup.py --users 10000 100000 1000000
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import time as dtime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+from scheduler import DEFAULT_REMINDER_TIME, DEFAULT_TIMEZONE, ReminderScheduler  # noqa: E402
+from subscribers import SubscriberRegistry  # noqa: E402
+
+ZONES = ["Europe/Kaliningrad", "Asia/Yekaterinburg", "Asia/Novosibirsk", "Asia/Vladivostok"]
+
+
+def _rows(users: int, rng: random.Random):
+    for chat_id in range(1, users + 1):
+        if rng.random() < 0.1:
+            yield chat_id, chat_id + 10**9, rng.choice(ZONES), dtime(rng.randrange(6, 11), rng.choice((0, 15, 30, 45)))
+        else:
+            yield chat_id, chat_id + 10**9, DEFAULT_TIMEZONE, DEFAULT_REMINDER_TIME
+
+
+def _bench(users: int, log_entries: int, directory: str) -> dict:
+    rng = random.Random(users)
+    path = os.path.join(directory, f"subscribers-{users}")
+    registry = SubscriberRegistry(path, compact_after=10**9)
+    registry.compact(_rows(users, rng))
+    for _ in range(log_entries):
+        chat_id = rng.randrange(1, users * 2)
+        if rng.random() < 0.2:
+            registry.remove(chat_id)
+        else:
+            registry.add(chat_id, None, rng.choice(ZONES), dtime(8, 30))
+    registry.close()
+    size = os.path.getsize(f"{path}.snap") + os.path.getsize(f"{path}.log")
+
+    scheduler = ReminderScheduler(None, registry=SubscriberRegistry(path, compact_after=10**9))
+    t0 = time.perf_counter()
+    loaded = scheduler.load_subscribers()
+    elapsed = time.perf_counter() - t0
+    return {"loaded": loaded, "seconds": elapsed, "bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--log-entries", type=int, default=10_000)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    print(f"{'подписчиков':>12} {'загружено':>10} {'на диске, МБ':>13} {'старт, с':>9} {'мкс/подп.':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for users in args.users:
+            result = _bench(users, args.log_entries, directory)
+            print(
+                f"{users:>12} {result['loaded']:>10} {result['bytes'] / 2**20:>13.1f} "
+                f"{result['seconds']:>9.2f} {result['seconds'] / result['loaded'] * 1e6:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Нагрузочный прогон API синхронизации: пропускная способность, задержки
+p50/p95/p99 и пиковая память процесса, результат - JSON для сравнения
+между коммитами.
+
+Приложение sync_api запускается в процессе (вместе с lifespan) и
+вызывается через ASGI-транспорт httpx, модель - локальная заглушка
+(benchmarks/lm_stub.py) с задержкой --lm-latency-ms, случайной добавкой
+до --lm-jitter-ms и долей ответов 503 --lm-error-rate. Сценарии идут по
+очереди, каждый - --requests запросов в --concurrency потоков:
+
+  sync:    POST /sync - снимок пользователя из --tasks задач (одна задача меняется)
+  get:     GET /sync/{userId} - полный снимок
+  analyze: POST /analyze_task - описания из --analyze-distinct вариантов
+           (0 - все разные, кэш не помогает)
+
+Пиковая память (ru_maxrss) - с начала процесса, включая заглушку LM.
+
+Запуск: python benchmarks/bench_sync_load.py --concurrency 32 --tasks 50 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+import httpx  # noqa: E402
+import sync_api  # noqa: E402
+from lm_stub import LMStub  # noqa: E402
+from storage import MemoryStorage, SQLiteStorage, WriteBehindStore  # noqa: E402
+
+SCENARIOS = ("sync", "get", "analyze")
+
+
+def _task(user_id: int, i: int, revision: int) -> dict:
+    return {
+        "id": f"load-{user_id}-{i}",
+        "title": f"Задача {i} пользователя {user_id}",
+        "deadline": "2026-12-31",
+        "subTasks": [
+            {"id": f"load-{user_id}-{i}-{j}", "title": f"Шаг {j}", "estimatedPomodoros": 2,
+             "completed": False, "completedPomodoros": 0}
+            for j in range(4)
+        ],
+        "createdAt": "2026-01-01T09:00:00Z",
+        "totalPomodoros": 8,
+        "completedPomodoros": revision % 8,
+    }
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def _peak_rss_mb() -> float:
+    # Linux отдаёт ru_maxrss в КБ, macOS - в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _request_factory(name: str, args):
+    """Функция, строящая i-й запрос сценария: (метод, путь, тело)"""
+    rng = random.Random(f"{name}-{args.seed}")
+    if name == "sync":
+        def make(i):
+            user_id = rng.randrange(args.users)
+            tasks = [_task(user_id, t, i if t == i % args.tasks else 0) for t in range(args.tasks)]
+            body = {"userId": user_id, "settings": {"reminderTime": "09:00"}, "tasks": tasks,
+                    "stats": {"totalSessions": i}}
+            return "POST", "/sync", body
+    elif name == "get":
+        def make(i):
+            return "GET", f"/sync/{rng.randrange(args.users)}", None
+    else:
+        def make(i):
+            n = rng.randrange(args.analyze_distinct) if args.analyze_distinct else i
+            body = {"userId": rng.randrange(args.users), "description": f"Подготовить отчёт номер {n}"}
+            return "POST", "/analyze_task", body
+    return make
+
+
+async def _scenario(client: httpx.AsyncClient, name: str, args) -> dict:
+    make = _request_factory(name, args)
+    requests = [make(i) for i in range(args.requests)]
+    latencies, statuses = [], Counter()
+    next_index = iter(range(len(requests)))
+
+    async def worker():
+        for i in next_index:
+            method, path, body = requests[i]
+            t0 = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    ok = statuses.get("200", 0)
+    return {
+        "requests": len(requests),
+        "ok": ok,
+        "statuses": dict(sorted(statuses.items())),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(requests) / elapsed, 1),
+        "ok_rps": round(ok / elapsed, 1),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        },
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+async def _run(args, tmp: str) -> tuple[dict, dict]:
+    """Результаты сценариев и счётчики заглушки LM"""
+    stub = LMStub(
+        latency_ms=args.lm_latency_ms, jitter_ms=args.lm_jitter_ms, error_rate=args.lm_error_rate, seed=args.seed,
+    )
+    await stub.start()
+    os.environ["LM_BASE_URL"] = stub.base_url
+
+    backend = SQLiteStorage(os.path.join(tmp, "sync.db")) if args.storage == "sqlite" else MemoryStorage()
+    sync_api.sync_storage = sync_api.user_store.storage = WriteBehindStore(backend)
+
+    results = {}
+    try:
+        async with sync_api.app.router.lifespan_context(sync_api.app):
+            transport = httpx.ASGITransport(app=sync_api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                for name in args.scenarios:
+                    results[name] = await _scenario(client, name, args)
+    finally:
+        await stub.stop()
+    return results, {"requests": stub.requests, "errors": stub.errors}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=2000, help="запросов в каждом сценарии")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--tasks", type=int, default=20, help="задач в снимке пользователя")
+    parser.add_argument("--analyze-distinct", type=int, default=0, help="разных описаний задач (0 - все разные)")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--lm-latency-ms", type=float, default=50)
+    parser.add_argument("--lm-jitter-ms", type=float, default=50)
+    parser.add_argument("--lm-error-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию только в stdout)")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp:
+        scenarios, lm = await _run(args, tmp)
+
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "scenarios": scenarios,
+        "lm_stub": lm,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
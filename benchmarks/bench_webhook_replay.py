@@ -0,0 +1,170 @@
+"""
+Локальный прогон обновлений: задержка от появления обновления в MAX до
+вызова обработчика при long polling и через вебхук.
+
+Генерируется --updates обновлений message_created по --chats чатам с
+пуассоновским потоком --rate обновлений в секунду. Сеть до MAX
+имитируется задержкой --rtt (туда и обратно), обработчик - ожиданием
+--handler-ms (запросы к API). Диспетчер и роутеры - настоящие из maxapi.
+
+  polling: фейковый GET /updates - long polling, отдаёт всё накопленное
+           (до 100 обновлений), как только оно появилось; диспетчер
+           обрабатывает пачку по очереди, как в dp.start_polling.
+  webhook: каждое обновление приходит POST-запросом в WebhookReceiver
+           (через ASGI в том же процессе) через rtt/2 после появления.
+
+Запуск: python benchmarks/bench_webhook_replay.py --updates 2000 --rate 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from maxapi import Bot, Dispatcher, Router  # noqa: E402
+from maxapi.types import MessageCreated  # noqa: E402
+
+from webhook import SECRET_HEADER, WebhookReceiver  # noqa: E402
+
+SECRET = "replay-secret"
+
+
+def _update(chat_id: int, seq: int, created_at: float) -> dict:
+    return {
+        "update_type": "message_created",
+        "timestamp": int(time.time() * 1000),
+        "message": {
+            "sender": {"user_id": chat_id, "first_name": "Тест", "is_bot": False, "last_activity_time": 0},
+            "recipient": {"chat_id": chat_id, "chat_type": "dialog"},
+            "timestamp": int(time.time() * 1000),
+            "body": {"mid": f"mid-{chat_id}-{seq}", "seq": seq, "text": repr(created_at)},
+        },
+    }
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def _setup(args, latencies: list, done: asyncio.Event):
+    async def get_me():
+        return type("Me", (), {"username": "replay_bot", "first_name": "Replay", "user_id": 1})()
+
+    bot = Bot("replay", auto_requests=False, auto_check_subscriptions=False)
+    bot.get_me = get_me
+    router = Router()
+
+    @router.message_created()
+    async def handler(event: MessageCreated):
+        latencies.append(time.perf_counter() - float(event.message.body.text))
+        await asyncio.sleep(args.handler_ms / 1000)
+        if len(latencies) == args.updates:
+            done.set()
+
+    dp = Dispatcher()
+    dp.include_routers(router)
+    return dp, bot
+
+
+async def _produce(args, deliver) -> None:
+    """Выпускать обновления пуассоновским потоком; deliver(update) - как оно попадает к боту"""
+    rng = random.Random(1)
+    for seq in range(args.updates):
+        await asyncio.sleep(rng.expovariate(args.rate))
+        deliver(_update(rng.randrange(args.chats), seq, time.perf_counter()))
+
+
+async def _polling(args) -> list:
+    latencies, done = [], asyncio.Event()
+    dp, bot = _setup(args, latencies, done)
+    pending, arrived = [], asyncio.Event()
+
+    def deliver(update):
+        pending.append(update)
+        arrived.set()
+
+    async def get_updates(marker=None, **kwargs):
+        await asyncio.sleep(args.rtt / 2)
+        if not pending:
+            arrived.clear()
+            try:
+                await asyncio.wait_for(arrived.wait(), 30)
+            except asyncio.TimeoutError:
+                pass
+        batch = pending[:100]
+        del pending[:100]
+        await asyncio.sleep(args.rtt / 2)
+        return {"updates": batch, "marker": (marker or 0) + len(batch)}
+
+    bot.get_updates = get_updates
+    polling = asyncio.create_task(dp.start_polling(bot))
+    await _produce(args, deliver)
+    await done.wait()
+    dp.polling = False
+    polling.cancel()
+    return latencies
+
+
+async def _webhook(args) -> list:
+    latencies, done = [], asyncio.Event()
+    dp, bot = _setup(args, latencies, done)
+    receiver = WebhookReceiver(dp, bot, secret=SECRET, workers=args.workers)
+    app = FastAPI()
+    receiver.mount(app)
+    await receiver.start()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bot")
+    posts = set()
+
+    async def post(update):
+        await asyncio.sleep(args.rtt / 2)
+        body = json.dumps(update)
+        response = await client.post("/webhook", content=body, headers={SECRET_HEADER: SECRET})
+        response.raise_for_status()
+
+    def deliver(update):
+        task = asyncio.create_task(post(update))
+        posts.add(task)
+        task.add_done_callback(posts.discard)
+
+    await _produce(args, deliver)
+    await done.wait()
+    await receiver.stop()
+    await client.aclose()
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50, help="обновлений в секунду")
+    parser.add_argument("--rtt", type=float, default=0.05, help="время туда и обратно до MAX, с")
+    parser.add_argument("--handler-ms", type=float, default=20, help="время работы обработчика, мс")
+    parser.add_argument("--workers", type=int, default=8, help="обработчиков вебхука")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    print(
+        f"обновлений {args.updates}, {args.rate:g}/с, чатов {args.chats}, "
+        f"rtt {args.rtt * 1000:.0f} мс, обработчик {args.handler_ms:g} мс"
+    )
+    for name, run in (("polling", _polling), ("webhook", _webhook)):
+        latencies = await run(args)
+        print(
+            f"  {name:<8} до обработчика: p50 {_percentile(latencies, 0.5) * 1000:7.1f} мс, "
+            f"p99 {_percentile(latencies, 0.99) * 1000:7.1f} мс, max {max(latencies) * 1000:7.1f} мс"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
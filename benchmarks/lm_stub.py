@@ -0,0 +1,145 @@
+"""
+Локальная заглушка OpenAI-совместимого LM сервера (/v1/models и
+/v1/chat/completions, в том числе со stream: true) для бенчмарков.
+Считает запросы и TCP-соединения, чтобы было видно, переиспользуются
+ли keep-alive соединения. Задержку ответа можно сделать случайной
+(latency_ms + от 0 до jitter_ms), а долю ответов - ошибками 503.
+
+Запуск отдельно: python benchmarks/lm_stub.py --port 1234 --latency-ms 200
+"""
+import argparse
+import asyncio
+import json
+import random
+from typing import Optional, Set, Tuple
+
+from aiohttp import web
+
+DEFAULT_CONTENT = json.dumps(
+    {
+        "subTasks": [
+            {"title": "Собрать материалы", "estimatedPomodoros": 2},
+            {"title": "Составить план", "estimatedPomodoros": 1},
+            {"title": "Основная работа", "estimatedPomodoros": 4},
+            {"title": "Проверка и итоги", "estimatedPomodoros": 1},
+        ]
+    },
+    ensure_ascii=False,
+)
+
+
+class LMStub:
+    """Заглушка LM сервера с настраиваемой задержкой ответа и долей ошибок"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        content: str = DEFAULT_CONTENT,
+        token_delay_ms: float = 0.0,
+        token_chars: int = 4,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.errors = 0
+        self.content = content
+        self.token_delay = token_delay_ms / 1000
+        self.token_chars = token_chars
+        self.requests = 0
+        self.connections: Set[Tuple] = set()
+        self.port: Optional[int] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def _track(self, request: web.Request) -> None:
+        self.requests += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+
+    async def models(self, request: web.Request) -> web.Response:
+        self._track(request)
+        return web.json_response({"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self._track(request)
+        body = await request.json()
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response(
+                {"error": {"message": "stub overloaded", "type": "server_error"}}, status=503
+            )
+        if body.get("stream"):
+            return await self._stream(request)
+        if self.token_delay:
+            # без стриминга клиент ждёт генерации всех токенов
+            tokens = -(-len(self.content) // self.token_chars)
+            await asyncio.sleep(self.token_delay * tokens)
+        return web.json_response(
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.content}}],
+            }
+        )
+
+    async def _stream(self, request: web.Request) -> web.StreamResponse:
+        """Ответ в формате SSE: content кусками по token_chars символов"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(0, len(self.content), self.token_chars):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": self.content[i:i + self.token_chars]}}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self, port: int = 0) -> None:
+        app = web.Application()
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _serve(args) -> None:
+    stub = LMStub(
+        latency_ms=args.latency_ms,
+        token_delay_ms=args.token_delay_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+    )
+    await stub.start(args.port)
+    print(f"LM заглушка слушает {stub.base_url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-delay-ms", type=float, default=0.0, help="задержка на каждый кусок ответа")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="случайная добавка к задержке, от 0 до")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    asyncio.run(_serve(parser.parse_args()))
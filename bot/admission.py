@@ -0,0 +1,181 @@
+"""
+Контроль допуска запросов к локальной модели.
+
+Не больше concurrency запросов выполняются одновременно, остальные ждут
+в ограниченной очереди с приоритетами (интерактивные раньше фоновых).
+Когда очередь полна, запрос сразу отклоняется с оценкой, через сколько
+повторить; запрос, чей дедлайн истёк в очереди, выбрасывается, не дойдя
+до модели.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+from typing import Any, Awaitable, Callable, List, Optional
+
+import metrics
+
+WAIT_SECONDS = metrics.histogram(
+    "focus_lm_queue_wait_seconds", "Ожидание слота в очереди к LM у допущенных запросов, с",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 45.0),
+)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class QueueFull(Exception):
+    """Очередь заполнена; retry_after - рекомендуемая пауза в секундах"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Очередь к модели заполнена, повторите через {retry_after} с")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Дедлайн запроса истёк до или во время выполнения"""
+
+
+class AdmissionQueue:
+    """
+    Очередь допуска с ограничением параллелизма.
+
+    Args:
+        concurrency: сколько запросов выполняются одновременно
+        max_queue: сколько запросов могут ждать; сверх этого - QueueFull
+        default_timeout: дедлайн запроса по умолчанию, с (ожидание + выполнение)
+    """
+
+    def __init__(self, concurrency: int = 2, max_queue: int = 32, default_timeout: float = 45.0):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self._active = 0
+        self._waiters: List[list] = []
+        # живые ожидающие: в куче остаются и отменённые записи, поэтому глубина считается отдельно
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._service_time = 5.0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._waiting
+
+    def retry_after(self) -> int:
+        """Оценка, через сколько секунд в очереди освободится место"""
+        ahead = self.depth + 1
+        return max(1, math.ceil(self._service_time * ahead / self.concurrency))
+
+    def deadline_for(self, timeout: Optional[float]) -> float:
+        loop = asyncio.get_running_loop()
+        return loop.time() + (timeout if timeout is not None else self.default_timeout)
+
+    async def acquire(self, priority: int = INTERACTIVE, deadline: Optional[float] = None) -> None:
+        """Занять слот выполнения. QueueFull, если очередь полна; DeadlineExceeded, если не дождались"""
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            deadline = self.deadline_for(None)
+        started = loop.time()
+
+        if self._active < self.concurrency and not self.depth:
+            self._active += 1
+        else:
+            if self.depth >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(self.retry_after())
+
+            future = loop.create_future()
+            entry = [priority, next(self._seq), future, deadline]
+            heapq.heappush(self._waiters, entry)
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout=max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                if not future.done():
+                    future.cancel()
+                    self._waiting -= 1
+                    self.expired += 1
+                    raise DeadlineExceeded("Дедлайн истёк в очереди к модели") from None
+                # слот выдан одновременно с таймаутом - пользуемся им
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                    self._waiting -= 1
+                elif not future.cancelled() and future.exception() is None:
+                    self.release()
+                raise
+            if future.exception() is not None:
+                raise future.exception()
+
+        waited = loop.time() - started
+        self.admitted += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        WAIT_SECONDS.observe(waited)
+
+    def release(self) -> None:
+        """Освободить слот: передать его следующему живому ожидающему или вернуть в пул"""
+        now = asyncio.get_running_loop().time()
+        while self._waiters:
+            _, _, future, deadline = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._waiting -= 1
+            if deadline <= now:
+                # клиент уже не ждёт ответа - не тратим на него модель
+                self.expired += 1
+                future.set_exception(DeadlineExceeded("Дедлайн истёк в очереди к модели"))
+                continue
+            future.set_result(None)
+            return
+        self._active -= 1
+
+    async def run(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        priority: int = INTERACTIVE,
+        deadline: Optional[float] = None,
+    ) -> Any:
+        """Выполнить factory() в слоте; выполнение прерывается по дедлайну"""
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            deadline = self.deadline_for(None)
+        await self.acquire(priority, deadline)
+        started = loop.time()
+        try:
+            return await asyncio.wait_for(factory(), timeout=max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Дедлайн истёк во время запроса к модели") from None
+        finally:
+            # скользящее среднее времени обслуживания для оценки Retry-After
+            self._service_time = 0.8 * self._service_time + 0.2 * (loop.time() - started)
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "depth": self.depth,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "wait_time_avg": self.wait_time_total / self.admitted if self.admitted else 0.0,
+            "wait_time_max": self.wait_time_max,
+            "service_time_avg": self._service_time,
+        }
+
+
+def create_queue_from_env() -> AdmissionQueue:
+    """Очередь по переменным окружения: LM_CONCURRENCY, LM_QUEUE_SIZE, LM_QUEUE_TIMEOUT"""
+    return AdmissionQueue(
+        concurrency=int(os.getenv("LM_CONCURRENCY", 2)),
+        max_queue=int(os.getenv("LM_QUEUE_SIZE", 32)),
+        default_timeout=float(os.getenv("LM_QUEUE_TIMEOUT", 45.0)),
+    )
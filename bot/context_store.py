@@ -0,0 +1,376 @@
+"""
+Постоянное хранилище контекстов диалогов (FSM) вместо MemoryContext.
+
+Контекст пользователя в чате - состояние FSM и данные диалога (например,
+черновик плана) - с тем же интерфейсом, что у maxapi.MemoryContext.
+Контексты живут в памяти (горячий слой, LRU по чистым записям), изменённые
+сбрасываются в SQLite пачками в фоне (write-behind), поэтому переживают
+перезапуск, а обработчик не ждёт диска. Контекст, который не менялся ttl
+секунд (брошенный диалог), считается пустым и удаляется из базы.
+
+Диспетчер получает контексты из хранилища через ContextDispatcher, тот же
+контекст вне обработчика - через ContextDispatcher.get_context().
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple, Type, Union
+
+from maxapi import Dispatcher
+from maxapi.context import State, StatesGroup
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+ContextKey = Tuple[int, int]
+# chat_id, user_id, состояние, данные (JSON), истекает в (время Unix)
+ContextRow = Tuple[int, int, Optional[str], str, float]
+
+
+class ContextBackend:
+    """Постоянное хранилище строк контекстов"""
+
+    def read(self, key: ContextKey) -> Optional[Tuple[Optional[str], str, float]]:
+        raise NotImplementedError
+
+    def write_many(self, rows: Iterable[ContextRow]) -> None:
+        """Записать пачку контекстов одной транзакцией"""
+        raise NotImplementedError
+
+    def purge(self, now: float) -> int:
+        """Удалить истёкшие контексты; возвращает их число"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryContextBackend(ContextBackend):
+    """Контексты в памяти процесса (для тестов и локальной разработки)"""
+
+    def __init__(self):
+        self._rows: Dict[ContextKey, Tuple[Optional[str], str, float]] = {}
+
+    def read(self, key: ContextKey):
+        return self._rows.get(key)
+
+    def write_many(self, rows: Iterable[ContextRow]) -> None:
+        for chat_id, user_id, state, data, expires_at in rows:
+            self._rows[(chat_id, user_id)] = (state, data, expires_at)
+
+    def purge(self, now: float) -> int:
+        expired = [key for key, row in self._rows.items() if row[2] <= now]
+        for key in expired:
+            del self._rows[key]
+        return len(expired)
+
+
+class SQLiteContextBackend(ContextBackend):
+    """Контексты в SQLite в режиме WAL"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS contexts ("
+            "chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL, state TEXT, data TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, PRIMARY KEY (chat_id, user_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS contexts_expires_at ON contexts (expires_at)")
+
+    def read(self, key: ContextKey):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT state, data, expires_at FROM contexts WHERE chat_id = ? AND user_id = ?", key
+            ).fetchone()
+
+    def write_many(self, rows: Iterable[ContextRow]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO contexts (chat_id, user_id, state, data, expires_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(chat_id, user_id) DO UPDATE SET "
+                    "state = excluded.state, data = excluded.data, expires_at = excluded.expires_at",
+                    rows,
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def purge(self, now: float) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM contexts WHERE expires_at <= ?", (now,)).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class StoredContext:
+    """
+    Контекст пользователя в чате с интерфейсом MemoryContext.
+
+    Данные должны сериализоваться в JSON. Как и у MemoryContext, get_data()
+    возвращает сам словарь; изменения на месте сохраняются при следующем
+    set_data/update_data/set_state.
+    """
+
+    __slots__ = ("chat_id", "user_id", "_store", "_context", "_state", "_lock", "expires_at")
+
+    def __init__(
+        self,
+        store: "ContextStore",
+        chat_id: int,
+        user_id: int,
+        data: Optional[Dict[str, Any]] = None,
+        state: Union[State, str, None] = None,
+        expires_at: float = 0.0,
+    ):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self._store = store
+        self._context: Dict[str, Any] = data if data is not None else {}
+        self._state = state
+        self._lock = asyncio.Lock()
+        self.expires_at = expires_at
+
+    async def get_data(self) -> Dict[str, Any]:
+        async with self._lock:
+            return self._context
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        async with self._lock:
+            self._context = data
+            self._store.changed(self)
+
+    async def update_data(self, **kwargs: Any) -> None:
+        async with self._lock:
+            self._context.update(kwargs)
+            self._store.changed(self)
+
+    async def set_state(self, state: Union[State, str, None] = None) -> None:
+        async with self._lock:
+            self._state = state
+            self._store.changed(self)
+
+    async def get_state(self) -> Union[State, str, None]:
+        async with self._lock:
+            return self._state
+
+    async def clear(self) -> None:
+        async with self._lock:
+            self._state = None
+            self._context = {}
+            self._store.changed(self)
+
+
+class ContextStore:
+    """
+    Контексты диалогов: горячий слой в памяти поверх ContextBackend с отложенной записью.
+
+    Изменённые контексты лежат отдельно от LRU до записи, поэтому вытеснение
+    никогда не теряет изменений и не перебирает несохранённые записи.
+
+    Args:
+        backend: постоянное хранилище
+        states: группы состояний FSM - по имени из базы восстанавливается тот же
+            объект State, с которым сравнивает диспетчер
+        ttl: через сколько секунд без изменений контекст считается брошенным
+        flush_interval_ms: как часто сбрасывать изменённые контексты
+        max_cached: сколько сохранённых контекстов держать в памяти
+    """
+
+    def __init__(
+        self,
+        backend: ContextBackend,
+        states: Iterable[Type[StatesGroup]] = (),
+        ttl: float = 86400.0,
+        flush_interval_ms: int = 1000,
+        max_cached: int = 10000,
+    ):
+        self.backend = backend
+        self.states: Dict[str, State] = {
+            str(state): state
+            for group in states
+            for state in vars(group).values()
+            if isinstance(state, State)
+        }
+        self.ttl = ttl
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[ContextKey, StoredContext]" = OrderedDict()
+        self._dirty: Dict[ContextKey, StoredContext] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._cache) + len(self._dirty)
+
+    def get(self, chat_id: int, user_id: int) -> StoredContext:
+        """Контекст пользователя в чате: из памяти, из базы или новый пустой"""
+        key = (chat_id, user_id)
+        context = self._dirty.get(key)
+        if context is not None:
+            return context
+
+        now = time.time()
+        context = self._cache.get(key)
+        if context is not None:
+            if context.expires_at > now:
+                self._cache.move_to_end(key)
+                return context
+            del self._cache[key]
+
+        context = self._load(key, now) or StoredContext(self, chat_id, user_id, expires_at=now + self.ttl)
+        self._cache[key] = context
+        self._evict()
+        return context
+
+    def _load(self, key: ContextKey, now: float) -> Optional[StoredContext]:
+        row = self.backend.read(key)
+        if row is None:
+            return None
+        state_name, data, expires_at = row
+        if expires_at <= now:
+            return None
+        state = self.states.get(state_name, state_name) if state_name is not None else None
+        return StoredContext(self, key[0], key[1], json.loads(data), state, expires_at)
+
+    def changed(self, context: StoredContext) -> None:
+        """Контекст изменился: продлить срок жизни и пометить для записи"""
+        key = (context.chat_id, context.user_id)
+        context.expires_at = time.time() + self.ttl
+        # контекст мог быть вытеснен, пока его держал обработчик - тогда он вернётся в память
+        self._cache.pop(key, None)
+        self._dirty[key] = context
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def _evict(self) -> None:
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def _row(self, context: StoredContext) -> Optional[ContextRow]:
+        state = context._state
+        try:
+            data = json.dumps(context._context, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Контекст {context.chat_id}/{context.user_id} не сериализуется в JSON: {e}")
+            return None
+        return (context.chat_id, context.user_id, None if state is None else str(state), data, context.expires_at)
+
+    async def flush(self) -> int:
+        """Сбросить все изменённые контексты одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, {}
+            rows = [row for row in map(self._row, dirty.values()) if row]
+            try:
+                await asyncio.to_thread(self.backend.write_many, rows)
+            except Exception:
+                # изменённые за время записи новее - их не трогаем
+                for key, context in dirty.items():
+                    self._dirty.setdefault(key, context)
+                raise
+            for key, context in dirty.items():
+                if key not in self._dirty:
+                    self._cache[key] = context
+            self._evict()
+            return len(rows)
+
+    async def purge(self) -> int:
+        """Удалить брошенные контексты из памяти и из базы"""
+        now = time.time()
+        expired = [key for key, context in self._cache.items() if context.expires_at <= now]
+        for key in expired:
+            del self._cache[key]
+        return await asyncio.to_thread(self.backend.purge, now)
+
+    async def _flush_loop(self) -> None:
+        purge_every = max(1, int(60 / self.flush_interval))
+        ticks = 0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            ticks += 1
+            try:
+                await self.flush()
+                if ticks % purge_every == 0:
+                    await self.purge()
+            except Exception as e:
+                logger.error(f"Ошибка записи контекстов: {e}", exc_info=True)
+
+    def start(self) -> None:
+        """Запустить фоновую запись"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Остановить фоновую запись, сбросить остаток и закрыть хранилище"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self.backend.close()
+
+
+class ContextDispatcher(Dispatcher):
+    """Dispatcher, который берёт контексты из ContextStore вместо списка MemoryContext"""
+
+    def __init__(self, context_store: ContextStore, **kwargs: Any):
+        # без метода в базовом классе подмена ниже молча перестанет работать и контексты
+        # уйдут в память maxapi; версия maxapi закреплена в requirements.txt
+        if not hasattr(Dispatcher, "_Dispatcher__get_memory_context"):
+            raise RuntimeError("В этой версии maxapi нет Dispatcher.__get_memory_context: контексты не будут сохраняться")
+        super().__init__(**kwargs)
+        self.context_store = context_store
+
+    # Dispatcher.handle вызывает self.__get_memory_context - подменяем его под искажённым именем
+    def _Dispatcher__get_memory_context(self, chat_id: int, user_id: int) -> StoredContext:
+        started = time.perf_counter()
+        context = self.context_store.get(chat_id, user_id)
+        tracing.note_context_load(chat_id, user_id, time.perf_counter() - started)
+        return context
+
+    def get_context(self, chat_id: int, user_id: int) -> StoredContext:
+        """Контекст пользователя вне обработчика (тот же, что получит обработчик)"""
+        return self.context_store.get(chat_id, user_id)
+
+
+def create_context_store_from_env(states: Iterable[Type[StatesGroup]] = ()) -> ContextStore:
+    """
+    Хранилище контекстов по переменным окружения: CONTEXT_STORAGE (sqlite | memory),
+    CONTEXT_DB_PATH, CONTEXT_TTL, CONTEXT_FLUSH_MS, CONTEXT_CACHE_SIZE
+    """
+    kind = os.getenv("CONTEXT_STORAGE", "sqlite").lower()
+    if kind == "memory":
+        backend: ContextBackend = MemoryContextBackend()
+    elif kind == "sqlite":
+        backend = SQLiteContextBackend(os.getenv("CONTEXT_DB_PATH", "contexts.db"))
+    else:
+        raise ValueError(f"Неизвестный тип хранилища CONTEXT_STORAGE={kind}")
+
+    return ContextStore(
+        backend,
+        states=states,
+        ttl=float(os.getenv("CONTEXT_TTL", 86400)),
+        flush_interval_ms=int(os.getenv("CONTEXT_FLUSH_MS", 1000)),
+        max_cached=int(os.getenv("CONTEXT_CACHE_SIZE", 10000)),
+    )
@@ -0,0 +1,233 @@
+"""
+Массовая рассылка сообщений через MAX API.
+
+Сообщения отправляет ограниченный пул параллельных отправителей; общий
+темп ограничен корзиной токенов (квота MAX API на запросы бота). Ответы
+429 и 5xx, а также обрывы соединения повторяются с экспоненциальной
+паузой; пользователи, запретившие боту писать (chat.denied), отдаются
+колбэку on_denied, чтобы их можно было исключить из рассылок.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from maxapi.exceptions.max import MaxConnection
+from maxapi.types.errors import Error
+
+logger = logging.getLogger(__name__)
+
+DENIED_CODES = {"chat.denied", "chat.not.found", "user.blocked"}
+
+
+class TokenBucket:
+    """
+    Корзина токенов: в среднем rate операций в секунду, всплеск до burst.
+
+    Токены резервируются сразу (баланс может уйти в минус), а вызывающий
+    ждёт, пока его токен «накопится», - так ожидающие обслуживаются по
+    порядку без отдельной блокировки.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._updated: Optional[float] = None
+
+    async def acquire(self) -> None:
+        now = asyncio.get_running_loop().time()
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+    def full(self) -> bool:
+        """Корзина восстановилась до burst (ею давно не пользовались)"""
+        if self._updated is None:
+            return True
+        idle = asyncio.get_running_loop().time() - self._updated
+        return self._tokens + idle * self.rate >= self.burst
+
+
+class FanoutReport:
+    """Итоги рассылки: сколько отправлено, не доставлено, исключено и за какое время"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.denied = 0
+        self.retries = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._started = time.perf_counter()
+        self.duration = 0.0
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.denied
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def finish(self) -> None:
+        self.finished_at = time.time()
+        self.duration = self.elapsed()
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "denied": self.denied,
+            "retries": self.retries,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": self.duration,
+        }
+
+    def __str__(self) -> str:
+        return (
+            f"{self.done}/{self.total}: отправлено {self.sent}, ошибок {self.failed}, "
+            f"исключено {self.denied}, повторов {self.retries}, за {self.elapsed():.1f} с"
+        )
+
+
+def error_code(result: Any) -> Optional[str]:
+    raw = getattr(result, "raw", None)
+    if isinstance(raw, dict):
+        return raw.get("code")
+    return None
+
+
+def is_retryable(result: Any) -> bool:
+    return isinstance(result, Error) and (result.code == 429 or result.code >= 500)
+
+
+def is_denied(result: Any) -> bool:
+    return isinstance(result, Error) and (error_code(result) in DENIED_CODES or result.code == 403)
+
+
+class Fanout:
+    """
+    Рассылка send(chat_id) по списку чатов.
+
+    Args:
+        concurrency: сколько отправок идут одновременно
+        rate: не больше rate отправок в секунду (включая повторы)
+        burst: размер всплеска корзины токенов (по умолчанию rate)
+        max_retries: сколько раз повторять при 429/5xx/обрыве соединения
+        backoff: начальная пауза перед повтором, с (удваивается, максимум max_backoff)
+        progress_interval: как часто писать прогресс в лог, с
+        bucket: общая корзина токенов (например, очереди исходящих сообщений);
+            по умолчанию у каждой рассылки своя корзина на rate/burst
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 20,
+        rate: float = 30.0,
+        burst: Optional[float] = None,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        progress_interval: float = 10.0,
+        bucket: Optional[TokenBucket] = None,
+    ):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.progress_interval = progress_interval
+        self.bucket = bucket
+
+    async def run(
+        self,
+        chat_ids: Iterable[int],
+        send: Callable[[int], Awaitable[Any]],
+        on_denied: Optional[Callable[[int], None]] = None,
+        report: Optional[FanoutReport] = None,
+    ) -> FanoutReport:
+        """Разослать всем chat_ids и вернуть итоги; report можно передать, чтобы следить за прогрессом"""
+        chat_ids = list(chat_ids)
+        if report is None:
+            report = FanoutReport(len(chat_ids))
+        bucket = self.bucket if self.bucket is not None else TokenBucket(self.rate, self.burst)
+        pending = iter(chat_ids)
+
+        async def worker():
+            for chat_id in pending:
+                await self._deliver(chat_id, send, bucket, report, on_denied)
+
+        progress = asyncio.create_task(self._log_progress(report))
+        try:
+            workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(chat_ids)))]
+            await asyncio.gather(*workers)
+        finally:
+            progress.cancel()
+        report.finish()
+        logger.info(f"Рассылка завершена: {report}")
+        return report
+
+    async def _deliver(self, chat_id, send, bucket, report, on_denied) -> None:
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            try:
+                result = await send(chat_id)
+            except MaxConnection as e:
+                result = e
+            except Exception as e:
+                logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+                report.failed += 1
+                return
+
+            if is_denied(result):
+                report.denied += 1
+                logger.info(f"Чат {chat_id} недоступен ({error_code(result) or result.code}), исключаем из рассылки")
+                if on_denied:
+                    on_denied(chat_id)
+                return
+            if not (is_retryable(result) or isinstance(result, MaxConnection)):
+                if isinstance(result, Error):
+                    logger.warning(f"Сообщение в чат {chat_id} не доставлено: {result.code} {result.raw}")
+                    report.failed += 1
+                else:
+                    report.sent += 1
+                return
+
+            if attempt < self.max_retries:
+                report.retries += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                # случайная добавка, чтобы повторы не приходили в API одной пачкой
+                await asyncio.sleep(delay * (1 + random.random() / 2))
+
+        logger.warning(f"Сообщение в чат {chat_id} не доставлено после {self.max_retries} повторов: {result}")
+        report.failed += 1
+
+    async def _log_progress(self, report: FanoutReport) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            logger.info(f"Рассылка: {report}")
+
+
+def create_fanout_from_env(bucket: Optional[TokenBucket] = None) -> Fanout:
+    """
+    Рассылка по переменным окружения: REMINDER_CONCURRENCY, REMINDER_RATE,
+    REMINDER_BURST, REMINDER_MAX_RETRIES; bucket - общая корзина вместо
+    REMINDER_RATE/REMINDER_BURST
+    """
+    burst = os.getenv("REMINDER_BURST")
+    return Fanout(
+        concurrency=int(os.getenv("REMINDER_CONCURRENCY", 20)),
+        rate=float(os.getenv("REMINDER_RATE", 30)),
+        burst=float(burst) if burst else None,
+        max_retries=int(os.getenv("REMINDER_MAX_RETRIES", 3)),
+        bucket=bucket,
+    )
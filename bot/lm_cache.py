@@ -0,0 +1,157 @@
+"""
+Кэш результатов разбора задач моделью с объединением одинаковых запросов.
+
+Одинаковые описания задач (после нормализации) с одинаковым дедлайном
+обслуживаются из кэша; если такой же запрос уже выполняется, новые
+запросы ждут его результат, а не идут в модель повторно.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,!?;:«»\"'()-"
+
+
+def normalize_key(description: str, deadline: Optional[str]) -> str:
+    """Ключ кэша: описание без регистра, лишних пробелов и пунктуации по краям, плюс дедлайн"""
+    desc = _SPACES.sub(" ", description.casefold().replace("ё", "е")).strip(_EDGE_PUNCTUATION)
+    dl = _SPACES.sub(" ", (deadline or "").casefold()).strip()
+    return f"{desc}\x1f{dl}"
+
+
+class AnalyzeCache:
+    """
+    LRU-кэш с TTL и объединением одновременных запросов (single-flight).
+
+    Args:
+        maxsize: максимальное число записей
+        ttl: время жизни записи в секундах
+        path: файл для сохранения кэша между перезапусками (опционально)
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 3600.0, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def lookup(self, key: str) -> Optional[Any]:
+        """get с учётом в счётчиках попаданий и промахов"""
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        should_store: Callable[[Any], bool] = lambda value: True,
+    ) -> Any:
+        """Вернуть значение из кэша, дождаться уже идущего вычисления или запустить новое"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t, should_store))
+
+        # shield: отмена одного ожидающего клиента не отменяет запрос к модели для остальных
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task, should_store: Callable[[Any], bool]) -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        value = task.result()
+        if should_store(value):
+            self.put(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+    def load(self) -> None:
+        """Загрузить сохранённый кэш с диска, пропуская истёкшие записи"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                rows = json.load(f)
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить кэш анализа задач из {self.path}: {e}")
+            return
+        now = time.time()
+        for key, expires_at, value in rows:
+            if expires_at > now:
+                self._entries[key] = (expires_at, value)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        logger.info(f"Загружено {len(self._entries)} записей кэша анализа задач")
+
+    def save(self) -> None:
+        """Сохранить кэш на диск (атомарно, через временный файл)"""
+        if not self.path:
+            return
+        rows = [[key, expires_at, value] for key, (expires_at, value) in self._entries.items()]
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить кэш анализа задач в {self.path}: {e}")
+
+
+def create_cache_from_env() -> AnalyzeCache:
+    """Кэш по переменным окружения: ANALYZE_CACHE_SIZE, ANALYZE_CACHE_TTL, ANALYZE_CACHE_PATH"""
+    return AnalyzeCache(
+        maxsize=int(os.getenv("ANALYZE_CACHE_SIZE", 1000)),
+        ttl=float(os.getenv("ANALYZE_CACHE_TTL", 24 * 3600)),
+        path=os.getenv("ANALYZE_CACHE_PATH") or None,
+    )
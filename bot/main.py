@@ -1,45 +1,184 @@
+"""
+Бот и API синхронизации в одном процессе.
+
+Диспетчер бота и приложение sync_api работают на одном цикле asyncio и
+делят одно хранилище данных пользователей (sync_api.user_store): задачи
+и статистика, сохранённые в боте, сразу видны webapp, а синхронизация из
+webapp сразу обновляет индекс напоминаний - без лишнего ввода-вывода.
+Бот запускается и останавливается вместе с приложением (хуки lifespan
+sync_api), в режиме вебхука его эндпоинт подключается к тому же
+приложению.
+"""
 import asyncio
 import logging
 import os
+import uvicorn
 from dotenv import load_dotenv
-from maxapi import Bot, Dispatcher
+from maxapi import Bot
 from maxapi.types import BotStarted
 
-import router
-from scheduler import ReminderScheduler
-
+# переменные окружения нужны модулям ниже уже при импорте
 load_dotenv()
 
+import metrics  # noqa: E402
+import router  # noqa: E402
+import sync_api  # noqa: E402
+from context_store import ContextDispatcher, create_context_store_from_env  # noqa: E402
+from fanout import create_fanout_from_env  # noqa: E402
+from outbox import create_outbox_from_env  # noqa: E402
+from scheduler import ReminderScheduler  # noqa: E402
+from states import UserStates  # noqa: E402
+from pomodoro import create_pomodoro_from_env  # noqa: E402
+from subscribers import create_registry_from_env  # noqa: E402
+from tracing import create_tracer_from_env  # noqa: E402
+from webhook import create_receiver_from_env  # noqa: E402
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 bot = Bot(os.getenv('BOT_TOKEN'))
-dp = Dispatcher()
+# состояния FSM и черновики диалогов переживают перезапуск бота
+context_store = create_context_store_from_env(states=[UserStates])
+dp = ContextDispatcher(context_store)
 dp.include_routers(router.router)
+# время обработки обновлений по этапам, медленные - в лог с разбивкой
+tracer = create_tracer_from_env()
+tracer.install(dp, [router.router])
+# строку maxapi «Обработано» на каждое обновление заменяет выборочный лог трассировки (UPDATE_LOG_EVERY)
+logging.getLogger("dispatcher").setLevel(os.getenv("DISPATCHER_LOG_LEVEL", "WARNING"))
+sync_api.app.add_api_route("/bot/slow_updates", tracer.slow_traces, methods=["GET"], include_in_schema=False)
+
+user_store = sync_api.user_store
+router.set_user_store(user_store)
+
+async def load_user_tasks(chat_id: int):
+    """Задачи пользователя из общего хранилища - для промахов индекса напоминаний"""
+    user_id = scheduler.user_by_chat.get(chat_id)
+    if user_id is None:
+        # chat_id - не id пользователя: без известной связи задач у чата нет
+        return []
+    return user_store.tasks(user_id)
 
-scheduler = ReminderScheduler(bot)
+# все ответы бота идут через очередь; рассылка напоминаний берёт токены из той же общей корзины
+outbox = create_outbox_from_env()
+router.set_outbox(outbox)
+
+scheduler = ReminderScheduler(
+    bot,
+    fanout=create_fanout_from_env(bucket=outbox.bucket),
+    task_loader=load_user_tasks,
+    registry=create_registry_from_env(),
+)
 router.set_scheduler(scheduler)
+# синхронизация из webapp и сохранение задач в боте сразу обновляют индекс напоминаний
+user_store.listeners.append(scheduler.on_sync)
+
+def get_context(chat_id: int, user_id: int):
+    """Контекст пользователя вне обработчика (тот же, что получит обработчик)"""
+    return dp.get_context(chat_id, user_id)
+
+async def on_pomodoro_finished(timer):
+    await router.finish_pomodoro(bot, get_context(timer.chat_id, timer.user_id), timer)
+
+pomodoro = create_pomodoro_from_env(on_pomodoro_finished)
+router.set_pomodoro(pomodoro)
 
 @dp.on_started()
 async def on_startup():
     logger.info('Бот FocusHelper запущен!')
     await scheduler.start()
+    await pomodoro.start_loop()
     logger.info("Команда /start доступна через обработчик. Черточка может появиться автоматически.")
 
 @dp.bot_started()
 async def handle_bot_started(event: BotStarted):
-    scheduler.add_user(event.chat_id)
+    scheduler.add_user(event.chat_id, user_id=event.user.user_id)
     
-    await event.bot.send_message(
+    outbox.send_message(
+        event.bot,
         chat_id=event.chat_id,
+        wait=False,
         text="🎯 Привет! Я FocusHelper - твой помощник по продуктивности с Pomodoro. "
              "Отправь /start чтобы начать разбивать задачи и фокусироваться!\n\n"
              "⏰ Я буду напоминать тебе в 9:00 утра о незавершенных делах!\n\n"
              "💡 Используй /help чтобы увидеть все доступные команды"
     )
 
+# состояние сервисов бота считается при сборе метрик (GET /metrics), а не на каждом событии
+metrics.gauge("focus_outbox_pending", "Сообщения в очереди исходящих").set_function(lambda: outbox.pending)
+metrics.gauge("focus_outbox_chats", "Чаты с очередью исходящих").set_function(lambda: len(outbox.chats))
+metrics.counter("focus_outbox_sent_total", "Сообщения, доставленные очередью исходящих").set_function(lambda: outbox.sent)
+metrics.counter("focus_outbox_failed_total", "Сообщения, не доставленные очередью").set_function(lambda: outbox.failed)
+metrics.counter("focus_outbox_retries_total", "Повторы отправки из очереди").set_function(lambda: outbox.retries)
+metrics.gauge("focus_reminder_subscribers", "Подписчики утренних напоминаний").set_function(
+    lambda: len(scheduler.active_users)
+)
+metrics.gauge("focus_pomodoro_timers", "Идущие сессии Pomodoro").set_function(lambda: len(pomodoro))
+metrics.counter("focus_pomodoro_finished_total", "Сессии Pomodoro, закончившиеся по таймеру").set_function(
+    lambda: pomodoro.finished
+)
+metrics.gauge("focus_context_cached", "Контексты диалогов в памяти").set_function(lambda: len(context_store))
+metrics.gauge("focus_context_dirty", "Контексты диалогов, ждущие записи").set_function(
+    lambda: context_store.dirty_count
+)
+
+# polling - забирать обновления long polling; webhook - принимать их HTTP-запросами от MAX
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+receiver = None
+if BOT_MODE == "webhook":
+    receiver = create_receiver_from_env(dp, bot)
+    receiver.mount(sync_api.app)
+    metrics.gauge("focus_webhook_queue_depth", "Обновления из вебхука, ждущие обработки").set_function(
+        lambda: receiver.depth
+    )
+    metrics.counter("focus_webhook_rejected_total", "Обновления, отклонённые из-за полной очереди").set_function(
+        lambda: receiver.rejected
+    )
+    metrics.counter("focus_webhook_handled_total", "Обработанные обновления из вебхука").set_function(
+        lambda: receiver.handled
+    )
+
+_polling_task = None
+
+def _polling_finished(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Long polling остановлен с ошибкой: {task.exception()}", exc_info=task.exception())
+
+async def start_bot():
+    """Запустить бота после запуска хранилища sync_api"""
+    global _polling_task
+    context_store.start()
+    if receiver is not None:
+        await receiver.start()
+    else:
+        _polling_task = asyncio.create_task(dp.start_polling(bot))
+        _polling_task.add_done_callback(_polling_finished)
+
+async def stop_bot():
+    """Остановить приём обновлений и сервисы бота до остановки хранилища"""
+    if receiver is not None:
+        await receiver.stop()
+    if _polling_task is not None:
+        dp.polling = False
+        _polling_task.cancel()
+        await asyncio.gather(_polling_task, return_exceptions=True)
+    await pomodoro.stop()
+    await outbox.join(timeout=10)
+    await scheduler.stop()
+    await context_store.stop()
+    await router.close_openrouter_session()
+
+sync_api.startup_hooks.append(start_bot)
+sync_api.shutdown_hooks.append(stop_bot)
+
 async def main():
-    await dp.start_polling(bot)
+    server = uvicorn.Server(uvicorn.Config(
+        sync_api.app,
+        host=os.getenv("SYNC_API_HOST", "0.0.0.0"),
+        port=int(os.getenv("SYNC_API_PORT", 8000)),
+    ))
+    await server.serve()
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
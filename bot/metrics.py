@@ -0,0 +1,265 @@
+"""
+Метрики в формате Prometheus без внешних зависимостей.
+
+Счётчики, показатели и гистограммы с фиксированными корзинами. Запись -
+это сложение в памяти процесса (без блокировок: всё работает в одном
+цикле asyncio); текст для Prometheus собирается только при запросе
+GET /metrics. Показатель можно не обновлять, а считать при сборе
+(set_function) - например, глубину очереди.
+
+    REQUESTS = counter("focus_sync_requests_total", "Запросы /sync", ["outcome"])
+    REQUESTS.labels("ok").inc()
+
+    LATENCY = histogram("focus_lm_request_seconds", "Запросы к LM")
+    with LATENCY.time():
+        ...
+
+Метрики с одним именем регистрируются один раз: повторный вызов
+counter()/gauge()/histogram() возвращает уже созданную.
+"""
+import logging
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# корзины по умолчанию, с: от быстрых ответов API до долгих ответов модели
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Timer:
+    """Контекстный менеджер: записать в гистограмму время выполнения блока"""
+
+    __slots__ = ("_histogram", "_started")
+
+    def __init__(self, histogram: "_HistogramValue"):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started)
+
+
+class _Value:
+    """Значение счётчика или показателя для одного набора меток"""
+
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Считать значение при сборе метрик, а не хранить"""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class _HistogramValue:
+    """Гистограмма для одного набора меток: число наблюдений в каждой корзине, сумма и количество"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+class Metric:
+    """Метрика с набором меток; значения для каждого набора создаются при первом обращении"""
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lookup: Dict[tuple, object] = {}
+        # без меток - одно значение, к нему обращаемся без поиска в словаре
+        self._default = self.labels() if not self.labelnames else None
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        value = self._lookup.get(values)
+        if value is None:
+            key = tuple(map(str, values))
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получено {key}")
+            value = self._values.get(key)
+            if value is None:
+                value = self._values[key] = self._new_value()
+            # в следующий раз те же метки (в том числе не строки) находятся без преобразования
+            self._lookup[values] = value
+        return value
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {_escape(self.help)}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Счётчик: только растёт"""
+
+    type = "counter"
+
+    def _new_value(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._default.set_function(function)
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, value in list(self._values.items()):
+            try:
+                samples.append(f"{self.name}{_labels_text(self.labelnames, key)} {_format_value(value.get())}")
+            except Exception as e:
+                logger.warning(f"Метрика {self.name} не собрана: {e}")
+        return samples
+
+
+class Gauge(Counter):
+    """Показатель: может расти и уменьшаться"""
+
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными корзинами (верхние границы, с)"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        bounds = sorted(float(b) for b in buckets)
+        if not bounds or not math.isinf(bounds[-1]):
+            bounds.append(math.inf)
+        self.bounds = tuple(bounds)
+        super().__init__(name, help, labelnames)
+
+    def _new_value(self) -> _HistogramValue:
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return _Timer(self._default)
+
+    def _samples(self) -> List[str]:
+        samples = []
+        names = self.labelnames + ("le",)
+        for key, value in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(value.bounds, value.counts):
+                cumulative += count
+                labels = _labels_text(names, key + (_format_value(bound),))
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels_text(self.labelnames, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(value.sum)}")
+            samples.append(f"{self.name}_count{labels} {value.count}")
+        return samples
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, cls, name: str, *args, **kwargs) -> Metric:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif type(metric) is not cls:
+            raise ValueError(f"Метрика {name} уже зарегистрирована как {metric.type}")
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(
+        self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
@@ -0,0 +1,236 @@
+"""
+Очередь исходящих сообщений бота.
+
+Всё, что бот отправляет в MAX API (новые сообщения, правки), ставится в
+очередь своего чата и уходит строго по порядку постановки: у каждого
+чата с непустой очередью один отправитель. Темп ограничен двумя
+корзинами токенов - общей (квота бота) и отдельной на каждый чат.
+Ответы 429 и 5xx, а также обрывы соединения повторяются с экспоненциальной
+паузой и случайной добавкой; остальные сообщения чата ждут, чтобы не
+нарушить порядок.
+
+submit() возвращает future с ответом API - его можно дождаться (доставка)
+или не ждать вовсе (отправил и забыл).
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from maxapi.exceptions.max import MaxConnection
+from maxapi.types.errors import Error
+
+import metrics
+from fanout import TokenBucket, error_code, is_denied, is_retryable
+
+logger = logging.getLogger(__name__)
+
+WAIT_SECONDS = metrics.histogram(
+    "focus_outbox_wait_seconds", "Ожидание сообщения в очереди исходящих до первой попытки отправки, с",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+Call = Callable[[], Awaitable[Any]]
+
+
+class _Outgoing:
+    """Сообщение в очереди: вызов API, future для ответа и время постановки"""
+
+    __slots__ = ("call", "future", "queued_at")
+
+    def __init__(self, call: Call, future: asyncio.Future, queued_at: float):
+        self.call = call
+        self.future = future
+        self.queued_at = queued_at
+
+
+class _ChatQueue:
+    __slots__ = ("messages", "bucket", "task")
+
+    def __init__(self, bucket: TokenBucket):
+        self.messages: Deque[_Outgoing] = deque()
+        self.bucket = bucket
+        self.task: Optional[asyncio.Task] = None
+
+
+def _forget(future: asyncio.Future) -> None:
+    # ошибка уже записана в лог; забираем её, чтобы asyncio не ругался
+    if not future.cancelled():
+        future.exception()
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений по чатам.
+
+    Args:
+        rate: не больше rate запросов в секунду на весь бот (включая повторы)
+        burst: всплеск общей корзины (по умолчанию rate)
+        chat_rate: не больше chat_rate запросов в секунду в один чат
+        chat_burst: всплеск корзины чата
+        max_retries: сколько раз повторять при 429/5xx/обрыве соединения
+        backoff: начальная пауза перед повтором, с (удваивается, максимум max_backoff)
+        wait_samples: сколько последних времён ожидания в очереди хранить для статистики
+    """
+
+    def __init__(
+        self,
+        rate: float = 30.0,
+        burst: Optional[float] = None,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 10.0,
+        wait_samples: int = 1000,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.chats: Dict[Hashable, _ChatQueue] = {}
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.waits: Deque[float] = deque(maxlen=wait_samples)
+        self._prune_at = 1024
+
+    def submit(self, chat_key: Hashable, call: Call, wait: bool = True) -> asyncio.Future:
+        """
+        Поставить вызов API call() в очередь чата chat_key.
+
+        Возвращает future с ответом API (или исключением вызова). Если
+        wait=False, результат никто не ждёт: ошибки только пишутся в лог.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not wait:
+            future.add_done_callback(_forget)
+
+        queue = self.chats.get(chat_key)
+        if queue is None:
+            if len(self.chats) >= self._prune_at:
+                self._prune()
+            queue = self.chats[chat_key] = _ChatQueue(TokenBucket(self.chat_rate, self.chat_burst))
+        queue.messages.append(_Outgoing(call, future, time.perf_counter()))
+        self.pending += 1
+        if queue.task is None:
+            queue.task = loop.create_task(self._drain(chat_key, queue))
+        return future
+
+    def send_message(self, bot, chat_id: Optional[int] = None, user_id: Optional[int] = None, wait: bool = True, **kwargs) -> asyncio.Future:
+        """Поставить в очередь bot.send_message(chat_id=..., user_id=..., **kwargs)"""
+        chat_key = chat_id if chat_id is not None else ("user", user_id)
+        return self.submit(
+            chat_key,
+            lambda: bot.send_message(chat_id=chat_id, user_id=user_id, **kwargs),
+            wait=wait,
+        )
+
+    async def _drain(self, chat_key: Hashable, queue: _ChatQueue) -> None:
+        """Отправитель чата: по одному сообщению, пока очередь не опустеет"""
+        try:
+            while queue.messages:
+                message = queue.messages[0]
+                try:
+                    result = await self._deliver(chat_key, queue, message)
+                except Exception as e:
+                    if not isinstance(e, MaxConnection):
+                        logger.error(f"Ошибка отправки в чат {chat_key}: {e}")
+                    self.failed += 1
+                    if not message.future.done():
+                        message.future.set_exception(e)
+                else:
+                    if not message.future.done():
+                        message.future.set_result(result)
+                queue.messages.popleft()
+                self.pending -= 1
+        finally:
+            queue.task = None
+
+    async def _deliver(self, chat_key: Hashable, queue: _ChatQueue, message: _Outgoing) -> Any:
+        for attempt in range(self.max_retries + 1):
+            await queue.bucket.acquire()
+            await self.bucket.acquire()
+            if attempt == 0:
+                waited = time.perf_counter() - message.queued_at
+                self.waits.append(waited)
+                WAIT_SECONDS.observe(waited)
+            try:
+                result = await message.call()
+            except MaxConnection as e:
+                result = e
+
+            if is_denied(result):
+                self.failed += 1
+                logger.info(f"Чат {chat_key} недоступен ({error_code(result) or result.code}), сообщение не отправлено")
+                return result
+            if not (is_retryable(result) or isinstance(result, MaxConnection)):
+                if isinstance(result, Error):
+                    self.failed += 1
+                    logger.warning(f"MAX API вернул ошибку при отправке в чат {chat_key}: {result.code} {result.raw}")
+                else:
+                    self.sent += 1
+                return result
+
+            if attempt < self.max_retries:
+                self.retries += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                await asyncio.sleep(delay * (1 + random.random() / 2))
+
+        logger.warning(f"Сообщение в чат {chat_key} не доставлено после {self.max_retries} повторов: {result}")
+        if isinstance(result, MaxConnection):
+            raise result
+        self.failed += 1
+        return result
+
+    def _prune(self) -> None:
+        """Забыть простаивающие чаты, корзины которых уже полностью восстановились"""
+        idle = [chat_key for chat_key, queue in self.chats.items() if queue.task is None and queue.bucket.full()]
+        for chat_key in idle:
+            del self.chats[chat_key]
+        self._prune_at = max(1024, len(self.chats) * 2)
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться отправки всего, что уже в очереди; False - не успели за timeout"""
+        tasks = [queue.task for queue in self.chats.values() if queue.task is not None]
+        if not tasks:
+            return True
+        _, not_done = await asyncio.wait(tasks, timeout=timeout)
+        if not_done:
+            logger.warning(f"Очередь исходящих не разобрана, осталось сообщений: {self.pending}")
+        return not not_done
+
+    def stats(self) -> dict:
+        """Счётчики и время ожидания в очереди (медиана и 99-й перцентиль по последним сообщениям), с"""
+        waits = sorted(self.waits)
+        return {
+            "pending": self.pending,
+            "chats": sum(1 for queue in self.chats.values() if queue.task is not None),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_p99": waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0,
+        }
+
+
+def create_outbox_from_env() -> Outbox:
+    """
+    Очередь по переменным окружения: OUTBOX_RATE, OUTBOX_BURST,
+    OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_MAX_RETRIES
+    """
+    burst = os.getenv("OUTBOX_BURST")
+    return Outbox(
+        rate=float(os.getenv("OUTBOX_RATE", 30)),
+        burst=float(burst) if burst else None,
+        chat_rate=float(os.getenv("OUTBOX_CHAT_RATE", 1)),
+        chat_burst=float(os.getenv("OUTBOX_CHAT_BURST", 3)),
+        max_retries=int(os.getenv("OUTBOX_MAX_RETRIES", 3)),
+    )
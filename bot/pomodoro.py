@@ -0,0 +1,243 @@
+"""
+Серверные таймеры Pomodoro.
+
+Все таймеры живут в одной мин-куче дедлайнов и обслуживаются одной
+задачей asyncio: она спит до ближайшего окончания сессии и просыпается
+раньше, если таймер запущен, поставлен на паузу или отменён. По
+окончании сессии вызывается on_finish(timer).
+
+Таймеры периодически сохраняются в JSON-файл (время окончания - время
+Unix), поэтому переживают перезапуск; сессии, закончившиеся, пока бот
+не работал, завершаются сразу после запуска.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from timers import DeadlineHeap, SystemClock, sleep_or_wakeup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DURATION = 25 * 60
+
+
+class PomodoroTimer:
+    """Таймер одной сессии: идёт (ends_at) или на паузе (remaining)"""
+
+    __slots__ = ("chat_id", "user_id", "title", "duration", "ends_at", "remaining")
+
+    def __init__(
+        self,
+        chat_id: int,
+        user_id: Optional[int],
+        title: str,
+        duration: float,
+        ends_at: Optional[float] = None,
+        remaining: Optional[float] = None,
+    ):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.title = title
+        self.duration = duration
+        self.ends_at = ends_at
+        self.remaining = remaining
+
+    @property
+    def paused(self) -> bool:
+        return self.ends_at is None
+
+    def left(self, now: float) -> float:
+        """Сколько секунд осталось до конца сессии"""
+        if self.paused:
+            return self.remaining
+        return max(0.0, self.ends_at - now)
+
+    def to_row(self) -> list:
+        return [self.chat_id, self.user_id, self.title, self.duration, self.ends_at, self.remaining]
+
+
+class PomodoroTimers:
+    """
+    Таймеры Pomodoro по чатам (в чате не больше одной сессии).
+
+    Args:
+        on_finish: async on_finish(timer) - сессия закончилась
+        clock: часы (time() и async sleep()); по умолчанию системные
+        path: файл для сохранения таймеров между перезапусками (опционально)
+        save_interval: как часто сохранять изменённые таймеры, с
+    """
+
+    def __init__(
+        self,
+        on_finish: Callable[[PomodoroTimer], Awaitable[None]],
+        clock=None,
+        path: Optional[str] = None,
+        save_interval: float = 5.0,
+    ):
+        self.on_finish = on_finish
+        self.clock = clock or SystemClock()
+        self.path = path
+        self.save_interval = save_interval
+        self.timers: Dict[int, PomodoroTimer] = {}
+        self.deadlines: DeadlineHeap[int] = DeadlineHeap()
+        self.finished = 0
+        self._dirty = False
+        self._saved_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._finishing: Set[asyncio.Task] = set()
+        self.running = False
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def get(self, chat_id: int) -> Optional[PomodoroTimer]:
+        return self.timers.get(chat_id)
+
+    def _changed(self) -> None:
+        self._dirty = True
+        self._wakeup.set()
+
+    def start(self, chat_id: int, user_id: Optional[int], title: str, duration: float = DEFAULT_DURATION) -> PomodoroTimer:
+        """Запустить сессию в чате; уже идущая сессия заменяется"""
+        timer = PomodoroTimer(chat_id, user_id, title, duration, ends_at=self.clock.time() + duration)
+        self.timers[chat_id] = timer
+        self.deadlines.schedule(chat_id, timer.ends_at)
+        self._changed()
+        return timer
+
+    def pause(self, chat_id: int) -> Optional[PomodoroTimer]:
+        timer = self.timers.get(chat_id)
+        if timer is None or timer.paused:
+            return timer
+        timer.remaining = timer.left(self.clock.time())
+        timer.ends_at = None
+        self.deadlines.cancel(chat_id)
+        self._changed()
+        return timer
+
+    def resume(self, chat_id: int) -> Optional[PomodoroTimer]:
+        timer = self.timers.get(chat_id)
+        if timer is None or not timer.paused:
+            return timer
+        timer.ends_at = self.clock.time() + timer.remaining
+        timer.remaining = None
+        self.deadlines.schedule(chat_id, timer.ends_at)
+        self._changed()
+        return timer
+
+    def cancel(self, chat_id: int) -> Optional[PomodoroTimer]:
+        timer = self.timers.pop(chat_id, None)
+        if timer is not None:
+            self.deadlines.cancel(chat_id)
+            self._changed()
+        return timer
+
+    async def _finish(self, timer: PomodoroTimer) -> None:
+        try:
+            await self.on_finish(timer)
+        except Exception as e:
+            logger.error(f"Ошибка завершения сессии Pomodoro в чате {timer.chat_id}: {e}", exc_info=True)
+
+    async def run(self) -> None:
+        """Цикл таймеров: спит до ближайшего окончания сессии или сохранения"""
+        while self.running:
+            try:
+                now = self.clock.time()
+                for _, chat_id in self.deadlines.pop_due(now):
+                    timer = self.timers.pop(chat_id, None)
+                    if timer is not None:
+                        self.finished += 1
+                        self._dirty = True
+                        task = asyncio.create_task(self._finish(timer))
+                        self._finishing.add(task)
+                        task.add_done_callback(self._finishing.discard)
+
+                if self._dirty and now - self._saved_at >= self.save_interval:
+                    await self.save()
+
+                self._wakeup.clear()
+                wake_at = self.deadlines.next_time()
+                if self._dirty:
+                    save_at = self._saved_at + self.save_interval
+                    wake_at = save_at if wake_at is None else min(wake_at, save_at)
+                await sleep_or_wakeup(self.clock, self._wakeup, None if wake_at is None else max(0.0, wake_at - now))
+            except Exception as e:
+                logger.error(f"Ошибка в цикле таймеров Pomodoro: {e}", exc_info=True)
+                await self.clock.sleep(1)
+
+    def load(self) -> None:
+        """Восстановить сохранённые таймеры"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                rows = json.load(f)
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить таймеры Pomodoro из {self.path}: {e}")
+            return
+        due = []
+        for row in rows:
+            timer = PomodoroTimer(*row)
+            self.timers[timer.chat_id] = timer
+            if not timer.paused:
+                due.append((timer.chat_id, timer.ends_at))
+        self.deadlines.schedule_many(due)
+        logger.info(f"Загружено таймеров Pomodoro: {len(self.timers)}")
+
+    async def save(self) -> None:
+        """Сохранить таймеры на диск (атомарно, через временный файл, в отдельном потоке)"""
+        self._dirty = False
+        self._saved_at = self.clock.time()
+        if not self.path:
+            return
+        rows = [timer.to_row() for timer in self.timers.values()]
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            self._dirty = True
+            logger.warning(f"Не удалось сохранить таймеры Pomodoro в {self.path}: {e}")
+
+    def _write(self, rows: list) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def start_loop(self) -> None:
+        """Загрузить сохранённые таймеры и запустить цикл"""
+        self.load()
+        self.running = True
+        self._task = asyncio.create_task(self.run())
+        logger.info("Таймеры Pomodoro запущены")
+
+    async def stop(self, drain_timeout: float = 30.0) -> None:
+        """
+        Остановить цикл, дождаться on_finish закончившихся сессий (не дольше
+        drain_timeout, остальные отменяются) и сохранить таймеры
+        """
+        self.running = False
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._finishing:
+            _, pending = await asyncio.wait(set(self._finishing), timeout=drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Завершение сессий Pomodoro прервано при остановке: {len(pending)}")
+                await asyncio.gather(*pending, return_exceptions=True)
+        await self.save()
+        logger.info("Таймеры Pomodoro остановлены")
+
+
+def create_pomodoro_from_env(on_finish: Callable[[PomodoroTimer], Awaitable[None]]) -> PomodoroTimers:
+    """Таймеры по переменным окружения: POMODORO_PATH (пусто - не сохранять), POMODORO_SAVE_INTERVAL"""
+    return PomodoroTimers(
+        on_finish,
+        path=os.getenv("POMODORO_PATH", "pomodoro_timers.json") or None,
+        save_interval=float(os.getenv("POMODORO_SAVE_INTERVAL", 5.0)),
+    )
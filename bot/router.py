@@ -3,20 +3,44 @@ import os
 import asyncio
 import json
 import aiohttp
-from datetime import datetime
+from datetime import datetime, time
 from pathlib import Path
+from time import perf_counter
+from zoneinfo import ZoneInfoNotFoundError
 from maxapi import F, Router
 from maxapi.types import MessageCreated, Command, MessageCallback
 from maxapi.context import MemoryContext
 from maxapi.utils.inline_keyboard import InlineKeyboardBuilder
-from maxapi.types import LinkButton
 from maxapi.context import State, StatesGroup
 from maxapi.types.input_media import InputMedia
 from maxapi.types.errors import Error
+import metrics
+import tracing
 from states import UserStates
+from templates import (
+    AI_CHAT_KEYBOARD, AI_EMPTY_QUESTION_TEXT, AI_ERROR_TEXT, AI_GREETING_TEXT, AI_INTERRUPTED_TEXT, AI_THINKING_TEXT,
+    BACK_TO_PLAN_KEYBOARD, CANCEL_KEYBOARD, CREATE_TASK_TEXT, DEADLINE_KEYBOARD, HELP_TEXT,
+    HOW_IT_WORKS_KEYBOARD, HOW_IT_WORKS_TEXT, MAIN_MENU_KEYBOARD, MAIN_MENU_TEXT, NO_ACTIVE_SESSION_TEXT,
+    POMODORO_PAUSED_KEYBOARD, POMODORO_RUNNING_KEYBOARD, QUICK_POMODORO_TEXT, SESSION_CANCELLED_TEXT,
+    SESSION_COMPLETED_TEXT, SESSION_FINISHED_KEYBOARD, SESSION_PAUSED_TEXT, SESSION_RESUMED_TEXT,
+    SESSION_STARTED_TEXT, SESSION_TIME_UP_TEXT, TASK_DESCRIPTION_TEXT, TASK_SAVED_KEYBOARD, TASK_SAVED_TEXT,
+    WELCOME_TEXT,
+)
 
 logger = logging.getLogger(__name__)
 
+BOT_MESSAGES = metrics.counter("focus_bot_messages_total", "Сообщения, отправленные обработчиками бота", ["outcome"])
+BOT_SEND_SECONDS = metrics.histogram("focus_bot_send_seconds", "Время отправки сообщения (с ожиданием доставки), с")
+OPENROUTER_REQUESTS = metrics.counter(
+    "focus_openrouter_requests_total", "Запросы к моделям OpenRouter", ["model", "outcome"]
+)
+OPENROUTER_SECONDS = metrics.histogram(
+    "focus_openrouter_seconds", "Время до ответа модели OpenRouter (в потоке - до первого куска), с", ["model"]
+)
+OPENROUTER_ANSWERS = metrics.counter(
+    "focus_openrouter_answers_total", "Ответы AI: основной моделью, запасной или без ответа", ["source"]
+)
+
 async def send_event_message(
     event,
     text: str | None = None,
@@ -25,8 +49,15 @@ async def send_event_message(
     link=None,
     notify=None,
     parse_mode=None,
+    wait: bool = True,
 ):
-    """Отправка сообщения через событие"""
+    """
+    Отправка сообщения через событие.
+
+    Если задана очередь исходящих (set_outbox), сообщение уходит через неё
+    по порядку чата и с ограничением темпа. wait=False - не ждать доставки
+    (ошибки только пишутся в лог очереди), вернётся None
+    """
     chat_id = None
     user_id = None
 
@@ -52,38 +83,60 @@ async def send_event_message(
         else:
             attachments_list = list(attachments)
 
-    response = await event.bot.send_message(
-        chat_id=chat_id,
-        user_id=user_id,
-        text=text,
-        attachments=attachments_list,
-        link=link,
-        notify=notify,
-        parse_mode=parse_mode,
-    )
-
-    if isinstance(response, Error):
+    started = perf_counter()
+    try:
+        if _outbox is not None:
+            delivery = _outbox.send_message(
+                event.bot,
+                chat_id=chat_id,
+                user_id=user_id,
+                wait=wait,
+                text=text,
+                attachments=attachments_list,
+                link=link,
+                notify=notify,
+                parse_mode=parse_mode,
+            )
+            if not wait:
+                BOT_MESSAGES.labels("queued").inc()
+                return None
+            response = await delivery
+        else:
+            response = await event.bot.send_message(
+                chat_id=chat_id,
+                user_id=user_id,
+                text=text,
+                attachments=attachments_list,
+                link=link,
+                notify=notify,
+                parse_mode=parse_mode,
+            )
+    except Exception:
+        BOT_MESSAGES.labels("error").inc()
+        raise
+    elapsed = perf_counter() - started
+    BOT_SEND_SECONDS.observe(elapsed)
+    tracing.add_stage("send", elapsed)
+
+    if not isinstance(response, Error):
+        BOT_MESSAGES.labels("ok").inc()
+    else:
         raw_code = response.raw.get("code") if isinstance(response.raw, dict) else None
         if raw_code == "chat.denied" or response.code == 403:
+            BOT_MESSAGES.labels("denied").inc()
             logger.info(
                 "Диалог приостановлен, сообщение не отправлено (chat.denied). user_id=%s chat_id=%s",
                 user_id,
                 chat_id,
             )
         else:
+            BOT_MESSAGES.labels("error").inc()
             logger.warning(
                 "MAX API вернул ошибку при отправке сообщения: %s", response.raw
             )
 
     return response
 
-class UserData:
-    def __init__(self):
-        self.tasks = []
-        self.total_sessions = 0
-        self.level = 1
-        self.joined_date = datetime.now().isoformat()
-
 router = Router()
 BASE_DIR = Path(__file__).resolve().parent
 
@@ -105,12 +158,33 @@ SAMPLE_PLANS = {
 }
 
 _scheduler = None
+_pomodoro = None
+_outbox = None
+_user_store = None
+
+POMODORO_MINUTES = float(os.getenv("POMODORO_MINUTES", 25))
+SESSION_XP = 10
 
 def set_scheduler(scheduler_instance):
     """Установить экземпляр планировщика"""
     global _scheduler
     _scheduler = scheduler_instance
 
+def set_pomodoro(pomodoro_instance):
+    """Установить сервис таймеров Pomodoro"""
+    global _pomodoro
+    _pomodoro = pomodoro_instance
+
+def set_outbox(outbox_instance):
+    """Установить очередь исходящих сообщений"""
+    global _outbox
+    _outbox = outbox_instance
+
+def set_user_store(store):
+    """Установить общее с webapp хранилище задач и статистики (UserStore)"""
+    global _user_store
+    _user_store = store
+
 @router.message_callback(F.callback.payload == "quick_start")
 async def quick_start_handler(event: MessageCallback, context: MemoryContext):
     """Обработчик быстрой кнопки /start"""
@@ -133,63 +207,75 @@ async def quick_start_handler(event: MessageCallback, context: MemoryContext):
     
     if _scheduler and chat_id:
         _scheduler.add_user(chat_id, context)
-    
-    user_data = await context.get_data()
-    if not user_data:
-        user_data = {
-            "tasks": [],
-            "total_sessions": 0,
-            "level": 1,
-            "joined_date": datetime.now().isoformat()
-        }
-        await context.set_data(user_data)
-    
-    if _scheduler and chat_id:
-        _scheduler.update_user_data(chat_id, user_data)
-    
-    builder = InlineKeyboardBuilder()
-    webapp_url = "https://max.ru/t122_hakaton_bot?startapp"
-    try:
-        builder.row(
-            LinkButton(text="📱 Открыть приложение", url=webapp_url)
-        )
-    except:
-        builder.row(
-            {"text": "📱 Открыть приложение", "url": webapp_url}
-        )
-    builder.row(
-        {"text": "ℹ️ Как работает", "payload": "how_it_works"}
-    )
-    builder.row(
-        {"text": "🤖 Умный помощник", "payload": "ai_assistant"}
-    )
-
-    welcome_text = """📱 Открой веб-приложение для удобной работы с задачами!
-
-Я помогу:
-• Разбить большие задачи на шаги
-• Фокусироваться с Pomodoro
-• Отслеживать прогресс и мотивацию
-
-"""
 
     await send_event_message(
         event, 
-        text=welcome_text, 
-        attachments=[builder.as_markup()]
+        text=WELCOME_TEXT, 
+        attachments=[MAIN_MENU_KEYBOARD]
     )
 
+# Не чаще одного редактирования сообщения за столько секунд при стриминге ответа AI
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", 1.0))
+MAX_MESSAGE_LENGTH = 4000
+
+def _sent_message_id(response) -> str | None:
+    """mid отправленного сообщения или None, если отправка не удалась"""
+    message = getattr(response, "message", None)
+    body = getattr(message, "body", None)
+    return getattr(body, "mid", None)
+
+async def _stream_answer(event, message_id: str, question: str, keyboard: list) -> str:
+    """
+    Получать ответ AI потоком и редактировать сообщение message_id по мере генерации
+    (не чаще AI_STREAM_EDIT_INTERVAL). Часть ответа сверх лимита длины досылается отдельными сообщениями.
+    Оборвавшийся на середине ответ помечается в конце, чтобы он не выглядел полным
+    """
+    loop = asyncio.get_running_loop()
+    parts: list[str] = []
+    last_edit = 0.0
+
+    async def edit(text: str):
+        def call():
+            return event.bot.edit_message(message_id=message_id, text=text, attachments=keyboard)
+
+        started = perf_counter()
+        try:
+            if _outbox is not None:
+                # ошибки пишет в лог сама очередь
+                chat_id, _ = event.get_ids()
+                await _outbox.submit(chat_id, call)
+                return
+            response = await call()
+        finally:
+            tracing.add_stage("send", perf_counter() - started)
+        if isinstance(response, Error):
+            logger.warning("MAX API вернул ошибку при редактировании сообщения: %s", response.raw)
+
+    interrupted = False
+    try:
+        async for chunk in ask_openrouter_stream(question):
+            parts.append(chunk)
+            now = loop.time()
+            if now - last_edit >= AI_STREAM_EDIT_INTERVAL:
+                last_edit = now
+                await edit("".join(parts)[:MAX_MESSAGE_LENGTH - 2] + " ▌")
+    except StreamInterrupted as e:
+        logger.warning(f"Ответ AI оборвался после {len(parts)} кусков: {e}")
+        interrupted = True
+
+    answer = "".join(parts)
+    if interrupted:
+        answer += AI_INTERRUPTED_TEXT
+    await edit(answer[:MAX_MESSAGE_LENGTH])
+    for i in range(MAX_MESSAGE_LENGTH, len(answer), MAX_MESSAGE_LENGTH):
+        await send_event_message(event, answer[i:i + MAX_MESSAGE_LENGTH], attachments=keyboard)
+    return answer
+
 # Обработчик AI помощника должен быть зарегистрирован раньше команд
 @router.message_created(UserStates.waiting_ai_question)
 async def handle_ai_question(event: MessageCreated, context: MemoryContext):
     """Обработка вопросов пользователя к AI"""
     try:
-        logger.info("Обработчик AI вопроса вызван")
-        
-        # Проверяем текущее состояние
-        current_state = await context.get_state()
-        logger.info(f"Текущее состояние: {current_state}")
-        
         # Получаем текст сообщения - в maxapi текст находится в event.message.body.text
         question = None
         
@@ -198,194 +284,109 @@ async def handle_ai_question(event: MessageCreated, context: MemoryContext):
                 # body - это объект MessageBody, у которого есть атрибут text
                 if hasattr(event.message.body, 'text'):
                     question = event.message.body.text
-                    logger.info(f"Текст сообщения: {question}")
         
         # Если не нашли, пробуем альтернативные способы
         if not question:
             if hasattr(event, 'message') and hasattr(event.message, 'text'):
                 question = event.message.text
-                logger.info(f"Текст из event.message.text: {question}")
         
-        logger.info(f"Итоговый текст сообщения: {question}")
+        logger.debug("Вопрос к AI: %.50r", question)
         
         # Проверяем, что это не команда
         if question and question.startswith('/'):
-            logger.info("Пропущена команда в режиме AI")
+            logger.debug("Пропущена команда в режиме AI")
             return
         
         if not question or not question.strip():
             logger.warning("Получено пустое сообщение в режиме AI")
-            builder = InlineKeyboardBuilder()
-            builder.row({"text": "◀️ Выйти из чата", "payload": "back_to_main"})
-            await send_event_message(event, "Пожалуйста, задайте вопрос текстом.", attachments=[builder.as_markup()])
+            await send_event_message(event, AI_EMPTY_QUESTION_TEXT, attachments=[AI_CHAT_KEYBOARD])
             return
         
-        logger.info(f"Обработка вопроса к AI: {question[:50]}...")
-        
-        # Отправляем сообщение о том, что обрабатываем запрос
-        builder = InlineKeyboardBuilder()
-        builder.row({"text": "◀️ Выйти из чата", "payload": "back_to_main"})
+        # Отправляем сообщение о том, что обрабатываем запрос, и дописываем в него ответ по мере генерации
+        keyboard = [AI_CHAT_KEYBOARD]
         
-        await send_event_message(
+        sent = await send_event_message(
             event,
-            "🤔 Думаю...",
-            attachments=[builder.as_markup()]
+            AI_THINKING_TEXT,
+            attachments=keyboard
         )
+        message_id = _sent_message_id(sent)
         
-        # Получаем ответ от AI
-        answer = await ask_openrouter(question)
-        logger.info(f"Получен ответ от AI (длина: {len(answer)})")
-        
-        # Отправляем ответ
-        builder = InlineKeyboardBuilder()
-        builder.row({"text": "◀️ Выйти из чата", "payload": "back_to_main"})
-        
-        await send_event_message(
-            event,
-            answer,
-            attachments=[builder.as_markup()]
-        )
+        if message_id:
+            answer = await _stream_answer(event, message_id, question, keyboard)
+        else:
+            answer = await ask_openrouter(question)
+            await send_event_message(
+                event,
+                answer,
+                attachments=keyboard
+            )
+        logger.debug("Получен ответ от AI (длина: %d)", len(answer))
     except Exception as e:
         logger.error(f"Ошибка в обработчике AI вопроса: {e}", exc_info=True)
-        builder = InlineKeyboardBuilder()
-        builder.row({"text": "◀️ Выйти из чата", "payload": "back_to_main"})
         await send_event_message(
             event,
-            f"❌ Произошла ошибка при обработке вопроса: {str(e)}",
-            attachments=[builder.as_markup()]
+            AI_ERROR_TEXT.format(error=e),
+            attachments=[AI_CHAT_KEYBOARD]
         )
 
 @router.message_created(Command("start"))
 async def start_command(event: MessageCreated, context: MemoryContext):
     chat_id = None
     try:
-        if not hasattr(start_command, '_debugged'):
-            logger.info(f"Доступные атрибуты event: {[attr for attr in dir(event) if not attr.startswith('_')]}")
+        # разбор устройства события - только на DEBUG и один раз: dir() и repr моделей дорогие
+        if logger.isEnabledFor(logging.DEBUG) and not hasattr(start_command, '_debugged'):
+            logger.debug(f"Доступные атрибуты event: {[attr for attr in dir(event) if not attr.startswith('_')]}")
             if hasattr(event, 'chat'):
-                logger.info(f"event.chat = {event.chat} (тип: {type(event.chat)})")
+                logger.debug(f"event.chat = {event.chat} (тип: {type(event.chat)})")
                 if hasattr(event.chat, 'id'):
-                    logger.info(f"event.chat.id = {event.chat.id}")
+                    logger.debug(f"event.chat.id = {event.chat.id}")
             if hasattr(event, 'from_user'):
-                logger.info(f"event.from_user = {event.from_user} (тип: {type(event.from_user)})")
+                logger.debug(f"event.from_user = {event.from_user} (тип: {type(event.from_user)})")
                 if hasattr(event.from_user, 'id'):
-                    logger.info(f"event.from_user.id = {event.from_user.id}")
+                    logger.debug(f"event.from_user.id = {event.from_user.id}")
             if hasattr(event, 'message'):
-                logger.info(f"Доступные атрибуты event.message: {[attr for attr in dir(event.message) if not attr.startswith('_')]}")
+                logger.debug(f"Доступные атрибуты event.message: {[attr for attr in dir(event.message) if not attr.startswith('_')]}")
                 if hasattr(event.message, 'recipient'):
-                    logger.info(f"event.message.recipient = {event.message.recipient} (тип: {type(event.message.recipient)})")
+                    logger.debug(f"event.message.recipient = {event.message.recipient} (тип: {type(event.message.recipient)})")
                 if hasattr(event.message, 'sender'):
-                    logger.info(f"event.message.sender = {event.message.sender} (тип: {type(event.message.sender)})")
+                    logger.debug(f"event.message.sender = {event.message.sender} (тип: {type(event.message.sender)})")
             start_command._debugged = True
         
         if hasattr(event, 'chat') and hasattr(event.chat, 'chat_id'):
             chat_id = event.chat.chat_id
-            logger.debug(f"Получен chat_id из event.chat.chat_id: {chat_id}")
+            logger.debug("Получен chat_id из event.chat.chat_id: %s", chat_id)
         
         if not chat_id and hasattr(event, 'message') and hasattr(event.message, 'recipient'):
             recipient = event.message.recipient
             if hasattr(recipient, 'chat_id'):
                 chat_id = recipient.chat_id
-                logger.debug(f"Получен chat_id из event.message.recipient.chat_id: {chat_id}")
+                logger.debug("Получен chat_id из event.message.recipient.chat_id: %s", chat_id)
         
         if not chat_id and hasattr(event, 'chat') and hasattr(event.chat, 'id'):
             chat_id = event.chat.id
-            logger.debug(f"Получен chat_id из event.chat.id: {chat_id}")
+            logger.debug("Получен chat_id из event.chat.id: %s", chat_id)
         
     except Exception as e:
         logger.warning(f"Ошибка получения chat_id: {e}", exc_info=True)
     
-    logger.info(f"Получена команда /start от пользователя {chat_id} (тип события: {type(event)})")
+    logger.debug("Получена команда /start от пользователя %s", chat_id)
     try:
         if _scheduler and chat_id:
             _scheduler.add_user(chat_id, context)
         
-        user_data = await context.get_data()
-        if not user_data:
-            logger.info("Инициализация данных нового пользователя")
-            user_data = {
-                "tasks": [],
-                "total_sessions": 0,
-                "level": 1,
-                "joined_date": datetime.now().isoformat()
-            }
-            await context.set_data(user_data)
-        
-        if _scheduler and chat_id:
-            _scheduler.update_user_data(chat_id, user_data)
-        
-        builder = InlineKeyboardBuilder()
-        logger.info("Создание кнопок клавиатуры")
-        
-        webapp_url = "https://max.ru/t122_hakaton_bot?startapp"
-        try:
-            builder.row(
-                LinkButton(text="📱 Открыть приложение", url=webapp_url)
-            )
-            logger.info(f"Кнопка 'Открыть приложение' добавлена (LinkButton с {webapp_url})")
-        except Exception as e:
-            logger.warning(f"Не удалось создать LinkButton: {e}, используем dict формат")
-            builder.row(
-                {"text": "📱 Открыть приложение", "url": webapp_url}
-            )
-            logger.info(f"Кнопка 'Открыть приложение' добавлена (dict с {webapp_url})")
-        
-        builder.row(
-            {"text": "ℹ️ Как работает", "payload": "how_it_works"}
-        )
-        logger.info("Кнопка 'Как работает' добавлена")
-        builder.row(
-            {"text": "🤖 Умный помощник", "payload": "ai_assistant"}
-        )
-        logger.info("Кнопка 'Умный помощник' добавлена")
-
-        welcome_text = """📱 Открой веб-приложение для удобной работы с задачами!
-
-Я помогу:
-• Разбить большие задачи на шаги
-• Фокусироваться с Pomodoro
-• Отслеживать прогресс и мотивацию"""
-
-        logger.info("Отправка приветственного сообщения")
-        markup = builder.as_markup()
-        logger.info(f"Созданная клавиатура: {markup}, тип: {type(markup)}")
         await send_event_message(
             event, 
-            text=welcome_text, 
-            attachments=[markup]
+            text=WELCOME_TEXT, 
+            attachments=[MAIN_MENU_KEYBOARD]
         )
-        logger.info("Приветственное сообщение отправлено успешно")
     except Exception as e:
         logger.error(f"Ошибка в обработчике /start: {e}", exc_info=True)
 
 @router.message_created(Command("help"))
 async def help_command(event: MessageCreated, context: MemoryContext):
     """Показать меню со всеми командами"""
-    help_text = """📋 Меню команд FocusHelper:
-
-/start - Начать работу с ботом
-/help или /menu - Показать это меню
-/test_reminder - Тест утреннего напоминания
-
-📱 Используй кнопки в сообщениях для быстрого доступа к функциям!"""
-    
-    builder = InlineKeyboardBuilder()
-    webapp_url = "https://max.ru/t122_hakaton_bot?startapp"
-    try:
-        builder.row(
-            LinkButton(text="📱 Открыть приложение", url=webapp_url)
-        )
-    except:
-        builder.row(
-            {"text": "📱 Открыть приложение", "url": webapp_url}
-        )
-    builder.row(
-        {"text": "ℹ️ Как работает", "payload": "how_it_works"}
-    )
-    builder.row(
-        {"text": "🤖 Умный помощник", "payload": "ai_assistant"}
-    )
-    
-    await send_event_message(event, text=help_text, attachments=[builder.as_markup()])
+    await send_event_message(event, text=HELP_TEXT, attachments=[MAIN_MENU_KEYBOARD])
 
 @router.message_created(Command("menu"))
 async def menu_command(event: MessageCreated, context: MemoryContext):
@@ -410,13 +411,19 @@ async def test_reminder_command(event: MessageCreated, context: MemoryContext):
     if chat_id and _scheduler:
         if context:
             _scheduler.add_user(chat_id, context)
-            try:
-                user_data = await context.get_data() or {}
-                _scheduler.update_user_data(chat_id, user_data)
-            except Exception as e:
-                logger.warning(f"Не удалось обновить данные пользователя: {e}")
         
-        await _scheduler.send_morning_reminder(chat_id)
+        # Через очередь исходящих, как и остальные сообщения бота: темп и порядок чата сохраняются
+        try:
+            text = await _scheduler.build_morning_reminder(chat_id)
+            if _outbox is not None:
+                await _outbox.send_message(event.bot, chat_id=chat_id, text=text)
+            else:
+                await event.bot.send_message(chat_id=chat_id, text=text)
+        except Exception as e:
+            logger.error(f"Ошибка отправки тестового напоминания в чат {chat_id}: {e}")
+            chat_id = None
+    
+    if chat_id and _scheduler:
         await send_event_message(
             event,
             "✅ Тестовое утреннее напоминание отправлено!"
@@ -427,37 +434,53 @@ async def test_reminder_command(event: MessageCreated, context: MemoryContext):
             "❌ Не удалось отправить тестовое напоминание. Проверьте логи."
         )
 
-@router.message_callback(F.callback.payload == "create_task")
-async def create_task_start(event: MessageCallback, context: MemoryContext):
-    await context.set_state(UserStates.waiting_task_description)
-    builder = InlineKeyboardBuilder()
-    builder.row({"text": "❌ Отмена", "payload": "back_to_main"})
+@router.message_created(Command("reminder"))
+async def reminder_command(event: MessageCreated, context: MemoryContext):
+    """Показать или изменить время утреннего напоминания: /reminder 08:30 [Europe/Moscow]"""
+    if not _scheduler:
+        await send_event_message(event, "❌ Напоминания сейчас недоступны.")
+        return
+    
+    chat_id, _ = event.get_ids()
+    text = (event.message.body.text if event.message.body else "") or ""
+    args = text.split()[1:]
+    
+    if args:
+        try:
+            hours, minutes = args[0].split(":")
+            reminder_time = time(int(hours), int(minutes))
+            tz_name = args[1] if len(args) > 1 else None
+            _scheduler.add_user(chat_id, context)
+            _scheduler.set_user_schedule(chat_id, tz_name, reminder_time)
+        except (ValueError, ZoneInfoNotFoundError):
+            await send_event_message(
+                event,
+                "❌ Не понял время. Пример: /reminder 08:30 или /reminder 08:30 Asia/Yekaterinburg"
+            )
+            return
     
+    tz_name, reminder_time = _scheduler.get_user_schedule(chat_id)
     await send_event_message(
         event,
-        "Опиши свою задачу одним сообщением.\n\n"
-        "Например: 'Подготовиться к экзамену по экономике'",
-        attachments=[builder.as_markup()]
+        f"⏰ Утреннее напоминание: {reminder_time:%H:%M} ({tz_name}).\n\n"
+        "Изменить: /reminder ЧЧ:ММ [часовой пояс]"
     )
 
+@router.message_callback(F.callback.payload == "create_task")
+async def create_task_start(event: MessageCallback, context: MemoryContext):
+    await context.set_state(UserStates.waiting_task_description)
+    await send_event_message(event, CREATE_TASK_TEXT, attachments=[CANCEL_KEYBOARD])
+
 @router.message_created(UserStates.waiting_task_description)
 async def handle_task_description(event: MessageCreated, context: MemoryContext):
-    task_desc = event.message.text
-    await context.set_data({"current_task": {"description": task_desc}})
+    task_desc = event.message.body.text
+    await context.update_data(current_task={"description": task_desc})
     await context.set_state(UserStates.waiting_deadline)
     
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        {"text": "📅 Указать дедлайн", "payload": "set_deadline"},
-        {"text": "➡️ Продолжить без", "payload": "no_deadline"}
-    )
-    builder.row({"text": "❌ Отмена", "payload": "back_to_main"})
-    
     await send_event_message(
         event,
-        f"Задача: {task_desc}\n\n"
-        f"Хочешь указать дедлайн? (опционально)",
-        attachments=[builder.as_markup()]
+        TASK_DESCRIPTION_TEXT.format(description=task_desc),
+        attachments=[DEADLINE_KEYBOARD]
     )
 
 @router.message_callback(F.callback.payload == "set_deadline")
@@ -471,7 +494,7 @@ async def set_deadline(event: MessageCallback, context: MemoryContext):
 
 @router.message_created(UserStates.waiting_deadline)
 async def handle_deadline(event: MessageCreated, context: MemoryContext):
-    deadline = event.message.text
+    deadline = event.message.body.text
     user_data = await context.get_data()
     current_task = user_data.get("current_task", {})
     current_task["deadline"] = deadline
@@ -479,7 +502,7 @@ async def handle_deadline(event: MessageCreated, context: MemoryContext):
     plan_steps = SAMPLE_PLANS.get("exam", ["Шаг 1", "Шаг 2", "Шаг 3"])
     current_task["subtasks"] = [{"title": step, "pomodoros": 2} for step in plan_steps]
     
-    await context.set_data({"current_task": current_task})
+    await context.update_data(current_task=current_task)
     await context.set_state(None)
     
     builder = InlineKeyboardBuilder()
@@ -495,164 +518,209 @@ async def handle_deadline(event: MessageCreated, context: MemoryContext):
     
     await send_event_message(event, text=plan_text, attachments=[builder.as_markup()])
 
-@router.message_callback(F.payload.startswith("view_step_"))
+@router.message_callback(F.callback.payload.startswith("view_step_"))
 async def view_step(event: MessageCallback, context: MemoryContext):
     step_num = int(event.callback.payload.split("_")[2])
     user_data = await context.get_data()
     subtasks = user_data.get("current_task", {}).get("subtasks", [])
     if step_num < len(subtasks):
         step = subtasks[step_num]
-        builder = InlineKeyboardBuilder()
-        builder.row({"text": "◀️ Назад к плану", "payload": "show_plan"})
         await send_event_message(
             event,
             f"Шаг {step_num + 1}: {step['title']}\n\nОценочное время: {step['pomodoros']} сессий Pomodoro",
-            attachments=[builder.as_markup()]
+            attachments=[BACK_TO_PLAN_KEYBOARD]
         )
 
+def _webapp_task(task: dict) -> dict:
+    """План из бота в формате задачи webapp (title, subTasks), чтобы его показало приложение"""
+    task_id = f"bot-{int(datetime.now().timestamp() * 1000)}"
+    subtasks = [
+        {
+            "id": f"{task_id}-{i + 1}",
+            "title": step["title"],
+            "estimatedPomodoros": step.get("pomodoros", 1),
+            "completed": False,
+            "completedPomodoros": 0,
+        }
+        for i, step in enumerate(task.get("subtasks", []))
+    ]
+    return {
+        "id": task_id,
+        "title": task.get("description") or "Задача без названия",
+        "deadline": task.get("deadline"),
+        "subTasks": subtasks,
+        "createdAt": datetime.now().isoformat(),
+        "totalPomodoros": sum(st["estimatedPomodoros"] for st in subtasks),
+        "completedPomodoros": 0,
+    }
+
 @router.message_callback(F.callback.payload == "save_task")
 async def save_task(event: MessageCallback, context: MemoryContext):
-    user_data = await context.get_data()
-    tasks = user_data.get("tasks", [])
-    current_task = user_data.get("current_task", {})
-    tasks.append(current_task)
-    user_data["tasks"] = tasks
-    await context.set_data(user_data)
+    """Сохранить план в задачи пользователя - общие с webapp"""
+    if _user_store is None:
+        await send_event_message(event, "❌ Сохранение задач сейчас недоступно. Используй веб-приложение.")
+        return
     
-    if _scheduler:
-        chat_id = None
-        try:
-            if hasattr(event, 'chat_id'):
-                chat_id = event.chat_id
-            elif hasattr(event, 'message') and hasattr(event.message, 'chat_id'):
-                chat_id = event.message.chat_id
-            elif hasattr(event, 'chat') and hasattr(event.chat, 'chat_id'):
-                chat_id = event.chat.chat_id
-            elif hasattr(event, 'message') and hasattr(event.message, 'recipient') and hasattr(event.message.recipient, 'chat_id'):
-                chat_id = event.message.recipient.chat_id
-        except Exception as e:
-            logger.warning(f"Ошибка получения chat_id в save_task: {e}")
-        
-        if chat_id:
-            _scheduler.update_user_data(chat_id, user_data)
-    
-    builder = InlineKeyboardBuilder()
-    builder.row({"text": "🍅 Начать первый шаг", "payload": "start_first_step"})
-    builder.row({"text": "📋 Посмотреть все задачи", "payload": "list_tasks"})
-    builder.row({"text": "◀️ Главное меню", "payload": "back_to_main"})
+    user_data = await context.get_data()
+    _, user_id = event.get_ids()
+    # индекс напоминаний узнаёт о новой задаче от слушателя хранилища
+    _user_store.apply(user_id, tasks=[_webapp_task(user_data.get("current_task") or {})])
+    await context.update_data(current_task={})
     
-    await send_event_message(
-        event,
-        "✅ План сохранен!\n\nГотов начать работу?",
-        attachments=[builder.as_markup()]
-    )
+    await send_event_message(event, TASK_SAVED_TEXT, attachments=[TASK_SAVED_KEYBOARD])
 
 @router.message_callback(F.callback.payload == "quick_pomodoro")
 async def quick_pomodoro(event: MessageCallback, context: MemoryContext):
     await context.set_state(UserStates.waiting_task_description)
-    builder = InlineKeyboardBuilder()
-    builder.row({"text": "❌ Отмена", "payload": "back_to_main"})
-    await send_event_message(
-        event,
-        "Для быстрой сессии: опиши, на чем фокусируешься (например: 'Чтение статьи')",
-        attachments=[builder.as_markup()]
-    )
+    await send_event_message(event, QUICK_POMODORO_TEXT, attachments=[CANCEL_KEYBOARD])
 
 
 @router.message_callback(F.callback.payload == "how_it_works")
 async def how_it_works(event: MessageCallback):
-    builder = InlineKeyboardBuilder()
-    webapp_url = "https://max.ru/t122_hakaton_bot?startapp"
-    try:
-        builder.row(
-            LinkButton(text="📱 Открыть приложение", url=webapp_url)
-        )
-    except:
-        builder.row(
-            {"text": "📱 Открыть приложение", "url": webapp_url}
-        )
-    builder.row({"text": "◀️ Назад", "payload": "back_to_main"})
-    
-    how_it_works_text = """🍅 Как работает FocusHelper:
+    await send_event_message(event, HOW_IT_WORKS_TEXT, attachments=[HOW_IT_WORKS_KEYBOARD])
 
-📋 Работа с задачами:
-• Создай задачу в веб-приложении
-• Приложение разобьет её на шаги
-• Каждый шаг можно выполнить за несколько Pomodoro сессий
-
-⏱️ Pomodoro техника:
-1. Выбери задачу или шаг
-2. Работай 25 минут без отвлечений
-3. Отдохни 5 минут
-4. После 4 сессий - длинный перерыв 15-30 минут
-
-📊 Статистика и мотивация:
-• Отслеживай свой прогресс
-• Получай достижения за активность
-• Повышай уровень и зарабатывай XP
+@router.message_callback(F.callback.payload == "back_to_main")
+async def back_to_main(event: MessageCallback, context: MemoryContext):
+    await context.set_state(None)
+    await send_event_message(event, text=MAIN_MENU_TEXT, attachments=[MAIN_MENU_KEYBOARD])
 
-⏰ Утренние напоминания:
-• Каждый день в 9:00 утра я напомню о незавершенных делах
-• Это поможет не забыть важные задачи
+def _record_session(user_id: int, minutes: float):
+    """Засчитать завершённую сессию в статистику (как в webapp): +10 XP, новый уровень каждые 100 XP"""
+    if _user_store is None:
+        return
+    _user_store.add_session(user_id, minutes, xp=SESSION_XP)
 
-📱 Используй веб-приложение для полного функционала!"""
+@router.message_callback(F.callback.payload == "complete_session")
+async def complete_session(event: MessageCallback, context: MemoryContext):
+    chat_id, user_id = event.get_ids()
+    if _pomodoro is None:
+        _record_session(user_id, POMODORO_MINUTES)
+    else:
+        # Таймера нет - сессию уже засчитал finish_pomodoro (или её не было): второй раз не считаем
+        timer = _pomodoro.cancel(chat_id)
+        if timer is not None:
+            _record_session(user_id, (timer.duration - timer.left(_pomodoro.clock.time())) / 60)
+    await context.set_state(None)
     
     await send_event_message(
         event,
-        how_it_works_text,
-        attachments=[builder.as_markup()]
+        SESSION_COMPLETED_TEXT,
+        attachments=[SESSION_FINISHED_KEYBOARD]
     )
 
-@router.message_callback(F.callback.payload == "back_to_main")
-async def back_to_main(event: MessageCallback, context: MemoryContext):
-    await context.set_state(None)
-    builder = InlineKeyboardBuilder()
-    webapp_url = "https://max.ru/t122_hakaton_bot?startapp"
-    try:
-        builder.row(
-            LinkButton(text="📱 Открыть приложение", url=webapp_url)
-        )
-    except:
-        builder.row(
-            {"text": "📱 Открыть приложение", "url": webapp_url}
-        )
-    builder.row(
-        {"text": "ℹ️ Как работает", "payload": "how_it_works"}
-    )
-    builder.row(
-        {"text": "🤖 Умный помощник", "payload": "ai_assistant"}
+async def finish_pomodoro(bot, context: MemoryContext, timer):
+    """Таймер сессии истёк: засчитать сессию и сообщить пользователю"""
+    _record_session(timer.user_id, timer.duration / 60)
+    if await context.get_state() == UserStates.pomodoro_active:
+        await context.set_state(None)
+    text = SESSION_TIME_UP_TEXT.format(title=timer.title)
+    if _outbox is not None:
+        await _outbox.send_message(bot, chat_id=timer.chat_id, text=text, attachments=[SESSION_FINISHED_KEYBOARD])
+        return
+    await bot.send_message(chat_id=timer.chat_id, text=text, attachments=[SESSION_FINISHED_KEYBOARD])
+
+@router.message_callback(F.callback.payload == "start_first_step")
+async def start_first_step(event: MessageCallback, context: MemoryContext):
+    """Запустить сессию Pomodoro по первому шагу последней сохранённой задачи"""
+    if _pomodoro is None:
+        await send_event_message(event, "❌ Таймер сейчас недоступен. Используй веб-приложение.")
+        return
+    
+    chat_id, user_id = event.get_ids()
+    tasks = _user_store.tasks(user_id) if _user_store is not None else []
+    subtasks = (tasks[-1].get("subTasks") or tasks[-1].get("subtasks") or []) if tasks else []
+    step = next((st for st in subtasks if not st.get("completed")), None)
+    title = step["title"] if step else "Фокус-сессия"
+    
+    _pomodoro.start(chat_id, user_id, title, POMODORO_MINUTES * 60)
+    await context.set_state(UserStates.pomodoro_active)
+    await send_event_message(
+        event,
+        SESSION_STARTED_TEXT.format(title=title, minutes=POMODORO_MINUTES),
+        attachments=[POMODORO_RUNNING_KEYBOARD]
     )
 
-    welcome_text = """🎯 FocusHelper!
-
-📱 Открой веб-приложение для работы с задачами!"""
+@router.message_callback(F.callback.payload == "pomodoro_pause")
+async def pomodoro_pause(event: MessageCallback, context: MemoryContext):
+    chat_id, _ = event.get_ids()
+    timer = _pomodoro.pause(chat_id) if _pomodoro is not None else None
+    if timer is None:
+        await send_event_message(event, NO_ACTIVE_SESSION_TEXT, attachments=[SESSION_FINISHED_KEYBOARD])
+        return
+    await send_event_message(
+        event,
+        SESSION_PAUSED_TEXT.format(minutes=timer.remaining / 60),
+        attachments=[POMODORO_PAUSED_KEYBOARD]
+    )
 
-    await send_event_message(event, text=welcome_text, attachments=builder.as_markup())
+@router.message_callback(F.callback.payload == "pomodoro_resume")
+async def pomodoro_resume(event: MessageCallback, context: MemoryContext):
+    chat_id, _ = event.get_ids()
+    timer = _pomodoro.resume(chat_id) if _pomodoro is not None else None
+    if timer is None:
+        await send_event_message(event, NO_ACTIVE_SESSION_TEXT, attachments=[SESSION_FINISHED_KEYBOARD])
+        return
+    await send_event_message(
+        event,
+        SESSION_RESUMED_TEXT.format(minutes=timer.left(_pomodoro.clock.time()) / 60),
+        attachments=[POMODORO_RUNNING_KEYBOARD]
+    )
 
-@router.message_callback(F.callback.payload == "complete_session")
-async def complete_session(event: MessageCallback, context: MemoryContext):
-    user_data = await context.get_data()
-    user_data["total_sessions"] += 1
-    if user_data["total_sessions"] % 10 == 0:
-        user_data["level"] += 1
-    await context.set_data(user_data)
-    
-    builder = InlineKeyboardBuilder()
-    builder.row({"text": "🍅 Новая сессия", "payload": "quick_pomodoro"})
+@router.message_callback(F.callback.payload == "pomodoro_cancel")
+async def pomodoro_cancel(event: MessageCallback, context: MemoryContext):
+    chat_id, _ = event.get_ids()
+    if _pomodoro is not None:
+        _pomodoro.cancel(chat_id)
+    await context.set_state(None)
     await send_event_message(
         event,
-        "🎉 Сессия завершена! +10 XP\n\nОтдохни и продолжи!",
-        attachments=[builder.as_markup()]
+        SESSION_CANCELLED_TEXT,
+        attachments=[SESSION_FINISHED_KEYBOARD]
     )
 
-async def ask_openrouter(question: str) -> str:
-    """Отправка запроса в OpenRouter API с fallback на несколько моделей"""
-    api_key = os.getenv('OPENROUTER_API_KEY')
-    if not api_key:
-        logger.error("OPENROUTER_API_KEY не установлен в переменных окружения")
-        return "❌ Ошибка: API ключ не настроен. Обратитесь к администратору."
-    
-    url = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# Список моделей для попыток (в порядке приоритета)
+OPENROUTER_MODELS = [
+    "anthropic/claude-3-haiku",  # Быстрая и доступная модель
+    "meta-llama/llama-3.2-3b-instruct",  # Бесплатная модель
+    "mistralai/mistral-7b-instruct",  # Бесплатная модель
+    "google/gemini-pro",  # Gemini Pro
+]
+
+# Через сколько секунд без ответа запускать следующую модель параллельно
+OPENROUTER_HEDGE_DELAY = float(os.getenv("OPENROUTER_HEDGE_DELAY", 4.0))
+# На сколько секунд исключать модель после ошибки региона или 404
+OPENROUTER_MODEL_COOLDOWN = float(os.getenv("OPENROUTER_MODEL_COOLDOWN", 600.0))
+OPENROUTER_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", 30.0))
+# Потоковый ответ не ограничен по времени целиком: обрывается, только если модель молчит столько секунд
+OPENROUTER_STREAM_READ_TIMEOUT = float(os.getenv("OPENROUTER_STREAM_READ_TIMEOUT", 30.0))
+
+_openrouter_session: aiohttp.ClientSession | None = None
+_model_cooldowns: dict[str, float] = {}
+
+def _get_openrouter_session() -> aiohttp.ClientSession:
+    """Общая сессия с пулом соединений к OpenRouter"""
+    global _openrouter_session
+    if _openrouter_session is None or _openrouter_session.closed:
+        _openrouter_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=OPENROUTER_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=50, ttl_dns_cache=300),
+        )
+    return _openrouter_session
+
+async def close_openrouter_session():
+    """Закрыть общую сессию OpenRouter (при остановке бота)"""
+    global _openrouter_session
+    if _openrouter_session is not None and not _openrouter_session.closed:
+        await _openrouter_session.close()
+    _openrouter_session = None
+
+OPENROUTER_NO_KEY_TEXT = "❌ Ошибка: API ключ не настроен. Обратитесь к администратору."
+OPENROUTER_FAILED_TEXT = "❌ Не удалось получить ответ от AI. Все доступные модели недоступны. Попробуйте позже."
+
+def _openrouter_request(api_key: str, question: str) -> tuple[dict, list]:
+    """Заголовки и сообщения запроса к OpenRouter"""
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
@@ -660,14 +728,6 @@ async def ask_openrouter(question: str) -> str:
         "X-Title": "FocusHelper Bot"
     }
     
-    # Список моделей для попыток (в порядке приоритета)
-    models = [
-        "anthropic/claude-3-haiku",  # Быстрая и доступная модель
-        "meta-llama/llama-3.2-3b-instruct",  # Бесплатная модель
-        "mistralai/mistral-7b-instruct",  # Бесплатная модель
-        "google/gemini-pro",  # Gemini Pro
-    ]
-    
     system_message = {
         "role": "system",
         "content": "Ты умный помощник в боте FocusHelper. Помогай пользователям с вопросами о продуктивности, планировании задач, технике Pomodoro и других вопросах. Отвечай кратко и по делу."
@@ -677,76 +737,237 @@ async def ask_openrouter(question: str) -> str:
         "role": "user",
         "content": question
     }
+    return headers, [system_message, user_message]
+
+def _cool_down_model(model: str, reason: str):
+    _model_cooldowns[model] = asyncio.get_running_loop().time() + OPENROUTER_MODEL_COOLDOWN
+    logger.info(f"Модель {model} исключена на {OPENROUTER_MODEL_COOLDOWN:.0f} с: {reason}")
+
+def _available_models() -> list[str]:
+    now = asyncio.get_running_loop().time()
+    models = [m for m in OPENROUTER_MODELS if _model_cooldowns.get(m, 0) <= now]
+    # Если все модели на паузе, пробуем все, чем не отвечать вовсе
+    return models or list(OPENROUTER_MODELS)
+
+async def _ask_model(model: str, messages: list, headers: dict) -> str | None:
+    """Запрос к одной модели. Возвращает текст ответа или None при ошибке"""
+    logger.debug("Пробую модель: %s", model)
+    payload = {"model": model, "messages": messages}
+    started = perf_counter()
+    # отменённый хеджированием запрос так и останется cancelled
+    outcome = "cancelled"
+    try:
+        async with _get_openrouter_session().post(OPENROUTER_URL, json=payload, headers=headers) as response:
+            if response.status == 200:
+                data = await response.json()
+                if 'choices' in data and len(data['choices']) > 0:
+                    logger.debug("Успешно получен ответ от модели %s", model)
+                    outcome = "ok"
+                    OPENROUTER_SECONDS.labels(model).observe(perf_counter() - started)
+                    return data['choices'][0]['message']['content']
+                logger.error(f"Неожиданный формат ответа от OpenRouter: {data}")
+                outcome = "bad_response"
+                return None
+
+            outcome = f"http_{response.status}"
+            error_text = await response.text()
+            logger.warning(f"Ошибка OpenRouter API для модели {model}: {response.status} - {error_text}")
+
+            # Ошибка региона или 404 (модель не найдена) - не пробуем модель какое-то время
+            if response.status == 404:
+                _cool_down_model(model, "модель не найдена")
+                return None
+            try:
+                error_msg = json.loads(error_text).get('error', {}).get('message', '')
+                if 'country' in error_msg.lower() or 'region' in error_msg.lower() or 'territory' in error_msg.lower():
+                    _cool_down_model(model, "не поддерживает регион")
+            except Exception:
+                pass
+            return None
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        logger.warning(f"Таймаут при запросе к модели {model}")
+        return None
+    except Exception as e:
+        outcome = "error"
+        logger.warning(f"Ошибка при запросе к модели {model}: {e}")
+        return None
+    finally:
+        OPENROUTER_REQUESTS.labels(model, outcome).inc()
+
+async def ask_openrouter(question: str) -> str:
+    """
+    Отправка запроса в OpenRouter API с хеджированием по нескольким моделям:
+    если основная модель не ответила за OPENROUTER_HEDGE_DELAY секунд или ответила ошибкой,
+    параллельно запускается следующая; берётся первый успешный ответ, остальные запросы отменяются
+    """
+    api_key = os.getenv('OPENROUTER_API_KEY')
+    if not api_key:
+        logger.error("OPENROUTER_API_KEY не установлен в переменных окружения")
+        OPENROUTER_ANSWERS.labels("no_key").inc()
+        return OPENROUTER_NO_KEY_TEXT
     
-    # Пробуем каждую модель по очереди
-    for model in models:
-        try:
-            logger.info(f"Пробую модель: {model}")
-            payload = {
-                "model": model,
-                "messages": [system_message, user_message]
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if 'choices' in data and len(data['choices']) > 0:
-                            logger.info(f"Успешно получен ответ от модели {model}")
-                            return data['choices'][0]['message']['content']
-                        else:
-                            logger.error(f"Неожиданный формат ответа от OpenRouter: {data}")
-                            continue  # Пробуем следующую модель
-                    else:
-                        error_text = await response.text()
-                        logger.warning(f"Ошибка OpenRouter API для модели {model}: {response.status} - {error_text}")
-                        
-                        # Если это ошибка региона, пробуем следующую модель
-                        try:
-                            error_data = json.loads(error_text)
-                            error_msg = error_data.get('error', {}).get('message', '')
-                            if 'country' in error_msg.lower() or 'region' in error_msg.lower() or 'territory' in error_msg.lower():
-                                logger.info(f"Модель {model} не поддерживает регион, пробую следующую")
-                                continue
-                        except:
-                            pass
-                        
-                        # Если это 404 (модель не найдена), пробуем следующую
-                        if response.status == 404:
-                            logger.info(f"Модель {model} не найдена, пробую следующую")
-                            continue
-                        
-                        # Для других ошибок пробуем следующую модель
-                        continue
-        except asyncio.TimeoutError:
-            logger.warning(f"Таймаут при запросе к модели {model}, пробую следующую")
-            continue
-        except Exception as e:
-            logger.warning(f"Ошибка при запросе к модели {model}: {e}, пробую следующую")
-            continue
+    headers, messages = _openrouter_request(api_key, question)
+    
+    models = iter(_available_models())
+    pending: set[asyncio.Task] = set()
+
+    def launch_next() -> bool:
+        model = next(models, None)
+        if model is None:
+            return False
+        pending.add(asyncio.create_task(_ask_model(model, messages, headers)))
+        return True
+
+    launch_next()
+    primary = next(iter(pending))
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=OPENROUTER_HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                answer = task.result()
+                if answer:
+                    OPENROUTER_ANSWERS.labels("primary" if task is primary else "fallback").inc()
+                    return answer
+            # Таймаут хеджирования или ошибка модели - подключаем следующую
+            launch_next()
+    finally:
+        for task in pending:
+            task.cancel()
     
     # Если все модели не сработали
-    return "❌ Не удалось получить ответ от AI. Все доступные модели недоступны. Попробуйте позже."
+    OPENROUTER_ANSWERS.labels("failed").inc()
+    return OPENROUTER_FAILED_TEXT
+
+class StreamInterrupted(Exception):
+    """Потоковый ответ модели оборвался после того, как часть текста уже отдана"""
+
+async def _stream_model(model: str, messages: list, headers: dict):
+    """
+    Потоковый запрос к одной модели: куски текста по мере генерации. Пустой поток при ошибке
+    до первого куска; ошибка после него - StreamInterrupted
+    """
+    logger.debug("Пробую модель (стриминг): %s", model)
+    payload = {"model": model, "messages": messages, "stream": True}
+    timeout = aiohttp.ClientTimeout(total=None, connect=OPENROUTER_TIMEOUT, sock_read=OPENROUTER_STREAM_READ_TIMEOUT)
+    started = perf_counter()
+    outcome = "cancelled"
+    first = True
+    try:
+        async with _get_openrouter_session().post(
+            OPENROUTER_URL, json=payload, headers=headers, timeout=timeout
+        ) as response:
+            if response.status != 200:
+                outcome = f"http_{response.status}"
+                error_text = await response.text()
+                logger.warning(f"Ошибка OpenRouter API для модели {model}: {response.status} - {error_text}")
+                if response.status == 404:
+                    _cool_down_model(model, "модель не найдена")
+                elif any(word in error_text.lower() for word in ('country', 'region', 'territory')):
+                    _cool_down_model(model, "не поддерживает регион")
+                return
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    if first:
+                        first = False
+                        OPENROUTER_SECONDS.labels(model).observe(perf_counter() - started)
+                    yield delta
+            outcome = "ok" if not first else "bad_response"
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        logger.warning(f"Таймаут при запросе к модели {model}")
+        if not first:
+            raise StreamInterrupted(f"модель {model} молчит дольше {OPENROUTER_STREAM_READ_TIMEOUT:.0f} с") from None
+    except Exception as e:
+        outcome = "error"
+        logger.warning(f"Ошибка при запросе к модели {model}: {e}")
+        if not first:
+            raise StreamInterrupted(f"модель {model}: {e}") from e
+    finally:
+        OPENROUTER_REQUESTS.labels(model, outcome).inc()
+
+async def ask_openrouter_stream(question: str):
+    """
+    Потоковый вариант ask_openrouter: отдаёт ответ кусками по мере генерации.
+    Хеджирование работает по первому куску: следующая модель запускается, если текущая
+    молчит OPENROUTER_HEDGE_DELAY секунд или ответила ошибкой; дальше читается поток победителя
+    """
+    api_key = os.getenv('OPENROUTER_API_KEY')
+    if not api_key:
+        logger.error("OPENROUTER_API_KEY не установлен в переменных окружения")
+        OPENROUTER_ANSWERS.labels("no_key").inc()
+        yield OPENROUTER_NO_KEY_TEXT
+        return
+
+    headers, messages = _openrouter_request(api_key, question)
+    models = iter(_available_models())
+    starts: dict[asyncio.Task, object] = {}
+
+    def launch_next() -> bool:
+        model = next(models, None)
+        if model is None:
+            return False
+        stream = _stream_model(model, messages, headers)
+        starts[asyncio.create_task(anext(stream, None))] = stream
+        return True
+
+    async def discard(task: asyncio.Task):
+        stream = starts.pop(task)
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        await stream.aclose()
+
+    winner = None
+    launch_next()
+    primary = next(iter(starts))
+    try:
+        while starts and winner is None:
+            done, _ = await asyncio.wait(
+                list(starts), timeout=OPENROUTER_HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                first = task.result()
+                if first and winner is None:
+                    winner = (starts.pop(task), first)
+                    OPENROUTER_ANSWERS.labels("primary" if task is primary else "fallback").inc()
+                else:
+                    await discard(task)
+            if winner is None:
+                launch_next()
+    finally:
+        for task in list(starts):
+            await discard(task)
+
+    if winner is None:
+        OPENROUTER_ANSWERS.labels("failed").inc()
+        yield OPENROUTER_FAILED_TEXT
+        return
+
+    stream, first = winner
+    try:
+        yield first
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
 
 @router.message_callback(F.callback.payload == "ai_assistant")
 async def ai_assistant_handler(event: MessageCallback, context: MemoryContext):
     """Обработчик кнопки 'Умный помощник'"""
-    logger.info("Кнопка 'Умный помощник' нажата, устанавливаю состояние")
     await context.set_state(UserStates.waiting_ai_question)
+    logger.debug("Включён режим AI помощника для %s", event.get_ids())
     
-    # Проверяем, что состояние установлено
-    current_state = await context.get_state()
-    logger.info(f"Текущее состояние после установки: {current_state}")
-    
-    builder = InlineKeyboardBuilder()
-    builder.row({"text": "◀️ Выйти из чата", "payload": "back_to_main"})
-    
-    await send_event_message(
-        event,
-        "🤖 Привет! Я умный помощник. Задай мне любой вопрос, и я постараюсь помочь!\n\n"
-        "Например:\n"
-        "• Как лучше планировать задачи?\n"
-        "• Что такое техника Pomodoro?\n"
-        "• Как повысить продуктивность?",
-        attachments=[builder.as_markup()]
-    )
\ No newline at end of file
+    await send_event_message(event, AI_GREETING_TEXT, attachments=[AI_CHAT_KEYBOARD])
\ No newline at end of file
@@ -1,5 +1,6 @@
 """
-Запуск API сервера для синхронизации данных между webapp и ботом
+Запуск только API сервера синхронизации, без бота (для разработки webapp).
+В работе API запускается вместе с ботом из main.py
 """
 import os
 import uvicorn
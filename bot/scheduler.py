@@ -1,123 +1,326 @@
 import asyncio
 import logging
-from datetime import datetime, time
-from typing import Set, Dict
+import os
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
 from maxapi import Bot
 from maxapi.context import MemoryContext
+import metrics
+from fanout import Fanout, FanoutReport, create_fanout_from_env
+from subscribers import Subscriber, SubscriberRegistry
+from task_index import IncompleteTaskIndex, TaskLoader, create_index_from_env
+from timers import DeadlineHeap, SystemClock, sleep_or_wakeup
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_TIMEZONE = os.getenv("REMINDER_TIMEZONE", "Europe/Moscow")
+DEFAULT_REMINDER_TIME = time(9, 0)
+
+REMINDER_LATENESS = metrics.histogram(
+    "focus_reminder_lateness_seconds", "Насколько позже назначенного времени сработало напоминание, с",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0),
+)
+REMINDERS = metrics.counter("focus_reminders_total", "Итоги рассылки утренних напоминаний", ["outcome"])
+REMINDER_FANOUT_SECONDS = metrics.histogram(
+    "focus_reminder_fanout_seconds", "Длительность одной рассылки напоминаний, с",
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0),
+)
+
+def next_fire_time(tz: ZoneInfo, at: time, after: float) -> float:
+    """
+    Ближайший момент (время Unix) строго после after, когда в зоне tz наступает время at.
+    Несуществующее при переводе часов вперёд время сдвигается на величину перевода,
+    а повторяющееся при переводе назад срабатывает один раз (в первый раз)
+    """
+    local_day = datetime.fromtimestamp(after, tz).date()
+    for offset in range(3):
+        day = local_day + timedelta(days=offset)
+        candidate = datetime.combine(day, at, tzinfo=tz).timestamp()
+        if candidate > after:
+            return candidate
+    raise ValueError("Не удалось вычислить время напоминания")
+
 class ReminderScheduler:
-    """Планировщик напоминаний"""
+    """
+    Планировщик напоминаний.
+
+    Время следующего напоминания каждого пользователя хранится в мин-куче;
+    цикл спит ровно до ближайшего срабатывания и просыпается раньше,
+    если расписание изменилось. Часы (clock) можно подменить в тестах.
+    Наступившие напоминания рассылаются параллельно через Fanout.
+
+    Контексты и данные пользователей не хранятся: сводки задач лежат в
+    ограниченном индексе, а при промахе перечитываются через task_loader.
+    Подписчики и их расписания сохраняются в registry и восстанавливаются
+    при запуске
+    """
     
-    def __init__(self, bot: Bot):
+    def __init__(
+        self,
+        bot: Bot,
+        clock=None,
+        fanout: Optional[Fanout] = None,
+        task_loader: Optional[TaskLoader] = None,
+        task_index: Optional[IncompleteTaskIndex] = None,
+        registry: Optional[SubscriberRegistry] = None,
+    ):
         self.bot = bot
+        self.clock = clock or SystemClock()
+        self.fanout = fanout or create_fanout_from_env()
+        self.last_report: Optional[FanoutReport] = None
         self.active_users: Set[int] = set()
-        self.user_contexts: Dict[int, MemoryContext] = {}
-        self.user_data_cache: Dict[int, dict] = {}
+        self.chat_by_user: Dict[int, int] = {}
+        self.user_by_chat: Dict[int, int] = {}
+        self.task_index = task_index if task_index is not None else create_index_from_env(task_loader)
+        self.schedules: Dict[int, Tuple[str, time]] = {}
+        self.timers: DeadlineHeap[int] = DeadlineHeap()
+        self.registry = registry
+        self._wakeup = asyncio.Event()
         self.running = False
+        self._task: Optional[asyncio.Task] = None
+        # идущие рассылки: stop() дожидается их, прежде чем закрыть реестр
+        self._sends: Set[asyncio.Task] = set()
+        self._compaction: Optional[asyncio.Task] = None
         
-    def add_user(self, chat_id: int, context: MemoryContext = None):
-        """Добавить пользователя для получения напоминаний"""
+    def add_user(self, chat_id: int, context: MemoryContext = None, user_id: Optional[int] = None):
+        """
+        Добавить пользователя для получения напоминаний. Связь чата с пользователем
+        (user_id или context.user_id) сохраняется в реестре: по ней ищутся задачи
+        пользователя, сам chat_id за user_id не принимается
+        """
+        if user_id is None and context is not None:
+            user_id = context.user_id
+        changed = chat_id not in self.active_users
         self.active_users.add(chat_id)
-        if context:
-            self.user_contexts[chat_id] = context
-        logger.info(f"Пользователь {chat_id} добавлен в список напоминаний")
+        if user_id is not None and self.user_by_chat.get(chat_id) != user_id:
+            self.chat_by_user[user_id] = chat_id
+            self.user_by_chat[chat_id] = user_id
+            changed = True
+        if chat_id not in self.timers:
+            self._reschedule(chat_id)
+        if changed:
+            self._persist(chat_id)
+            logger.info(f"Пользователь {chat_id} добавлен в список напоминаний")
+    
+    def set_user_schedule(self, chat_id: int, tz_name: Optional[str] = None, reminder_time: Optional[time] = None):
+        """Задать часовой пояс и/или время напоминания пользователя и перепланировать его"""
+        current_tz, current_time = self.schedules.get(chat_id, (DEFAULT_TIMEZONE, DEFAULT_REMINDER_TIME))
+        if tz_name is not None:
+            ZoneInfo(tz_name)  # ZoneInfoNotFoundError для неизвестного пояса
+            current_tz = tz_name
+        if reminder_time is not None:
+            current_time = reminder_time
+        self.schedules[chat_id] = (current_tz, current_time)
+        if chat_id in self.active_users:
+            self._reschedule(chat_id)
+            self._persist(chat_id)
+        logger.info(f"Расписание напоминаний пользователя {chat_id}: {current_time:%H:%M} {current_tz}")
+    
+    def get_user_schedule(self, chat_id: int) -> Tuple[str, time]:
+        return self.schedules.get(chat_id, (DEFAULT_TIMEZONE, DEFAULT_REMINDER_TIME))
+    
+    def _reschedule(self, chat_id: int, after: Optional[float] = None):
+        tz_name, at = self.get_user_schedule(chat_id)
+        if after is None:
+            after = self.clock.time()
+        self.timers.schedule(chat_id, next_fire_time(ZoneInfo(tz_name), at, after))
+        self._wakeup.set()
+    
+    def _persist(self, chat_id: int):
+        """Записать подписчика в журнал реестра; при разросшемся журнале - новый снимок в фоне"""
+        if self.registry is None:
+            return
+        tz_name, at = self.get_user_schedule(chat_id)
+        try:
+            self.registry.add(chat_id, self.user_by_chat.get(chat_id), tz_name, at)
+            if self.registry.needs_compaction() and self._compaction is None:
+                self._start_compaction()
+        except OSError as e:
+            logger.error(f"Не удалось сохранить подписчика {chat_id}: {e}")
+    
+    def _start_compaction(self):
+        """
+        Новый снимок реестра вне цикла событий: журнал переключается и состояние
+        копируется здесь же (копии словарей), а разбор и запись снимка с fsync идут в потоке
+        """
+        self.registry.rotate_log()
+        rows = self._subscriber_rows(list(self.active_users), self.user_by_chat.copy(), self.schedules.copy())
+        self._compaction = asyncio.create_task(self._compact(rows))
+    
+    async def _compact(self, rows: Iterator[Subscriber]):
+        try:
+            count = await asyncio.to_thread(self.registry.write_snapshot, rows)
+            self.registry.finish_compaction(count)
+        except OSError as e:
+            # отложенный журнал остаётся на диске и войдёт в следующий снимок
+            logger.error(f"Не удалось записать снимок подписчиков: {e}")
+        finally:
+            self._compaction = None
+    
+    def _subscriber_rows(self, chat_ids=None, user_by_chat=None, schedules=None) -> Iterator[Subscriber]:
+        user_by_chat = self.user_by_chat if user_by_chat is None else user_by_chat
+        schedules = self.schedules if schedules is None else schedules
+        default = (DEFAULT_TIMEZONE, DEFAULT_REMINDER_TIME)
+        for chat_id in self.active_users if chat_ids is None else chat_ids:
+            tz_name, at = schedules.get(chat_id, default)
+            yield chat_id, user_by_chat.get(chat_id), tz_name, at
+    
+    def load_subscribers(self) -> int:
+        """
+        Восстановить подписчиков и их расписания из реестра. Время следующего
+        напоминания считается один раз на каждую пару (пояс, время), а куча
+        таймеров строится целиком - загрузка линейна по числу подписчиков
+        """
+        if self.registry is None:
+            return 0
+        now = self.clock.time()
+        fire_times: Dict[Tuple[str, time], float] = {}
+        due = []
+        for chat_id, user_id, tz_name, at in self.registry.load():
+            self.active_users.add(chat_id)
+            if user_id is not None:
+                self.chat_by_user[user_id] = chat_id
+                self.user_by_chat[chat_id] = user_id
+            schedule = (tz_name, at)
+            if schedule != (DEFAULT_TIMEZONE, DEFAULT_REMINDER_TIME):
+                self.schedules[chat_id] = schedule
+            fire_at = fire_times.get(schedule)
+            if fire_at is None:
+                fire_at = fire_times[schedule] = next_fire_time(ZoneInfo(tz_name), at, now)
+            due.append((chat_id, fire_at))
+        self.timers.schedule_many(due)
+        self._wakeup.set()
+        if self.registry.needs_compaction():
+            self.registry.compact(self._subscriber_rows())
+        logger.info(f"Загружено подписчиков напоминаний: {len(due)}")
+        return len(due)
+    
+    def update_user_data(self, chat_id: int, user_data: dict, changed_tasks: Optional[List[dict]] = None):
+        """
+        Обновить сводку незавершённых задач пользователя: по changed_tasks,
+        если известно, какие задачи изменились, иначе по всему списку задач
+        """
+        if changed_tasks is None:
+            self.task_index.replace(chat_id, user_data.get("tasks", []))
+        else:
+            self.task_index.apply(chat_id, changed_tasks)
     
-    def update_user_data(self, chat_id: int, user_data: dict):
-        """Обновить кэш данных пользователя"""
-        self.user_data_cache[chat_id] = user_data
+    def on_sync(self, user_id: int, changed_tasks: List[Dict[str, Any]], deleted_task_ids: Iterable[Any]):
+        """Учесть задачи, пришедшие синхронизацией из webapp (слушатель sync_api)"""
+        chat_id = self.chat_by_user.get(user_id)
+        if chat_id is None:
+            # пользователь не подписан на напоминания (или его чат неизвестен) - индексировать некому
+            return
+        self.task_index.apply(chat_id, changed_tasks, deleted_task_ids)
     
     def remove_user(self, chat_id: int):
         """Удалить пользователя из списка напоминаний"""
+        if chat_id in self.active_users and self.registry is not None:
+            try:
+                self.registry.remove(chat_id)
+            except OSError as e:
+                logger.error(f"Не удалось удалить подписчика {chat_id} из реестра: {e}")
         self.active_users.discard(chat_id)
-        self.user_contexts.pop(chat_id, None)
+        user_id = self.user_by_chat.pop(chat_id, None)
+        if user_id is not None:
+            self.chat_by_user.pop(user_id, None)
+        self.task_index.remove(chat_id)
+        self.timers.cancel(chat_id)
         logger.info(f"Пользователь {chat_id} удален из списка напоминаний")
     
-    async def get_user_tasks(self, chat_id: int, context: MemoryContext = None) -> list:
-        """Получить задачи пользователя"""
-        try:
-            user_data = None
-            
-            if chat_id in self.user_data_cache:
-                user_data = self.user_data_cache[chat_id]
-            
-            if not user_data and context:
-                try:
-                    user_data = await context.get_data()
-                    if user_data:
-                        self.user_data_cache[chat_id] = user_data
-                except Exception as e:
-                    logger.warning(f"Не удалось получить данные из контекста для {chat_id}: {e}")
-            
-            if not user_data:
-                user_data = {}
-            
-            tasks = user_data.get("tasks", [])
-            incomplete_tasks = []
-            for task in tasks:
-                subtasks = task.get("subtasks", [])
-                incomplete_subtasks = [st for st in subtasks if not st.get("completed", False)]
-                if incomplete_subtasks:
-                    incomplete_tasks.append(task)
+    async def build_morning_reminder(self, chat_id: int) -> str:
+        """Текст утреннего напоминания пользователю"""
+        count, titles = await self.task_index.summary(chat_id)
+        
+        if count:
+            tasks_text = "\n".join([f"• {title}" for title in titles])
+            if count > len(titles):
+                tasks_text += f"\n... и еще {count - len(titles)} задач"
             
-            return incomplete_tasks
-        except Exception as e:
-            logger.error(f"Ошибка получения задач пользователя {chat_id}: {e}")
-            return []
+            return f"🌅 Доброе утро!\n\nПроверьте, может у вас есть незавершенные дела или вы хотите начать новое?\n\n📋 Ваши незавершенные задачи:\n{tasks_text}\n\n🎯 Используйте /start для работы с задачами!"
+        return "🌅 Доброе утро!\n\nПроверьте, может у вас есть незавершенные дела или вы хотите начать новое?\n\n🎯 Используйте /start для создания новых задач!"
+    
+    async def _send_reminder_message(self, chat_id: int):
+        message = await self.build_morning_reminder(chat_id)
+        return await self.bot.send_message(chat_id=chat_id, text=message)
     
     async def send_morning_reminder(self, chat_id: int):
-        """Отправить утреннее напоминание пользователю"""
+        """Отправить утреннее напоминание одному пользователю"""
         try:
-            context = self.user_contexts.get(chat_id)
-            tasks = await self.get_user_tasks(chat_id, context)
-            
-            if tasks:
-                tasks_text = "\n".join([f"• {task.get('description', 'Задача без названия')}" for task in tasks[:5]])
-                if len(tasks) > 5:
-                    tasks_text += f"\n... и еще {len(tasks) - 5} задач"
-                
-                message = f"🌅 Доброе утро!\n\nПроверьте, может у вас есть незавершенные дела или вы хотите начать новое?\n\n📋 Ваши незавершенные задачи:\n{tasks_text}\n\n🎯 Используйте /start для работы с задачами!"
-            else:
-                message = "🌅 Доброе утро!\n\nПроверьте, может у вас есть незавершенные дела или вы хотите начать новое?\n\n🎯 Используйте /start для создания новых задач!"
-            
-            await self.bot.send_message(
-                chat_id=chat_id,
-                text=message
-            )
+            await self._send_reminder_message(chat_id)
             logger.info(f"Утреннее напоминание отправлено пользователю {chat_id}")
         except Exception as e:
             logger.error(f"Ошибка отправки напоминания пользователю {chat_id}: {e}")
     
     async def check_and_send_reminders(self):
-        """Проверить время и отправить напоминания в 9:00"""
+        """Цикл напоминаний: спит до ближайшего срабатывания и рассылает наступившие"""
         while self.running:
             try:
-                now = datetime.now()
-                current_time = now.time()
-                target_time = time(9, 0)
+                now = self.clock.time()
+                due = self.timers.pop_due(now)
+                if due:
+                    chat_ids = []
+                    for fire_at, chat_id in due:
+                        if chat_id in self.active_users:
+                            REMINDER_LATENESS.observe(now - fire_at)
+                            chat_ids.append(chat_id)
+                            self._reschedule(chat_id, after=max(fire_at, now))
+                    logger.info(f"Время для отправки утренних напоминаний: {len(chat_ids)} пользователей")
+                    send = asyncio.create_task(self._send_reminders(chat_ids))
+                    self._sends.add(send)
+                    send.add_done_callback(self._sends.discard)
                 
-                if current_time.hour == target_time.hour and current_time.minute == target_time.minute:
-                    logger.info(f"Время для отправки утренних напоминаний: {now}")
-                    
-                    for chat_id in list(self.active_users):
-                        await self.send_morning_reminder(chat_id)
-                    
-                    await asyncio.sleep(60)
-                else:
-                    await asyncio.sleep(60)
+                self._wakeup.clear()
+                next_at = self.timers.next_time()
+                await sleep_or_wakeup(self.clock, self._wakeup, None if next_at is None else max(0.0, next_at - now))
             except Exception as e:
                 logger.error(f"Ошибка в планировщике напоминаний: {e}")
-                await asyncio.sleep(60)
+                await self.clock.sleep(1)
+    
+    async def _send_reminders(self, chat_ids: list) -> FanoutReport:
+        """Разослать напоминания; пользователи с chat.denied исключаются из рассылки"""
+        self.last_report = report = FanoutReport(len(chat_ids))
+        try:
+            return await self.fanout.run(
+                chat_ids,
+                self._send_reminder_message,
+                on_denied=self.remove_user,
+                report=report,
+            )
+        finally:
+            REMINDERS.labels("sent").inc(report.sent)
+            REMINDERS.labels("failed").inc(report.failed)
+            REMINDERS.labels("denied").inc(report.denied)
+            REMINDER_FANOUT_SECONDS.observe(report.duration or report.elapsed())
     
     async def start(self):
         """Запустить планировщик"""
+        self.load_subscribers()
         self.running = True
         logger.info("Планировщик утренних напоминаний запущен")
-        asyncio.create_task(self.check_and_send_reminders())
+        self._task = asyncio.create_task(self.check_and_send_reminders())
     
-    def stop(self):
-        """Остановить планировщик"""
+    async def stop(self, drain_timeout: float = 30.0):
+        """
+        Остановить планировщик: дождаться цикла и идущих рассылок (не дольше drain_timeout,
+        недосланные отменяются), затем закрыть реестр
+        """
         self.running = False
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._sends:
+            _, pending = await asyncio.wait(set(self._sends), timeout=drain_timeout)
+            for send in pending:
+                send.cancel()
+            if pending:
+                logger.warning(f"Рассылка напоминаний прервана при остановке: {len(pending)}")
+                await asyncio.gather(*pending, return_exceptions=True)
+        if self._compaction is not None:
+            await self._compaction
+        if self.registry is not None:
+            self.registry.close()
         logger.info("Планировщик утренних напоминаний остановлен")
 
@@ -0,0 +1,410 @@
+"""
+Статистика сессий Pomodoro по дням.
+
+Для каждого пользователя хранятся два массива префиксных сумм по дням
+(сессии и секунды фокуса): элемент i - сумма за дни [start, start + i).
+Сумма за любой диапазон дней - разность двух элементов, поэтому ответ
+на запрос «по дням» или «по неделям» стоит O(1) на корзину независимо от
+длины истории. Массив - array('I'), 4 байта на день: три года истории -
+около 9 КиБ на пользователя.
+
+Ряды держатся в памяти в пределах бюджета max_bytes (вытеснение чистых
+по LRU), изменённые в фоне сбрасываются в постоянное хранилище пачками -
+так же, как документы пользователей в storage.py. В хранилище лежат те же
+префиксные суммы, сжатые zlib (дни без сессий повторяют предыдущее
+значение и хорошо сжимаются): загрузка ряда - распаковка без пересчёта.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+# user_id, первый день (date.toordinal), префиксные суммы сессий и секунд фокуса (zlib)
+Row = Tuple[int, int, bytes, bytes]
+
+BUCKETS = ("day", "week")
+
+
+def _pack(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return zlib.compress(values.tobytes())
+
+
+def _unpack(blob: bytes) -> array:
+    values = array("I")
+    values.frombytes(zlib.decompress(blob))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class StatsBackend:
+    """Постоянное хранилище рядов: сжатые префиксные суммы по user_id"""
+
+    def read(self, user_id: int) -> Optional[Row]:
+        raise NotImplementedError
+
+    def write_many(self, rows: Iterable[Row]) -> None:
+        """Записать пачку рядов одной транзакцией"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStatsBackend(StatsBackend):
+    """Хранилище в памяти процесса (для тестов и локальной разработки)"""
+
+    def __init__(self):
+        self._rows: Dict[int, Row] = {}
+
+    def read(self, user_id: int) -> Optional[Row]:
+        return self._rows.get(user_id)
+
+    def write_many(self, rows: Iterable[Row]) -> None:
+        for row in rows:
+            self._rows[row[0]] = row
+
+
+class SQLiteStatsBackend(StatsBackend):
+    """Хранилище в SQLite в режиме WAL"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily_stats ("
+            "user_id INTEGER PRIMARY KEY, start_day INTEGER NOT NULL, "
+            "sessions BLOB NOT NULL, focus BLOB NOT NULL)"
+        )
+
+    def read(self, user_id: int) -> Optional[Row]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT user_id, start_day, sessions, focus FROM daily_stats WHERE user_id = ?", (user_id,)
+            ).fetchone()
+
+    def write_many(self, rows: Iterable[Row]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO daily_stats (user_id, start_day, sessions, focus) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET start_day = excluded.start_day, "
+                    "sessions = excluded.sessions, focus = excluded.focus",
+                    rows,
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class DailySeries:
+    """
+    Сессии и секунды фокуса одного пользователя по дням в виде префиксных сумм.
+
+    start - номер первого дня (date.toordinal); sessions[i] и focus[i] - суммы
+    за дни [start, start + i), длина массивов - число дней + 1.
+    """
+
+    __slots__ = ("start", "sessions", "focus")
+
+    def __init__(self, start: int = 0, sessions: Optional[array] = None, focus: Optional[array] = None):
+        self.start = start
+        self.sessions = sessions if sessions is not None else array("I", [0])
+        self.focus = focus if focus is not None else array("I", [0])
+
+    @property
+    def days(self) -> int:
+        return len(self.sessions) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return (len(self.sessions) + len(self.focus)) * self.sessions.itemsize
+
+    def add(self, day: int, sessions: int, focus_seconds: int, max_days: int) -> None:
+        """Прибавить к дню day; дни дальше max_days от последнего отбрасываются"""
+        if not self.days:
+            self.start = day
+        elif day < self.start:
+            if self.start + self.days - day > max_days:
+                return
+            # день раньше начала истории (запоздалая синхронизация) - дописываем нули в начало
+            gap = self.start - day
+            self.sessions = array("I", [0] * gap) + self.sessions
+            self.focus = array("I", [0] * gap) + self.focus
+            self.start = day
+
+        index = day - self.start
+        if index >= self.days:
+            # новый день в конце: дни без сессий повторяют последнюю сумму
+            gap = index - self.days
+            for prefix, value in ((self.sessions, sessions), (self.focus, focus_seconds)):
+                last = prefix[-1]
+                if gap:
+                    prefix.extend([last] * gap)
+                prefix.append(last + value)
+            self._trim(max_days)
+            return
+
+        # правка прошлого дня - сдвиг всех сумм после него
+        for prefix, value in ((self.sessions, sessions), (self.focus, focus_seconds)):
+            if value:
+                for i in range(index + 1, len(prefix)):
+                    prefix[i] += value
+
+    def _trim(self, max_days: int) -> None:
+        excess = self.days - max_days
+        if excess <= 0:
+            return
+        # обрезаем с запасом в месяц, чтобы не пересчитывать суммы каждый день
+        excess = min(self.days, excess + 30)
+        for name in ("sessions", "focus"):
+            prefix = getattr(self, name)
+            base = prefix[excess]
+            setattr(self, name, array("I", (value - base for value in prefix[excess:])))
+        self.start += excess
+
+    def totals(self, edges: List[int]) -> Tuple[List[int], List[int]]:
+        """
+        Сессии и секунды фокуса между соседними границами edges (номера дней по возрастанию):
+        i-я пара - за дни [edges[i], edges[i + 1])
+        """
+        start, days = self.start, self.days
+        indexes = []
+        for edge in edges:
+            i = edge - start
+            indexes.append(0 if i < 0 else days if i > days else i)
+        result = []
+        for prefix in (self.sessions, self.focus):
+            values = [prefix[i] for i in indexes]
+            result.append([b - a for a, b in zip(values, values[1:])])
+        return result[0], result[1]
+
+    def to_row(self, user_id: int) -> Row:
+        return user_id, self.start, _pack(self.sessions), _pack(self.focus)
+
+    @classmethod
+    def from_row(cls, row: Row) -> "DailySeries":
+        _, start, sessions, focus = row
+        return cls(start, _unpack(sessions), _unpack(focus))
+
+
+class StatsRollups:
+    """
+    Ряды статистики пользователей с бюджетом памяти и отложенной записью.
+
+    Args:
+        backend: постоянное хранилище рядов
+        tz: часовой пояс, по которому сессия относится к дню
+        max_bytes: сколько байт массивов держать в памяти; чистые ряды сверх бюджета вытесняются по LRU
+        max_days: сколько дней истории хранить на пользователя
+        flush_interval_ms: интервал фоновой записи изменённых рядов
+    """
+
+    def __init__(
+        self,
+        backend: StatsBackend,
+        tz: str = "Europe/Moscow",
+        max_bytes: int = 64 * 1024 * 1024,
+        max_days: int = 3660,
+        flush_interval_ms: int = 1000,
+    ):
+        self.backend = backend
+        self.tz = ZoneInfo(tz)
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+        self.flush_interval = flush_interval_ms / 1000
+        self._cache: "OrderedDict[int, DailySeries]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        # ряды, которые пишутся прямо сейчас: до конца записи их нельзя вытеснять,
+        # иначе при ошибке записи изменения пропадут
+        self._flushing: Set[int] = set()
+        self._bytes = 0
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.loads = 0
+
+    def day_of(self, timestamp: float) -> int:
+        """Номер дня (date.toordinal) момента timestamp в часовом поясе статистики"""
+        return datetime.fromtimestamp(timestamp, self.tz).date().toordinal()
+
+    def today(self) -> date:
+        return datetime.now(self.tz).date()
+
+    def _get(self, user_id: int, create: bool = False) -> Optional[DailySeries]:
+        series = self._cache.get(user_id)
+        if series is not None:
+            self._cache.move_to_end(user_id)
+            return series
+
+        row = self.backend.read(user_id)
+        if row is not None:
+            series = DailySeries.from_row(row)
+            self.loads += 1
+        elif create:
+            series = DailySeries()
+        else:
+            return None
+        self._cache[user_id] = series
+        self._bytes += series.nbytes
+        return series
+
+    def add(self, user_id: int, sessions: int = 1, focus_minutes: float = 0.0, at: Optional[float] = None) -> None:
+        """Засчитать сессии и минуты фокуса в день момента at (время Unix, по умолчанию сейчас)"""
+        sessions = max(int(sessions), 0)
+        focus_seconds = max(round(focus_minutes * 60), 0)
+        if not sessions and not focus_seconds:
+            return
+        day = self.day_of(time.time() if at is None else at)
+        series = self._get(user_id, create=True)
+        before = series.nbytes
+        series.add(day, sessions, focus_seconds, self.max_days)
+        self._bytes += series.nbytes - before
+        self._dirty.add(user_id)
+        self._evict()
+
+    def query(self, user_id: int, first: date, last: date, bucket: str = "day") -> List[Tuple[date, int, int]]:
+        """
+        Сессии и секунды фокуса по корзинам за дни [first, last]: список (начало корзины, сессии, секунды).
+        Недельные корзины начинаются с понедельника; первая и последняя обрезаются по first и last
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"Неизвестная корзина {bucket}, ожидается одна из {BUCKETS}")
+        first_day, last_day = first.toordinal(), last.toordinal()
+        if bucket == "week":
+            # первая неделя - с first, следующие - с понедельника
+            edges = [first_day, *range(first_day - first.weekday() + 7, last_day + 1, 7)]
+        else:
+            edges = list(range(first_day, last_day + 1))
+        edges.append(last_day + 1)
+
+        series = self._get(user_id)
+        if series is None:
+            sessions = focus = [0] * (len(edges) - 1)
+        else:
+            sessions, focus = series.totals(edges)
+            self._evict()
+        return list(zip(map(date.fromordinal, edges), sessions, focus))
+
+    @property
+    def cached_bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _evict(self) -> None:
+        if self._bytes <= self.max_bytes:
+            return
+        victims = []
+        freed = 0
+        for user_id, series in self._cache.items():
+            if self._bytes - freed <= self.max_bytes:
+                break
+            if user_id not in self._dirty and user_id not in self._flushing:
+                victims.append(user_id)
+                freed += series.nbytes
+        for user_id in victims:
+            del self._cache[user_id]
+        self._bytes -= freed
+
+    async def flush(self) -> int:
+        """Сбросить все изменённые ряды одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            dirty, self._dirty = self._dirty, set()
+            self._flushing = dirty
+            rows = [self._cache[user_id].to_row(user_id) for user_id in dirty if user_id in self._cache]
+            try:
+                await asyncio.to_thread(self.backend.write_many, rows)
+            except Exception:
+                self._dirty |= dirty
+                raise
+            finally:
+                self._flushing = set()
+
+            self._evict()
+            return len(rows)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи статистики по дням: {e}", exc_info=True)
+
+    def start(self) -> None:
+        """Запустить фоновую запись"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Остановить фоновую запись, сбросить остаток и закрыть хранилище"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self.backend.close()
+
+
+def default_range(rollups: StatsRollups, first: Optional[date], last: Optional[date], bucket: str) -> Tuple[date, date]:
+    """Диапазон запроса по умолчанию: до сегодня, 30 дней или 12 недель"""
+    last = last or rollups.today()
+    if first is None:
+        first = last - (timedelta(days=29) if bucket == "day" else timedelta(days=last.weekday() + 7 * 11))
+    return first, last
+
+
+def create_rollups_from_env() -> StatsRollups:
+    """
+    Статистика по дням по переменным окружения: STATS_STORAGE (sqlite | memory), STATS_DB_PATH,
+    STATS_TIMEZONE, STATS_CACHE_MB, STATS_MAX_DAYS, STATS_FLUSH_MS
+    """
+    kind = os.getenv("STATS_STORAGE", os.getenv("SYNC_STORAGE", "sqlite")).lower()
+    if kind == "memory":
+        backend: StatsBackend = MemoryStatsBackend()
+    elif kind == "sqlite":
+        backend = SQLiteStatsBackend(os.getenv("STATS_DB_PATH", "stats.db"))
+    else:
+        raise ValueError(f"Неизвестный тип хранилища STATS_STORAGE={kind}")
+
+    return StatsRollups(
+        backend,
+        tz=os.getenv("STATS_TIMEZONE", os.getenv("REMINDER_TIMEZONE", "Europe/Moscow")),
+        max_bytes=int(float(os.getenv("STATS_CACHE_MB", 64)) * 1024 * 1024),
+        max_days=int(os.getenv("STATS_MAX_DAYS", 3660)),
+        flush_interval_ms=int(os.getenv("STATS_FLUSH_MS", 1000)),
+    )
@@ -0,0 +1,240 @@
+"""
+Хранилище данных синхронизации пользователей.
+
+Данные держатся в памяти (горячий слой), а изменённые пользователи
+сбрасываются в постоянное хранилище пачками в фоне (write-behind),
+поэтому /sync не ждёт диска, а данные переживают перезапуск.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BaseStorage:
+    """Постоянное хранилище: хранит JSON-документ пользователя по его id"""
+
+    def read(self, user_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    def write_many(self, rows: Iterable[Tuple[int, str]]) -> None:
+        """Записать пачку документов одной транзакцией"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStorage(BaseStorage):
+    """Хранилище в памяти процесса (для тестов и локальной разработки)"""
+
+    def __init__(self):
+        self._rows: Dict[int, str] = {}
+
+    def read(self, user_id: int) -> Optional[str]:
+        return self._rows.get(user_id)
+
+    def write_many(self, rows: Iterable[Tuple[int, str]]) -> None:
+        self._rows.update(rows)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище в SQLite в режиме WAL.
+
+    Чтение идёт через отдельное соединение только для чтения со своей
+    блокировкой: в WAL оно не ждёт транзакцию записи, которую держит
+    фоновый сброс, поэтому промах кэша не останавливает цикл событий
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._read_lock = threading.Lock()
+        self._read_conn = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False, isolation_level=None
+        )
+
+    def read(self, user_id: int) -> Optional[str]:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT data FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def write_many(self, rows: Iterable[Tuple[int, str]]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                    rows,
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._read_lock:
+            self._read_conn.close()
+        with self._lock:
+            self._conn.close()
+
+
+class WriteBehindStore:
+    """
+    Кэш данных пользователей поверх BaseStorage с отложенной записью.
+
+    Поддерживает словарный интерфейс (get / [] / in), которым раньше
+    пользовались для sync_storage. Запись помечает пользователя «грязным»;
+    фоновая задача раз в flush_interval_ms сбрасывает всех грязных
+    пользователей одной транзакцией. Чистые записи вытесняются по LRU,
+    когда кэш превышает max_cached; пользователи, чья запись ещё идёт,
+    не вытесняются до её успеха - иначе при ошибке записи правка пропала бы.
+    """
+
+    def __init__(self, backend: BaseStorage, flush_interval_ms: int = 200, max_cached: int = 10000):
+        self.backend = backend
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._flushing: Set[int] = set()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, user_id: int, default: Any = None) -> Any:
+        data = self._cache.get(user_id)
+        if data is not None:
+            self._cache.move_to_end(user_id)
+            return data
+
+        raw = self.backend.read(user_id)
+        if raw is None:
+            return default
+
+        data = json.loads(raw)
+        self._cache[user_id] = data
+        self._evict()
+        return data
+
+    def __getitem__(self, user_id: int) -> Dict[str, Any]:
+        data = self.get(user_id)
+        if data is None:
+            raise KeyError(user_id)
+        return data
+
+    def __setitem__(self, user_id: int, data: Dict[str, Any]) -> None:
+        self._cache[user_id] = data
+        self._cache.move_to_end(user_id)
+        self._dirty.add(user_id)
+        self._evict()
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def mark_dirty(self, user_id: int) -> None:
+        """Пометить изменённые на месте данные пользователя для записи"""
+        if user_id in self._cache:
+            self._dirty.add(user_id)
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def _evict(self) -> None:
+        excess = len(self._cache) - self.max_cached
+        if excess <= 0:
+            return
+
+        victims = []
+        for user_id in self._cache:
+            if len(victims) >= excess:
+                break
+            if user_id not in self._dirty and user_id not in self._flushing:
+                victims.append(user_id)
+        for user_id in victims:
+            del self._cache[user_id]
+
+    async def flush(self) -> int:
+        """Сбросить всех грязных пользователей одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            dirty, self._dirty = self._dirty, set()
+            self._flushing = dirty
+            rows = [
+                (user_id, json.dumps(self._cache[user_id], ensure_ascii=False))
+                for user_id in dirty
+                if user_id in self._cache
+            ]
+            try:
+                await asyncio.to_thread(self.backend.write_many, rows)
+            except Exception:
+                self._dirty |= dirty
+                raise
+            finally:
+                self._flushing = set()
+
+            self._evict()
+            return len(rows)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи данных синхронизации: {e}", exc_info=True)
+
+    def start(self) -> None:
+        """Запустить фоновую запись"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Остановить фоновую запись, сбросить остаток и закрыть хранилище"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self.backend.close()
+
+
+def create_store_from_env() -> WriteBehindStore:
+    """
+    Создать хранилище по переменным окружения:
+    SYNC_STORAGE (sqlite | memory), SYNC_DB_PATH, SYNC_FLUSH_MS, SYNC_CACHE_SIZE
+    """
+    kind = os.getenv("SYNC_STORAGE", "sqlite").lower()
+    if kind == "memory":
+        backend: BaseStorage = MemoryStorage()
+    elif kind == "sqlite":
+        backend = SQLiteStorage(os.getenv("SYNC_DB_PATH", "sync_storage.db"))
+    else:
+        raise ValueError(f"Неизвестный тип хранилища SYNC_STORAGE={kind}")
+
+    return WriteBehindStore(
+        backend,
+        flush_interval_ms=int(os.getenv("SYNC_FLUSH_MS", 200)),
+        max_cached=int(os.getenv("SYNC_CACHE_SIZE", 10000)),
+    )
@@ -0,0 +1,218 @@
+"""
+Реестр подписчиков утренних напоминаний на диске.
+
+Состояние хранится в двух файлах:
+- <path>.snap - компактный двоичный снимок: таблица часовых поясов и по
+  20 байт на подписчика (chat_id, user_id, время напоминания, пояс);
+- <path>.log - журнал изменений после снимка, по строке на изменение:
+  "+ chat_id user_id HH:MM пояс" или "- chat_id".
+
+При запуске снимок читается целиком и поверх проигрывается журнал,
+так что загрузка линейна по числу подписчиков. Когда журнал разрастается,
+текущее состояние записывается новым снимком: журнал откладывается в
+<path>.log.old (новые записи идут в свежий журнал), снимок пишется - в
+том числе в отдельном потоке, - и отложенный журнал удаляется. Если
+процесс упал посреди записи снимка, при загрузке проигрываются оба
+журнала: повтор уже вошедших в снимок записей ничего не меняет.
+"""
+import logging
+import os
+import shutil
+import struct
+from datetime import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FSB1"
+HEADER = struct.Struct("<4sII")  # magic, число поясов, число подписчиков
+TZ_NAME = struct.Struct("<H")
+RECORD = struct.Struct("<qqHH")  # chat_id, user_id (0 - неизвестен), минуты от полуночи, индекс пояса
+
+# chat_id, user_id, пояс, время напоминания
+Subscriber = Tuple[int, Optional[int], str, time]
+
+
+class SubscriberRegistry:
+    """
+    Снимок и журнал подписчиков.
+
+    Args:
+        path: путь без расширения; рядом создаются path.snap и path.log
+        compact_after: после скольких записей журнала делать новый снимок
+            (но не раньше, чем журнал сравняется по числу строк со снимком)
+    """
+
+    def __init__(self, path: str, compact_after: int = 100000):
+        self.path = path
+        self.snapshot_path = f"{path}.snap"
+        self.log_path = f"{path}.log"
+        self.old_log_path = f"{path}.log.old"
+        self.compact_after = compact_after
+        self.snapshot_count = 0
+        self.log_entries = 0
+        self._log = None
+
+    def load(self) -> Iterator[Subscriber]:
+        """Подписчики из снимка с применённым журналом"""
+        # журнал мал по сравнению со снимком: сворачиваем его в итоговое
+        # состояние по chat_id (None - удалён) и накладываем на поток снимка
+        changes: Dict[int, Optional[Subscriber]] = {}
+        self.log_entries = 0
+        for op, row in self._read_log(self.old_log_path) + self._read_log(self.log_path):
+            if op == "+":
+                changes[row[0]] = row
+            else:
+                changes[row] = None
+        for row in self._read_snapshot():
+            if row[0] in changes:
+                row = changes.pop(row[0])
+                if row is None:
+                    continue
+            yield row
+        for row in changes.values():
+            if row is not None:
+                yield row
+
+    def _read_snapshot(self) -> Iterator[Subscriber]:
+        self.snapshot_count = 0
+        if not os.path.exists(self.snapshot_path):
+            return
+        with open(self.snapshot_path, "rb") as f:
+            data = f.read()
+        magic, tz_count, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.snapshot_path}: неизвестный формат снимка подписчиков")
+        offset = HEADER.size
+        zones: List[str] = []
+        for _ in range(tz_count):
+            (length,) = TZ_NAME.unpack_from(data, offset)
+            offset += TZ_NAME.size
+            zones.append(data[offset:offset + length].decode())
+            offset += length
+        # одинаковые времена напоминания - один объект time на всех
+        times: Dict[int, time] = {}
+        end = offset + count * RECORD.size
+        for chat_id, user_id, minutes, tz_index in RECORD.iter_unpack(data[offset:end]):
+            at = times.get(minutes)
+            if at is None:
+                at = times[minutes] = time(minutes // 60, minutes % 60)
+            yield chat_id, user_id or None, zones[tz_index], at
+        self.snapshot_count = count
+
+    def _read_log(self, path: str) -> List[tuple]:
+        ops: List[tuple] = []
+        if not os.path.exists(path):
+            return ops
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                parts = line.split()
+                try:
+                    if parts[0] == "+":
+                        hours, minutes = parts[3].split(":")
+                        user_id = int(parts[2])
+                        ops.append(("+", (int(parts[1]), user_id or None, parts[4], time(int(hours), int(minutes)))))
+                    elif parts[0] == "-":
+                        ops.append(("-", int(parts[1])))
+                    else:
+                        raise ValueError(parts[0])
+                except (IndexError, ValueError):
+                    # недописанная последняя строка после падения процесса
+                    logger.warning(f"Пропущена повреждённая строка журнала подписчиков: {line!r}")
+                    continue
+                self.log_entries += 1
+        return ops
+
+    def _append(self, line: str) -> None:
+        if self._log is None:
+            self._log = open(self.log_path, "ab+")
+            if self._log.tell():
+                # недописанную строку отделяем, чтобы не склеить её со следующей записью
+                self._log.seek(-1, os.SEEK_END)
+                if self._log.read(1) != b"\n":
+                    self._log.write(b"\n")
+        self._log.write(line.encode())
+        self._log.flush()
+        self.log_entries += 1
+
+    def add(self, chat_id: int, user_id: Optional[int], tz_name: str, at: time) -> None:
+        """Записать подписчика или его новые настройки"""
+        self._append(f"+ {chat_id} {user_id or 0} {at:%H:%M} {tz_name}\n")
+
+    def remove(self, chat_id: int) -> None:
+        self._append(f"- {chat_id}\n")
+
+    def needs_compaction(self) -> bool:
+        return self.log_entries >= max(self.compact_after, self.snapshot_count)
+
+    def compact(self, subscribers: Iterable[Subscriber]) -> None:
+        """Записать текущее состояние новым снимком (атомарно) и обнулить журнал"""
+        self.rotate_log()
+        self.finish_compaction(self.write_snapshot(subscribers))
+
+    def rotate_log(self) -> None:
+        """
+        Начать новый снимок: журнал до этого момента откладывается в .old, новые
+        записи идут в свежий журнал. Состояние для снимка берётся в тот же момент
+        """
+        self.close()
+        if os.path.exists(self.log_path):
+            if os.path.exists(self.old_log_path):
+                # прошлый снимок не дописан: его отложенный журнал ещё нужен - дописываем в него
+                with open(self.old_log_path, "ab+") as old, open(self.log_path, "rb") as log:
+                    if old.tell():
+                        old.seek(-1, os.SEEK_END)
+                        if old.read(1) != b"\n":
+                            old.write(b"\n")
+                    shutil.copyfileobj(log, old)
+                os.remove(self.log_path)
+            else:
+                os.replace(self.log_path, self.old_log_path)
+        self.log_entries = 0
+
+    def write_snapshot(self, subscribers: Iterable[Subscriber]) -> int:
+        """
+        Записать снимок (атомарно); состояние реестра не трогает, поэтому может
+        работать в отдельном потоке. Возвращает число подписчиков
+        """
+        zones: Dict[str, int] = {}
+        records = bytearray()
+        count = 0
+        for chat_id, user_id, tz_name, at in subscribers:
+            tz_index = zones.setdefault(tz_name, len(zones))
+            records += RECORD.pack(chat_id, user_id or 0, at.hour * 60 + at.minute, tz_index)
+            count += 1
+
+        header = bytearray(HEADER.pack(MAGIC, len(zones), count))
+        for tz_name in zones:
+            encoded = tz_name.encode()
+            header += TZ_NAME.pack(len(encoded)) + encoded
+
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        logger.info(f"Снимок подписчиков записан: {count} подписчиков, {len(header) + len(records)} байт")
+        return count
+
+    def finish_compaction(self, count: int) -> None:
+        """Снимок записан: отложенный журнал больше не нужен"""
+        if os.path.exists(self.old_log_path):
+            os.remove(self.old_log_path)
+        self.snapshot_count = count
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+def create_registry_from_env() -> Optional[SubscriberRegistry]:
+    """Реестр по переменным окружения: SUBSCRIBERS_PATH (пусто - не сохранять), SUBSCRIBERS_COMPACT_AFTER"""
+    path = os.getenv("SUBSCRIBERS_PATH", "subscribers")
+    if not path:
+        return None
+    return SubscriberRegistry(path, compact_after=int(os.getenv("SUBSCRIBERS_COMPACT_AFTER", 100000)))
@@ -1,19 +1,118 @@
 """
 API эндпоинты для синхронизации данных между webapp и ботом
 """
+import asyncio
+import json
 import logging
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-from maxapi.context import MemoryContext
+import os
+import re
+import time
+from contextlib import aclosing, asynccontextmanager
+from datetime import date
+import httpx
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, Union, AsyncIterator, Literal, Callable, Awaitable
+import metrics
+from admission import BACKGROUND, INTERACTIVE, DeadlineExceeded, QueueFull, create_queue_from_env
+from lm_cache import create_cache_from_env, normalize_key
+from stats_rollup import create_rollups_from_env, default_range
+from storage import create_store_from_env
+from user_state import changed_since, task_delta, task_list
+from user_store import UserStore
 
 logger = logging.getLogger(__name__)
 
-sync_storage: Dict[int, Dict[str, Any]] = {}
+# Сколько последних удалений хранить для дельта-синхронизации.
+# Клиент, отставший сильнее, получает полный снимок данных.
+MAX_TOMBSTONES = int(os.getenv("SYNC_MAX_TOMBSTONES", 1000))
 
-app = FastAPI()
+# Сколько корзин можно запросить в GET /stats/{userId} за раз
+MAX_STATS_BUCKETS = int(os.getenv("STATS_MAX_BUCKETS", 1000))
 
-app = FastAPI(title="Focus Assistant API")
+sync_storage = create_store_from_env()
+# Сессии по дням: пишутся при каждом приросте статистики (синхронизация webapp, сессии в боте)
+stats_rollups = create_rollups_from_env()
+# Документы пользователей: их же читает и пишет бот, если работает в этом процессе
+user_store = UserStore(sync_storage, max_tombstones=MAX_TOMBSTONES, rollups=stats_rollups)
+analyze_cache = create_cache_from_env()
+lm_queue = create_queue_from_env()
+
+SYNC_REQUESTS = metrics.counter("focus_sync_requests_total", "Запросы POST /sync", ["outcome"])
+SYNC_MERGE_SECONDS = metrics.histogram(
+    "focus_sync_merge_seconds", "Время слияния данных пользователя (/sync и /sync/batch), с",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+LM_REQUEST_SECONDS = metrics.histogram("focus_lm_request_seconds", "Запросы к LM (без стриминга), с", ["outcome"])
+ANALYZE_REQUESTS = metrics.counter("focus_analyze_requests_total", "Запросы POST /analyze_task", ["outcome"])
+ANALYZE_SECONDS = metrics.histogram("focus_analyze_seconds", "Время ответа POST /analyze_task, с")
+metrics.gauge("focus_lm_queue_depth", "Запросы к LM, ждущие в очереди").set_function(lambda: lm_queue.depth)
+metrics.gauge("focus_lm_queue_active", "Запросы к LM, выполняющиеся сейчас").set_function(lambda: lm_queue.stats()["active"])
+metrics.counter("focus_lm_queue_rejected_total", "Запросы, отклонённые очередью к LM").set_function(lambda: lm_queue.rejected)
+metrics.counter("focus_lm_queue_expired_total", "Запросы, не дождавшиеся LM").set_function(lambda: lm_queue.expired)
+metrics.counter("focus_analyze_cache_hits_total", "Попадания в кэш разбора задач").set_function(lambda: analyze_cache.hits)
+metrics.counter("focus_analyze_cache_misses_total", "Промахи кэша разбора задач").set_function(lambda: analyze_cache.misses)
+metrics.gauge("focus_stats_cache_bytes", "Статистика по дням в памяти, байт").set_function(
+    lambda: stats_rollups.cached_bytes
+)
+metrics.counter("focus_stats_loads_total", "Загрузки статистики по дням из хранилища").set_function(
+    lambda: stats_rollups.loads
+)
+
+# Общий пул соединений к LM: создаётся в lifespan и переиспользует
+# keep-alive соединения между запросами /analyze_task и /lm/health
+lm_client: Optional[httpx.AsyncClient] = None
+
+def _create_lm_client() -> httpx.AsyncClient:
+    """
+    Создать пул соединений к LM по переменным окружения:
+    LM_TIMEOUT, LM_CONNECT_TIMEOUT, LM_MAX_CONNECTIONS, LM_MAX_KEEPALIVE, LM_KEEPALIVE_EXPIRY
+    """
+    timeout = httpx.Timeout(
+        float(os.getenv("LM_TIMEOUT", 45.0)),
+        connect=float(os.getenv("LM_CONNECT_TIMEOUT", 10.0)),
+    )
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("LM_MAX_CONNECTIONS", 20)),
+        max_keepalive_connections=int(os.getenv("LM_MAX_KEEPALIVE", 10)),
+        keepalive_expiry=float(os.getenv("LM_KEEPALIVE_EXPIRY", 30.0)),
+    )
+    return httpx.AsyncClient(timeout=timeout, limits=limits)
+
+def _get_lm_client() -> httpx.AsyncClient:
+    global lm_client
+    if lm_client is None or lm_client.is_closed:
+        lm_client = _create_lm_client()
+    return lm_client
+
+# Сервисы, работающие в одном процессе с API (бот): startup-хуки вызываются
+# после запуска хранилища, shutdown-хуки - до его остановки, в обратном порядке
+startup_hooks: List[Callable[[], Awaitable[None]]] = []
+shutdown_hooks: List[Callable[[], Awaitable[None]]] = []
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global lm_client
+    sync_storage.start()
+    stats_rollups.start()
+    analyze_cache.load()
+    lm_client = _create_lm_client()
+    for hook in startup_hooks:
+        await hook()
+    yield
+    for hook in reversed(shutdown_hooks):
+        try:
+            await hook()
+        except Exception as e:
+            logger.error(f"Ошибка при остановке сервиса: {e}", exc_info=True)
+    await lm_client.aclose()
+    analyze_cache.save()
+    await stats_rollups.stop()
+    await sync_storage.stop()
+
+app = FastAPI(title="Focus Assistant API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -40,98 +139,179 @@ async def lm_health():
         return {"ok": False, "error": "LM_BASE_URL is empty"}
     url = f"{base_url}/models"
     try:
-        async with httpx.AsyncClient(timeout=httpx.Timeout(12.0)) as client:
-            r = await client.get(url)
-            data = r.json()
+        r = await _get_lm_client().get(url, timeout=httpx.Timeout(12.0))
+        data = r.json()
         return {"ok": r.status_code == 200, "status": r.status_code, "base_url": base_url, "wanted_model": model, "models": data}
     except Exception as e:
         return {"ok": False, "base_url": base_url, "error": str(e)}
 
+# Слушатели синхронизации: listener(user_id, изменённые задачи целиком, id удалённых задач).
+# Вызываются после каждого слияния, изменившего задачи (например, индекс напоминаний бота)
+sync_listeners = user_store.listeners
+
 class SyncData(BaseModel):
     userId: int
     settings: Optional[Dict[str, Any]] = None
     tasks: Optional[List[Dict[str, Any]]] = None
     stats: Optional[Dict[str, Any]] = None
+    deletedTaskIds: Optional[List[Union[str, int]]] = None
+    sinceRevision: Optional[int] = None
+    clientTime: Optional[int] = Field(None, description="Время синхронизации на клиенте, мс с эпохи Unix")
+    settingsTimestamps: Optional[Dict[str, int]] = Field(
+        None, description="Время правки каждого присланного ключа settings на клиенте, мс"
+    )
 
 class SyncResponse(BaseModel):
     success: bool
     settings: Optional[Dict[str, Any]] = None
     tasks: Optional[List[Dict[str, Any]]] = None
     stats: Optional[Dict[str, Any]] = None
+    deletedTaskIds: Optional[List[str]] = None
+    revision: int = 0
+    isDelta: bool = False
     message: Optional[str] = None
 
-@app.post("/sync", response_model=SyncResponse)
-async def sync_data(data: SyncData):
+def _build_response(current_data: Dict[str, Any], since: Optional[int], message: str) -> SyncResponse:
     """
-    Синхронизация данных между webapp и ботом
+    Полный снимок данных, либо (если клиент прислал sinceRevision) только
+    изменённые после этой ревизии поля задач и id удалённых задач
     """
-    try:
-        userId = data.userId
-        
-        current_data = sync_storage.get(userId, {})
-        
-        if data.settings is not None:
-            current_data["settings"] = {**current_data.get("settings", {}), **data.settings}
-        
-        if data.tasks is not None:
-            existing_tasks = {task.get("id"): task for task in current_data.get("tasks", [])}
-            for task in data.tasks:
-                task_id = task.get("id")
-                if task_id and task_id in existing_tasks:
-                    existing_tasks[task_id].update(task)
-                else:
-                    existing_tasks[task_id] = task
-            current_data["tasks"] = list(existing_tasks.values())
-        
-        if data.stats is not None:
-            existing_stats = current_data.get("stats", {})
-            for key, value in data.stats.items():
-                if key in existing_stats:
-                    if isinstance(value, (int, float)) and isinstance(existing_stats[key], (int, float)):
-                        existing_stats[key] = max(existing_stats[key], value)
-                    else:
-                        existing_stats[key] = value
-                else:
-                    existing_stats[key] = value
-            current_data["stats"] = existing_stats
-        
-        sync_storage[userId] = current_data
-        
-        logger.info(f"Данные синхронизированы для пользователя {userId}")
-        
+    revision = current_data.get("revision", 0)
+    if since is None or since > revision or since < current_data.get("tombstoneFloor", 0):
         return SyncResponse(
             success=True,
             settings=current_data.get("settings"),
-            tasks=current_data.get("tasks"),
+            tasks=task_list(current_data),
             stats=current_data.get("stats"),
-            message="Данные успешно синхронизированы"
+            revision=revision,
+            message=message
+        )
+
+    return SyncResponse(
+        success=True,
+        settings=current_data.get("settings") if current_data.get("settingsRevision", 0) > since else None,
+        tasks=task_delta(current_data, since),
+        stats=current_data.get("stats") if current_data.get("statsRevision", 0) > since else None,
+        deletedTaskIds=changed_since(current_data.get("tombstones", {}), since),
+        revision=revision,
+        isDelta=True,
+        message=message
+    )
+
+def _apply_sync(data: SyncData) -> SyncResponse:
+    """Слить данные одного пользователя в хранилище и собрать ответ"""
+    with SYNC_MERGE_SECONDS.time():
+        current_data, _ = user_store.apply(
+            data.userId,
+            settings=data.settings,
+            tasks=data.tasks,
+            stats=data.stats,
+            deleted_task_ids=data.deletedTaskIds,
+            client_time=data.clientTime,
+            settings_timestamps=data.settingsTimestamps,
         )
+    return _build_response(current_data, data.sinceRevision, "Данные успешно синхронизированы")
+
+@app.post("/sync", response_model=SyncResponse)
+async def sync_data(data: SyncData):
+    """
+    Синхронизация данных между webapp и ботом
+    """
+    try:
+        response = _apply_sync(data)
+        logger.info(f"Данные синхронизированы для пользователя {data.userId}")
+        SYNC_REQUESTS.labels("ok").inc()
+        return response
     except Exception as e:
+        SYNC_REQUESTS.labels("error").inc()
         logger.error(f"Ошибка синхронизации данных: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка синхронизации: {str(e)}")
 
+class SyncBatchRequest(BaseModel):
+    items: List[SyncData]
+
+class SyncBatchResponse(BaseModel):
+    success: bool
+    results: List[SyncResponse]
+
+@app.post("/sync/batch", response_model=SyncBatchResponse)
+async def sync_batch(batch: SyncBatchRequest):
+    """
+    Синхронизация данных сразу многих пользователей.
+    Правила слияния те же, что у /sync; все изменения записываются одной транзакцией,
+    результаты возвращаются в порядке запроса
+    """
+    results = []
+    for data in batch.items:
+        try:
+            results.append(_apply_sync(data))
+        except Exception as e:
+            logger.error(f"Ошибка синхронизации данных пользователя {data.userId}: {e}", exc_info=True)
+            results.append(SyncResponse(success=False, message=f"Ошибка синхронизации: {str(e)}"))
+
+    try:
+        await sync_storage.flush()
+    except Exception as e:
+        logger.error(f"Ошибка записи пакета синхронизации: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Ошибка записи данных: {str(e)}")
+
+    logger.info(f"Пакетная синхронизация: {len(results)} пользователей")
+    return SyncBatchResponse(success=all(r.success for r in results), results=results)
+
 @app.get("/sync/{userId}")
-async def get_sync_data(userId: int):
+async def get_sync_data(userId: int, sinceRevision: Optional[int] = None):
     """
     Получить синхронизированные данные пользователя
     """
     try:
-        user_data = sync_storage.get(userId, {})
-        return SyncResponse(
-            success=True,
-            settings=user_data.get("settings"),
-            tasks=user_data.get("tasks"),
-            stats=user_data.get("stats"),
-            message="Данные получены"
-        )
+        user_data = user_store.get(userId)
+        return _build_response(user_data, sinceRevision, "Данные получены")
     except Exception as e:
         logger.error(f"Ошибка получения данных: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка получения данных: {str(e)}")
 
+@app.get("/stats/{userId}")
+async def get_stats(
+    userId: int,
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    bucket: Literal["day", "week"] = "day",
+):
+    """
+    Сессии Pomodoro и минуты фокуса по дням или неделям за [from, to] (даты YYYY-MM-DD, включительно).
+    По умолчанию - до сегодня, 30 дней или 12 недель
+    """
+    first, last = default_range(stats_rollups, from_, to, bucket)
+    if first > last:
+        raise HTTPException(status_code=400, detail="from позже to")
+    days = (last - first).days + 1
+    if (days if bucket == "day" else days // 7) > MAX_STATS_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Слишком большой диапазон: больше {MAX_STATS_BUCKETS} корзин")
+    try:
+        rows = stats_rollups.query(userId, first, last, bucket)
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Ошибка получения статистики: {str(e)}")
+    return {
+        "ok": True,
+        "userId": userId,
+        "bucket": bucket,
+        "from": first.isoformat(),
+        "to": last.isoformat(),
+        "buckets": [
+            {"start": start.isoformat(), "sessions": sessions, "focusMinutes": round(focus / 60, 1)}
+            for start, sessions, focus in rows
+        ],
+        "totalSessions": sum(row[1] for row in rows),
+        "totalFocusMinutes": round(sum(row[2] for row in rows) / 60, 1),
+    }
+
 class AnalyzeTaskRequest(BaseModel):
     userId: int
     description: str = Field(..., description="Текст задачи")
     deadline: Optional[str] = None
+    priority: Literal["interactive", "background"] = "interactive"
+    timeoutMs: Optional[int] = Field(None, ge=1, description="Сколько клиент готов ждать ответа, мс")
 
 class SubTask(BaseModel):
     title: str
@@ -153,7 +333,7 @@ def _build_prompt(desc: str, deadline: Optional[str]) -> list[Dict[str, str]]:
     user = f"Задача: {desc}\nДедлайн: {deadline or 'не указан'}\nВерни только JSON."
     return [{"role": "system", "content": system}, {"role": "user", "content": user}]
 
-async def _call_lm(messages: list[Dict[str, str]]) -> Dict[str, Any]:
+def _lm_request(messages: list[Dict[str, str]], stream: bool = False) -> tuple[str, Dict[str, str], Dict[str, Any]]:
     base_url = os.getenv("LM_BASE_URL", "http://127.0.0.1:1234/v1").rstrip("/")
     model = os.getenv("LM_MODEL", "Qwen3-VL-4B-Instruct-Q4_K_M")
     api_key = os.getenv("LM_API_KEY", "")
@@ -168,54 +348,281 @@ async def _call_lm(messages: list[Dict[str, str]]) -> Dict[str, Any]:
         "temperature": 0.2,
         "max_tokens": 800,
     }
+    if stream:
+        payload["stream"] = True
+
+    return f"{base_url}/chat/completions", headers, payload
 
-    timeout = httpx.Timeout(45.0, connect=10.0)
-    url = f"{base_url}/chat/completions"
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post(url, headers=headers, json=payload)
+async def _call_lm(messages: list[Dict[str, str]]) -> Dict[str, Any]:
+    url, headers, payload = _lm_request(messages)
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        r = await _get_lm_client().post(url, headers=headers, json=payload)
         r.raise_for_status()
+        outcome = "ok"
         return r.json()
+    finally:
+        LM_REQUEST_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+
+async def _stream_lm(messages: list[Dict[str, str]]) -> AsyncIterator[str]:
+    """Потоковый ответ модели: куски текста по мере генерации"""
+    url, headers, payload = _lm_request(messages, stream=True)
+    async with _get_lm_client().stream("POST", url, headers=headers, json=payload) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+def _normalize_sub_task(st: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    title = (st.get("title") or "").strip()
+    est = int(st.get("estimatedPomodoros") or 1)
+    est = max(1, min(est, 12))
+    if not title:
+        return None
+    return {"title": title, "estimatedPomodoros": est}
+
+class _SubTaskStreamParser:
+    """
+    Инкрементальный разбор JSON-ответа модели вида {"subTasks": [{...}, ...]}:
+    возвращает каждую подзадачу, как только закрылся её объект
+    """
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._current: List[str] = []
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        sub_tasks = []
+        for ch in chunk:
+            if self._depth >= 2:
+                self._current.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+                if self._depth == 2:
+                    self._current = ["{"]
+            elif ch == "}" and self._depth > 0:
+                if self._depth == 2:
+                    try:
+                        st = _normalize_sub_task(json.loads("".join(self._current)))
+                    except (json.JSONDecodeError, TypeError, ValueError):
+                        st = None
+                    if st:
+                        sub_tasks.append(st)
+                self._depth -= 1
+        return sub_tasks
+
+FALLBACK_SUB_TASKS = [
+    {"title": "Подготовка", "estimatedPomodoros": 1},
+    {"title": "Основная работа", "estimatedPomodoros": 3},
+    {"title": "Завершение", "estimatedPomodoros": 1},
+]
+
+async def _analyze(description: str, deadline: Optional[str]) -> List[Dict[str, Any]]:
+    """Разбить задачу на подзадачи моделью. Пустой список, если модель ничего не предложила"""
+    raw = await _call_lm(_build_prompt(description, deadline))
+    content = raw["choices"][0]["message"]["content"]
+
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        m = re.findall(r"\{[\s\S]*\}", content)
+        data = None
+        for cand in m:
+            try:
+                data = json.loads(cand)
+                break
+            except json.JSONDecodeError:
+                continue
+        if data is None:
+            raise
+
+    sub_tasks: List[Dict[str, Any]] = []
+    for st in data.get("subTasks", []):
+        st = _normalize_sub_task(st)
+        if st:
+            sub_tasks.append(st)
+    return sub_tasks
+
+def _admission(req: AnalyzeTaskRequest) -> tuple[int, float]:
+    """Приоритет и дедлайн запроса в очереди к модели"""
+    priority = BACKGROUND if req.priority == "background" else INTERACTIVE
+    deadline = lm_queue.deadline_for(req.timeoutMs / 1000 if req.timeoutMs else None)
+    return priority, deadline
+
+def _queue_full(e: QueueFull) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Модель перегружена, повторите запрос позже",
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 @app.post("/analyze_task", response_model=AnalyzeTaskResponse)
 async def analyze_task(req: AnalyzeTaskRequest):
+    priority, deadline = _admission(req)
+    started = time.perf_counter()
+    outcome = "error"
     try:
-        raw = await _call_lm(_build_prompt(req.description, req.deadline))
-        content = raw["choices"][0]["message"]["content"]
-
-        try:
-            data = json.loads(content)
-        except json.JSONDecodeError:
-            m = re.findall(r"\{[\s\S]*\}", content)
-            data = None
-            for cand in m:
-                try:
-                    data = json.loads(cand)
-                    break
-                except json.JSONDecodeError:
-                    continue
-            if data is None:
-                raise
-
-        sub_tasks: List[Dict[str, Any]] = []
-        for st in data.get("subTasks", []):
-            title = (st.get("title") or "").strip()
-            est = int(st.get("estimatedPomodoros") or 1)
-            est = max(1, min(est, 12))
-            if title:
-                sub_tasks.append({"title": title, "estimatedPomodoros": est})
+        sub_tasks = await analyze_cache.get_or_compute(
+            normalize_key(req.description, req.deadline),
+            lambda: lm_queue.run(lambda: _analyze(req.description, req.deadline), priority, deadline),
+            should_store=bool,
+        )
 
+        outcome = "ok"
         if not sub_tasks:
-            sub_tasks = [
-                {"title": "Подготовка", "estimatedPomodoros": 1},
-                {"title": "Основная работа", "estimatedPomodoros": 3},
-                {"title": "Завершение", "estimatedPomodoros": 1},
-            ]
+            sub_tasks = FALLBACK_SUB_TASKS
+            outcome = "fallback"
 
         total = sum(s["estimatedPomodoros"] for s in sub_tasks)
         return AnalyzeTaskResponse(success=True, subTasks=sub_tasks, totalPomodoros=total)
+    except QueueFull as e:
+        outcome = "queue_full"
+        raise _queue_full(e)
+    except DeadlineExceeded as e:
+        outcome = "deadline"
+        raise HTTPException(status_code=504, detail=str(e))
     except httpx.HTTPError as e:
+        outcome = "lm_error"
         logger.exception("LM HTTP error")
         raise HTTPException(status_code=502, detail="Модель недоступна (LM_BASE_URL/туннель?)")
     except Exception as e:
         logger.exception("Analyze error")
         raise HTTPException(status_code=500, detail=f"Ошибка анализа задачи: {e}")
+    finally:
+        ANALYZE_REQUESTS.labels(outcome).inc()
+        ANALYZE_SECONDS.observe(time.perf_counter() - started)
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse, который по окончании ответа - в том числе оборванного клиентом
+    или так и не начатого - закрывает генератор и вызывает on_close
+    """
+
+    def __init__(self, content: AsyncIterator[str], on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                self.on_close()
+
+@app.post("/analyze_task/stream")
+async def analyze_task_stream(req: AnalyzeTaskRequest):
+    """
+    Разбор задачи с потоковой выдачей (text/event-stream): событие subtask отправляется,
+    как только подзадача полностью разобрана из ответа модели, в конце - событие done
+    с полным планом, при ошибке - событие error
+    """
+    key = normalize_key(req.description, req.deadline)
+    cached = analyze_cache.lookup(key)
+    priority, deadline = _admission(req)
+    holding = cached is None
+    if holding:
+        # Слот в очереди занимаем до ответа, чтобы переполнение вернулось как 429, а не внутри потока
+        try:
+            await lm_queue.acquire(priority, deadline)
+        except QueueFull as e:
+            raise _queue_full(e)
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+
+    def release():
+        # Слот освобождается один раз: сразу после ответа модели или, если поток оборвался, по закрытии ответа
+        nonlocal holding
+        if holding:
+            holding = False
+            lm_queue.release()
+
+    async def events():
+        sub_tasks = cached
+        if sub_tasks is None:
+            sub_tasks = []
+            parser = _SubTaskStreamParser()
+            try:
+                async with aclosing(_stream_lm(_build_prompt(req.description, req.deadline))) as stream:
+                    while True:
+                        # Дедлайн ограничивает ожидание модели; время, пока клиент читает поток, тоже идёт в счёт
+                        async with asyncio.timeout_at(deadline):
+                            chunk = await anext(stream, None)
+                        if chunk is None:
+                            break
+                        for st in parser.feed(chunk):
+                            sub_tasks.append(st)
+                            yield _sse("subtask", st)
+            except TimeoutError:
+                logger.warning("Дедлайн истёк во время потокового ответа модели")
+                yield _sse("error", {"detail": "Дедлайн истёк во время запроса к модели"})
+                return
+            except httpx.HTTPError:
+                logger.exception("LM HTTP error")
+                yield _sse("error", {"detail": "Модель недоступна (LM_BASE_URL/туннель?)"})
+                return
+            except Exception as e:
+                logger.exception("Analyze stream error")
+                yield _sse("error", {"detail": f"Ошибка анализа задачи: {e}"})
+                return
+            finally:
+                release()
+            if sub_tasks:
+                analyze_cache.put(key, sub_tasks)
+        else:
+            for st in sub_tasks:
+                yield _sse("subtask", st)
+
+        if not sub_tasks:
+            sub_tasks = FALLBACK_SUB_TASKS
+            for st in sub_tasks:
+                yield _sse("subtask", st)
+
+        total = sum(s["estimatedPomodoros"] for s in sub_tasks)
+        yield _sse("done", {"success": True, "subTasks": sub_tasks, "totalPomodoros": total})
+
+    return _ClosingStreamingResponse(
+        events(),
+        release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/lm/queue")
+async def lm_queue_stats():
+    """Состояние очереди к модели: глубина, занятые слоты, отказы, время ожидания"""
+    return {"ok": True, **lm_queue.stats()}
+
+@app.get("/analyze_task/cache")
+async def analyze_cache_stats():
+    """Счётчики кэша разбора задач: попадания, промахи, объединённые запросы"""
+    return {"ok": True, **analyze_cache.stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Метрики API и бота (если он в этом процессе) в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
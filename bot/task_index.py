@@ -0,0 +1,216 @@
+"""
+Индекс незавершённых задач пользователей для утренних напоминаний.
+
+Для каждого пользователя хранится упорядоченный по добавлению словарь
+{id задачи: TaskRecord} только незавершённых задач. Он обновляется по
+изменившимся задачам (сохранение в боте, синхронизация из webapp), так
+что при рассылке сводка читается без обхода исходных задач.
+
+Индекс ограничен по размеру (LRU) и времени жизни записей (TTL); при
+промахе задачи пользователя перечитываются из хранилища через loader.
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_SIZE = 5
+UNTITLED = "Задача без названия"
+
+TaskLoader = Callable[[int], Awaitable[Optional[List[Dict[str, Any]]]]]
+
+
+def task_key(task: Dict[str, Any], position: Optional[int] = None) -> Optional[str]:
+    """Ключ задачи в индексе: id, а для задач без id - позиция в списке"""
+    task_id = task.get("id")
+    if task_id is not None:
+        return str(task_id)
+    if position is not None:
+        return f"#{position}"
+    return None
+
+
+def task_title(task: Dict[str, Any]) -> str:
+    """Название задачи: description у задач бота, title у задач webapp"""
+    return task.get("description") or task.get("title") or UNTITLED
+
+
+class SubTaskRecord:
+    """Незавершённая подзадача"""
+
+    __slots__ = ("title",)
+
+    def __init__(self, title: str):
+        self.title = title
+
+
+class TaskRecord:
+    """Незавершённая задача: название и её невыполненные подзадачи"""
+
+    __slots__ = ("title", "subtasks")
+
+    def __init__(self, title: str, subtasks: Tuple[SubTaskRecord, ...]):
+        self.title = title
+        self.subtasks = subtasks
+
+    @classmethod
+    def from_task(cls, task: Dict[str, Any]) -> Optional["TaskRecord"]:
+        """
+        Запись для задачи бота (description/subtasks) или webapp (title/subTasks);
+        None, если у задачи не осталось невыполненных подзадач
+        """
+        subtasks = tuple(
+            SubTaskRecord(subtask.get("title") or "")
+            for subtask in task.get("subtasks") or task.get("subTasks") or []
+            if not subtask.get("completed", False)
+        )
+        if not subtasks:
+            return None
+        return cls(task_title(task), subtasks)
+
+
+class UserTasks:
+    """Запись индекса одного пользователя"""
+
+    __slots__ = ("tasks", "expires_at")
+
+    def __init__(self, tasks: Dict[str, TaskRecord], expires_at: float):
+        self.tasks = tasks
+        self.expires_at = expires_at
+
+
+class IncompleteTaskIndex:
+    """
+    Сводки незавершённых задач по пользователям.
+
+    Args:
+        maxsize: сколько пользователей держать в памяти (LRU)
+        ttl: время жизни записи, с; после него задачи перечитываются через loader
+        loader: async loader(user_id) -> список задач или None; без loader записи
+            не вытесняются по TTL, а вытесненные по размеру теряются до следующего обновления
+        preview_size: сколько названий задач в сводке
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 100000,
+        ttl: float = 24 * 3600,
+        loader: Optional[TaskLoader] = None,
+        preview_size: int = PREVIEW_SIZE,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.loader = loader
+        self.preview_size = preview_size
+        self._users: "OrderedDict[int, UserTasks]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.loader else float("inf")
+
+    def _store(self, user_id: int, tasks: Dict[str, TaskRecord]) -> None:
+        self._users[user_id] = UserTasks(tasks, self._expires_at())
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+            self.evictions += 1
+
+    def replace(self, user_id: int, tasks: Iterable[Dict[str, Any]]) -> None:
+        """Перестроить сводку пользователя по полному списку задач"""
+        incomplete = {}
+        for position, task in enumerate(tasks):
+            record = TaskRecord.from_task(task)
+            if record is not None:
+                incomplete[task_key(task, position)] = record
+        self._store(user_id, incomplete)
+
+    def apply(
+        self,
+        user_id: int,
+        changed: Iterable[Dict[str, Any]] = (),
+        deleted: Iterable[Any] = (),
+    ) -> None:
+        """
+        Учесть изменённые и удалённые задачи; работа пропорциональна числу изменений.
+        Если пользователя нет в памяти, а loader задан, изменения пропускаются -
+        при следующем обращении задачи перечитаются из хранилища целиком
+        """
+        entry = self._users.get(user_id)
+        if entry is None:
+            if self.loader:
+                return
+            self._store(user_id, {})
+            entry = self._users[user_id]
+        incomplete = entry.tasks
+        for task_id in deleted:
+            incomplete.pop(str(task_id), None)
+        for task in changed:
+            key = task_key(task)
+            if key is None:
+                continue
+            record = TaskRecord.from_task(task)
+            if record is not None:
+                # у уже известной задачи запись заменяется, место в порядке сохраняется
+                incomplete[key] = record
+            else:
+                incomplete.pop(key, None)
+
+    def remove(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+
+    async def _entry(self, user_id: int) -> Optional[UserTasks]:
+        entry = self._users.get(user_id)
+        if entry is not None and entry.expires_at > time.time():
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        if self.loader is None:
+            return entry
+        try:
+            tasks = await self.loader(user_id)
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить задачи пользователя {user_id}: {e}")
+            return entry
+        self.replace(user_id, tasks or [])
+        return self._users.get(user_id)
+
+    async def summary(self, user_id: int) -> Tuple[int, List[str]]:
+        """Число незавершённых задач и названия первых preview_size из них"""
+        entry = await self._entry(user_id)
+        if entry is None or not entry.tasks:
+            return 0, []
+        titles = [record.title for record in islice(entry.tasks.values(), self.preview_size)]
+        return len(entry.tasks), titles
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._users),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def create_index_from_env(loader: Optional[TaskLoader] = None) -> IncompleteTaskIndex:
+    """Индекс по переменным окружения: REMINDER_CACHE_SIZE, REMINDER_CACHE_TTL"""
+    return IncompleteTaskIndex(
+        maxsize=int(os.getenv("REMINDER_CACHE_SIZE", 100000)),
+        ttl=float(os.getenv("REMINDER_CACHE_TTL", 24 * 3600)),
+        loader=loader,
+    )
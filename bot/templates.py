@@ -0,0 +1,158 @@
+"""
+Готовые клавиатуры и тексты статических экранов бота.
+
+Клавиатуры собираются один раз при импорте: объект вложения только
+читается при отправке, поэтому его можно переиспользовать во всех
+сообщениях. Тексты с данными пользователя - шаблоны str.format,
+которые заполняются при отправке.
+"""
+from maxapi.types import LinkButton
+from maxapi.utils.inline_keyboard import InlineKeyboardBuilder
+
+WEBAPP_URL = "https://max.ru/t122_hakaton_bot?startapp"
+
+
+def _webapp_button():
+    try:
+        return LinkButton(text="📱 Открыть приложение", url=WEBAPP_URL)
+    except Exception:
+        return {"text": "📱 Открыть приложение", "url": WEBAPP_URL}
+
+
+def _keyboard(*rows):
+    """Вложение-клавиатура из рядов кнопок"""
+    builder = InlineKeyboardBuilder()
+    for row in rows:
+        builder.row(*row)
+    return builder.as_markup()
+
+
+# Клавиатуры
+
+MAIN_MENU_KEYBOARD = _keyboard(
+    [_webapp_button()],
+    [{"text": "ℹ️ Как работает", "payload": "how_it_works"}],
+    [{"text": "🤖 Умный помощник", "payload": "ai_assistant"}],
+)
+
+HOW_IT_WORKS_KEYBOARD = _keyboard(
+    [_webapp_button()],
+    [{"text": "◀️ Назад", "payload": "back_to_main"}],
+)
+
+AI_CHAT_KEYBOARD = _keyboard(
+    [{"text": "◀️ Выйти из чата", "payload": "back_to_main"}],
+)
+
+CANCEL_KEYBOARD = _keyboard(
+    [{"text": "❌ Отмена", "payload": "back_to_main"}],
+)
+
+DEADLINE_KEYBOARD = _keyboard(
+    [
+        {"text": "📅 Указать дедлайн", "payload": "set_deadline"},
+        {"text": "➡️ Продолжить без", "payload": "no_deadline"},
+    ],
+    [{"text": "❌ Отмена", "payload": "back_to_main"}],
+)
+
+BACK_TO_PLAN_KEYBOARD = _keyboard(
+    [{"text": "◀️ Назад к плану", "payload": "show_plan"}],
+)
+
+TASK_SAVED_KEYBOARD = _keyboard(
+    [{"text": "🍅 Начать первый шаг", "payload": "start_first_step"}],
+    [{"text": "📋 Посмотреть все задачи", "payload": "list_tasks"}],
+    [{"text": "◀️ Главное меню", "payload": "back_to_main"}],
+)
+
+SESSION_FINISHED_KEYBOARD = _keyboard(
+    [{"text": "🍅 Новая сессия", "payload": "quick_pomodoro"}],
+)
+
+_POMODORO_CONTROLS = [
+    {"text": "✅ Завершить", "payload": "complete_session"},
+    {"text": "⏹ Остановить", "payload": "pomodoro_cancel"},
+]
+
+POMODORO_RUNNING_KEYBOARD = _keyboard(
+    [{"text": "⏸ Пауза", "payload": "pomodoro_pause"}],
+    _POMODORO_CONTROLS,
+)
+
+POMODORO_PAUSED_KEYBOARD = _keyboard(
+    [{"text": "▶️ Продолжить", "payload": "pomodoro_resume"}],
+    _POMODORO_CONTROLS,
+)
+
+
+# Тексты
+
+WELCOME_TEXT = """📱 Открой веб-приложение для удобной работы с задачами!
+
+Я помогу:
+• Разбить большие задачи на шаги
+• Фокусироваться с Pomodoro
+• Отслеживать прогресс и мотивацию"""
+
+MAIN_MENU_TEXT = """🎯 FocusHelper!
+
+📱 Открой веб-приложение для работы с задачами!"""
+
+HELP_TEXT = """📋 Меню команд FocusHelper:
+
+/start - Начать работу с ботом
+/help или /menu - Показать это меню
+/test_reminder - Тест утреннего напоминания
+/reminder - Время утреннего напоминания
+
+📱 Используй кнопки в сообщениях для быстрого доступа к функциям!"""
+
+HOW_IT_WORKS_TEXT = """🍅 Как работает FocusHelper:
+
+📋 Работа с задачами:
+• Создай задачу в веб-приложении
+• Приложение разобьет её на шаги
+• Каждый шаг можно выполнить за несколько Pomodoro сессий
+
+⏱️ Pomodoro техника:
+1. Выбери задачу или шаг
+2. Работай 25 минут без отвлечений
+3. Отдохни 5 минут
+4. После 4 сессий - длинный перерыв 15-30 минут
+
+📊 Статистика и мотивация:
+• Отслеживай свой прогресс
+• Получай достижения за активность
+• Повышай уровень и зарабатывай XP
+
+⏰ Утренние напоминания:
+• Каждый день в 9:00 утра я напомню о незавершенных делах
+• Это поможет не забыть важные задачи
+
+📱 Используй веб-приложение для полного функционала!"""
+
+AI_GREETING_TEXT = (
+    "🤖 Привет! Я умный помощник. Задай мне любой вопрос, и я постараюсь помочь!\n\n"
+    "Например:\n"
+    "• Как лучше планировать задачи?\n"
+    "• Что такое техника Pomodoro?\n"
+    "• Как повысить продуктивность?"
+)
+AI_EMPTY_QUESTION_TEXT = "Пожалуйста, задайте вопрос текстом."
+AI_THINKING_TEXT = "🤔 Думаю..."
+AI_ERROR_TEXT = "❌ Произошла ошибка при обработке вопроса: {error}"
+AI_INTERRUPTED_TEXT = "\n\n⚠️ Ответ оборвался: модель перестала отвечать. Задайте вопрос ещё раз, чтобы получить его целиком."
+
+CREATE_TASK_TEXT = "Опиши свою задачу одним сообщением.\n\nНапример: 'Подготовиться к экзамену по экономике'"
+QUICK_POMODORO_TEXT = "Для быстрой сессии: опиши, на чем фокусируешься (например: 'Чтение статьи')"
+TASK_DESCRIPTION_TEXT = "Задача: {description}\n\nХочешь указать дедлайн? (опционально)"
+TASK_SAVED_TEXT = "✅ План сохранен!\n\nГотов начать работу?"
+
+SESSION_COMPLETED_TEXT = "🎉 Сессия завершена! +10 XP\n\nОтдохни и продолжи!"
+SESSION_TIME_UP_TEXT = "⏰ Время вышло! Сессия «{title}» завершена. +10 XP\n\nОтдохни 5 минут и продолжай!"
+SESSION_STARTED_TEXT = "🍅 Сессия началась: {title}\n\n⏱ {minutes:g} минут без отвлечений. Я напишу, когда время выйдет."
+SESSION_PAUSED_TEXT = "⏸ Пауза. До конца сессии осталось {minutes:.0f} мин."
+SESSION_RESUMED_TEXT = "▶️ Продолжаем! Осталось {minutes:.0f} мин."
+SESSION_CANCELLED_TEXT = "⏹ Сессия остановлена. Возвращайся, когда будешь готов!"
+NO_ACTIVE_SESSION_TEXT = "Сейчас нет активной сессии."
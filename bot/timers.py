@@ -0,0 +1,100 @@
+"""
+Примитивы для таймеров: часы, которые можно подменить в тестах,
+и куча дедлайнов с ключами.
+"""
+import asyncio
+import heapq
+import time
+from typing import Dict, Generic, Hashable, Iterable, List, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class SystemClock:
+    """Реальные часы: время Unix в секундах и asyncio.sleep"""
+
+    def time(self) -> float:
+        return time.time()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+
+async def sleep_or_wakeup(clock, wakeup: asyncio.Event, delay: Optional[float]) -> None:
+    """Спать delay секунд по clock (None - бессрочно) или до wakeup.set()"""
+    waiter = asyncio.create_task(wakeup.wait())
+    waiters = {waiter}
+    if delay is not None:
+        waiters.add(asyncio.create_task(clock.sleep(delay)))
+    try:
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in waiters:
+            task.cancel()
+
+
+class DeadlineHeap(Generic[K]):
+    """
+    Мин-куча (время срабатывания, ключ) с переносом и отменой по ключу.
+
+    Перенос и отмена не ищут запись в куче: старые записи остаются и
+    пропускаются при извлечении, если их время не совпадает с текущим
+    временем ключа.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, K]] = []
+        self._when: Dict[K, float] = {}
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._when)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._when
+
+    def when(self, key: K) -> Optional[float]:
+        return self._when.get(key)
+
+    def schedule(self, key: K, when: float) -> None:
+        """Поставить (или перенести) срабатывание ключа на время when"""
+        self._when[key] = when
+        self._seq += 1
+        heapq.heappush(self._heap, (when, self._seq, key))
+        if len(self._heap) > 2 * len(self._when) + 64:
+            self._compact()
+
+    def schedule_many(self, items: Iterable[Tuple[K, float]]) -> None:
+        """Поставить много срабатываний сразу: одна перестройка кучи вместо push на каждое"""
+        for key, when in items:
+            self._when[key] = when
+        self._compact()
+
+    def cancel(self, key: K) -> None:
+        self._when.pop(key, None)
+
+    def next_time(self) -> Optional[float]:
+        """Время ближайшего срабатывания или None, если таймеров нет"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[Tuple[float, K]]:
+        """Извлечь все ключи со временем срабатывания <= now"""
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            when, _, key = heapq.heappop(self._heap)
+            del self._when[key]
+            due.append((when, key))
+
+    def _drop_stale(self) -> None:
+        heap = self._heap
+        while heap and self._when.get(heap[0][2]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def _compact(self) -> None:
+        self._heap = [(when, i, key) for i, (key, when) in enumerate(self._when.items())]
+        heapq.heapify(self._heap)
+        self._seq = len(self._heap)
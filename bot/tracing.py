@@ -0,0 +1,199 @@
+"""
+Время обработки обновлений бота: целиком и по этапам.
+
+UpdateTracer ставится middleware в диспетчер (снаружи всей цепочки) и в
+роутеры (вокруг каждого обработчика) и для каждого обновления собирает
+UpdateTrace: загрузка контекста, обработчик, отправка сообщений. Этапы
+добавляют и сами модули (add_stage) - трасса текущего обновления хранится
+в contextvar, поэтому одновременные обновления (вебхук) не смешиваются.
+
+Время попадает в метрики; обновление дольше slow_ms записывается в лог
+с разбивкой по этапам и в slow (последние медленные трассы). Обычные
+обновления в лог попадают по одному из log_every (INFO), все - только
+на уровне DEBUG; строки форматируются, только если запись будет выведена.
+"""
+import functools
+import logging
+import os
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Deque, Dict, Iterable, Optional, Tuple
+
+from maxapi import Dispatcher
+from maxapi.filters.middleware import BaseMiddleware
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+UPDATE_SECONDS = metrics.histogram(
+    "focus_update_seconds", "Обработка обновления целиком, от загрузки контекста до выхода из обработчика, с",
+    ["handler"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+STAGE_SECONDS = metrics.histogram(
+    "focus_update_stage_seconds", "Этапы обработки обновления (context, handler, send), с", ["stage"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+SLOW_UPDATES = metrics.counter("focus_slow_updates_total", "Обновления дольше порога SLOW_UPDATE_MS", ["handler"])
+
+UNHANDLED = "-"
+
+
+class UpdateTrace:
+    """Трасса одного обновления: тип, чат, обработчик и время этапов, с"""
+
+    __slots__ = ("update_type", "chat_id", "user_id", "handler", "started", "total", "stages")
+
+    def __init__(self, update_type: Any, chat_id: Optional[int], user_id: Optional[int]):
+        self.update_type = update_type
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.handler = UNHANDLED
+        self.started = perf_counter()
+        self.total = 0.0
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def describe(self) -> str:
+        update_type = getattr(self.update_type, "value", self.update_type)
+        stages = ", ".join(f"{name} {seconds * 1000:.1f}" for name, seconds in self.stages.items())
+        return (
+            f"{update_type} {self.handler} chat_id={self.chat_id} user_id={self.user_id}: "
+            f"{self.total * 1000:.1f} мс ({stages})"
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "update_type": getattr(self.update_type, "value", self.update_type),
+            "handler": self.handler,
+            "chat_id": self.chat_id,
+            "user_id": self.user_id,
+            "total_ms": round(self.total * 1000, 2),
+            "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()},
+        }
+
+
+_current: ContextVar[Optional[UpdateTrace]] = ContextVar("update_trace", default=None)
+# загрузка контекста идёт в диспетчере до middleware - её время ждёт здесь начала трассы
+_context_load: ContextVar[Tuple[Optional[int], Optional[int], float]] = ContextVar(
+    "context_load", default=(None, None, 0.0)
+)
+
+
+def current_trace() -> Optional[UpdateTrace]:
+    return _current.get()
+
+
+def add_stage(stage: str, seconds: float) -> None:
+    """Добавить время этапа к трассе текущего обновления (если она есть)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+def note_context_load(chat_id: Optional[int], user_id: Optional[int], seconds: float) -> None:
+    """Время загрузки контекста для обновления, которое сейчас начнёт обрабатываться"""
+    _context_load.set((chat_id, user_id, seconds))
+
+
+def _handler_name(handler) -> str:
+    """Имя функции-обработчика из цепочки middleware maxapi (partial(call_handler, Handler))"""
+    while isinstance(handler, functools.partial) and handler.args:
+        first = handler.args[0]
+        func_event = getattr(first, "func_event", None)
+        if func_event is not None:
+            return func_event.__name__
+        handler = first
+    return UNHANDLED
+
+
+class _UpdateMiddleware(BaseMiddleware):
+    """Снаружи всей цепочки диспетчера: трасса обновления целиком"""
+
+    def __init__(self, tracer: "UpdateTracer"):
+        self.tracer = tracer
+
+    async def __call__(self, handler, event_object, data):
+        # ids диспетчер уже достал для поиска контекста - берём их оттуда же
+        chat_id, user_id, context_load = _context_load.get()
+        trace = UpdateTrace(getattr(event_object, "update_type", None), chat_id, user_id)
+        trace.stages["context"] = context_load
+        token = _current.set(trace)
+        try:
+            return await handler(event_object, data)
+        finally:
+            _current.reset(token)
+            trace.total = perf_counter() - trace.started + context_load
+            self.tracer.finish(trace)
+
+
+class _HandlerMiddleware(BaseMiddleware):
+    """Вокруг обработчика роутера: имя обработчика и его время"""
+
+    async def __call__(self, handler, event_object, data):
+        trace = _current.get()
+        if trace is None:
+            return await handler(event_object, data)
+        trace.handler = _handler_name(handler)
+        started = perf_counter()
+        try:
+            return await handler(event_object, data)
+        finally:
+            trace.add("handler", perf_counter() - started)
+
+
+class UpdateTracer:
+    """
+    Замер обработки обновлений и трассы медленных.
+
+    Args:
+        slow_ms: обновления дольше этого пишутся в лог (WARNING) и в slow
+        keep: сколько последних медленных трасс хранить
+        log_every: писать в лог (INFO) каждое log_every-е обычное обновление; 0 - только на DEBUG
+    """
+
+    def __init__(self, slow_ms: float = 1000.0, keep: int = 100, log_every: int = 0):
+        self.slow_threshold = slow_ms / 1000
+        self.log_every = log_every
+        self.slow: Deque[UpdateTrace] = deque(maxlen=keep)
+        self.updates = 0
+        self.update_middleware = _UpdateMiddleware(self)
+        self.handler_middleware = _HandlerMiddleware()
+
+    def install(self, dp: Dispatcher, routers: Iterable[Dispatcher] = ()) -> None:
+        """Поставить middleware: в диспетчер - первым, в роутеры - вокруг обработчиков"""
+        dp.outer_middleware(self.update_middleware)
+        for router in routers:
+            router.middleware(self.handler_middleware)
+
+    def finish(self, trace: UpdateTrace) -> None:
+        self.updates += 1
+        UPDATE_SECONDS.labels(trace.handler).observe(trace.total)
+        for stage, seconds in trace.stages.items():
+            STAGE_SECONDS.labels(stage).observe(seconds)
+
+        if trace.total >= self.slow_threshold:
+            self.slow.append(trace)
+            SLOW_UPDATES.labels(trace.handler).inc()
+            logger.warning("Медленное обновление: %s", trace.describe())
+        elif self.log_every and self.updates % self.log_every == 0:
+            logger.info("Обновление (1 из %d): %s", self.log_every, trace.describe())
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Обновление: %s", trace.describe())
+
+    def slow_traces(self) -> list:
+        """Последние медленные трассы, новые в конце"""
+        return [trace.as_dict() for trace in self.slow]
+
+
+def create_tracer_from_env() -> UpdateTracer:
+    """Трассировка по переменным окружения: SLOW_UPDATE_MS, SLOW_UPDATE_KEEP, UPDATE_LOG_EVERY"""
+    return UpdateTracer(
+        slow_ms=float(os.getenv("SLOW_UPDATE_MS", 1000)),
+        keep=int(os.getenv("SLOW_UPDATE_KEEP", 100)),
+        log_every=int(os.getenv("UPDATE_LOG_EVERY", 100)),
+    )
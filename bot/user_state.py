@@ -0,0 +1,237 @@
+"""
+Данные пользователя для синхронизации и правила их слияния.
+
+Документ пользователя:
+    settings         - настройки
+    settingsClocks   - {ключ: [ts, ревизия]} для настроек
+    tasks            - индекс задач {id: задача}
+    taskClocks       - {id: {поле: [ts, ревизия]}} для полей задач
+    taskRevisions    - {id: ревизия}, упорядочен по ревизиям
+    tombstones       - {id: ревизия} удалённых задач, упорядочен по ревизиям
+    deletedAt        - {id: ts} время удаления задачи
+    stats            - статистика (по ключу берётся максимум)
+    revision         - ревизия пользователя, растёт при каждом изменении
+
+Задачи и настройки сливаются по полям по правилу «последний писатель
+побеждает» (LWW): у каждого поля хранится время записи, при равенстве
+времени побеждает большее значение в канонической JSON-форме. Поэтому
+одинаковые правки, пришедшие в разном порядке от бота и webapp, сходятся
+к одному результату, а стоимость слияния зависит только от размера
+присланных изменений.
+
+Время поля - время правки на клиенте (fieldTimestamps задачи,
+settingsTimestamps для настроек), без него - clientTime запроса; время из
+будущего обрезается до времени сервера.
+"""
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Служебное поле задачи с временем правки отдельных полей (мс)
+FIELD_TIMESTAMPS = "fieldTimestamps"
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def touch(revisions: Dict[str, int], key: str, revision: int):
+    """Записать ревизию так, чтобы словарь оставался упорядоченным по ревизиям"""
+    revisions.pop(key, None)
+    revisions[key] = revision
+
+
+def changed_since(revisions: Dict[str, int], since: int) -> List[str]:
+    """Ключи, изменённые после since: идём с конца упорядоченного словаря"""
+    keys = []
+    for key in reversed(revisions):
+        if revisions[key] <= since:
+            break
+        keys.append(key)
+    keys.reverse()
+    return keys
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def lww_merge(
+    target: Dict[str, Any],
+    clocks: Dict[str, list],
+    incoming: Dict[str, Any],
+    ts: int,
+    revision: int,
+    field_ts: Optional[Dict[str, int]] = None,
+    skip: Tuple[str, ...] = (),
+) -> bool:
+    """Слить incoming в target по полям (LWW). Возвращает True, если target изменился"""
+    changed = False
+    for field, value in incoming.items():
+        if field in skip:
+            continue
+        field_time = ts
+        if field_ts and field in field_ts:
+            field_time = min(int(field_ts[field]), ts)
+
+        clock = clocks.get(field)
+        if clock is not None:
+            if field in target and target[field] == value:
+                continue
+            if field_time < clock[0]:
+                continue
+            if field_time == clock[0] and _canonical(value) <= _canonical(target.get(field)):
+                continue
+
+        target[field] = value
+        clocks[field] = [field_time, revision]
+        changed = True
+    return changed
+
+
+def ensure_index(record: Dict[str, Any]) -> None:
+    """Перевести документ старого формата (tasks - список) на индекс задач"""
+    tasks = record.get("tasks")
+    if isinstance(tasks, dict):
+        return
+
+    index = {}
+    for i, task in enumerate(tasks or []):
+        task_id = str(task.get("id") or f"legacy-{i}")
+        index[task_id] = task
+    record["tasks"] = index
+
+
+def merge_sync(
+    record: Dict[str, Any],
+    settings: Optional[Dict[str, Any]] = None,
+    tasks: Optional[Iterable[Dict[str, Any]]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    deleted_task_ids: Optional[Iterable[Any]] = None,
+    client_time: Optional[int] = None,
+    max_tombstones: int = 1000,
+    settings_timestamps: Optional[Dict[str, int]] = None,
+) -> bool:
+    """Слить присланные данные в документ пользователя. Возвращает True, если что-то изменилось"""
+    ensure_index(record)
+    revision = record.get("revision", 0) + 1
+    server_time = now_ms()
+    ts = min(client_time, server_time) if client_time else server_time
+    changed = False
+
+    if settings is not None:
+        current_settings = record.setdefault("settings", {})
+        if lww_merge(
+            current_settings,
+            record.setdefault("settingsClocks", {}),
+            settings,
+            ts,
+            revision,
+            field_ts=settings_timestamps,
+        ):
+            record["settingsRevision"] = revision
+            changed = True
+
+    if tasks is not None or deleted_task_ids:
+        index = record["tasks"]
+        task_clocks = record.setdefault("taskClocks", {})
+        task_revisions = record.setdefault("taskRevisions", {})
+        tombstones = record.setdefault("tombstones", {})
+        deleted_at = record.setdefault("deletedAt", {})
+
+        for task in tasks or []:
+            raw_id = task.get("id")
+            task_id = str(raw_id) if raw_id not in (None, "") else f"srv-{revision}-{len(index)}"
+            field_ts = task.get(FIELD_TIMESTAMPS)
+            if task_id in deleted_at:
+                newest = max((field_ts or {}).values(), default=ts)
+                if min(newest, ts) <= deleted_at[task_id]:
+                    continue
+                tombstones.pop(task_id, None)
+                deleted_at.pop(task_id, None)
+
+            stored = index.get(task_id)
+            if stored is None:
+                stored = index[task_id] = {"id": raw_id if raw_id not in (None, "") else task_id}
+            if lww_merge(
+                stored,
+                task_clocks.setdefault(task_id, {}),
+                task,
+                ts,
+                revision,
+                field_ts=field_ts,
+                skip=("id", FIELD_TIMESTAMPS),
+            ):
+                touch(task_revisions, task_id, revision)
+                changed = True
+
+        for raw_id in deleted_task_ids or []:
+            task_id = str(raw_id)
+            if index.pop(task_id, None) is None:
+                continue
+            task_clocks.pop(task_id, None)
+            task_revisions.pop(task_id, None)
+            touch(tombstones, task_id, revision)
+            deleted_at[task_id] = ts
+            changed = True
+
+        while len(tombstones) > max_tombstones:
+            oldest = next(iter(tombstones))
+            record["tombstoneFloor"] = tombstones.pop(oldest)
+            deleted_at.pop(oldest, None)
+
+    if stats is not None:
+        existing_stats = record.setdefault("stats", {})
+        stats_changed = False
+        for key, value in stats.items():
+            if key in existing_stats:
+                if isinstance(value, (int, float)) and isinstance(existing_stats[key], (int, float)):
+                    value = max(existing_stats[key], value)
+            if key not in existing_stats or existing_stats[key] != value:
+                existing_stats[key] = value
+                stats_changed = True
+        if stats_changed:
+            record["statsRevision"] = revision
+            changed = True
+
+    if changed:
+        record["revision"] = revision
+    return changed
+
+
+def task_list(record: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """Все задачи пользователя списком (для полного ответа)"""
+    tasks = record.get("tasks")
+    if tasks is None:
+        return None
+    if isinstance(tasks, dict):
+        return list(tasks.values())
+    return tasks
+
+
+def task_delta(record: Dict[str, Any], since: int) -> List[Dict[str, Any]]:
+    """Задачи, изменённые после ревизии since: только изменившиеся поля и id"""
+    ensure_index(record)
+    index = record["tasks"]
+    task_clocks = record.get("taskClocks", {})
+    delta = []
+    for task_id in changed_since(record.get("taskRevisions", {}), since):
+        task = index.get(task_id)
+        if task is None:
+            continue
+        clocks = task_clocks.get(task_id, {})
+        fields = {"id": task.get("id")}
+        for field, clock in clocks.items():
+            if clock[1] > since and field in task:
+                fields[field] = task[field]
+        delta.append(fields)
+    return delta
+
+
+def changed_tasks(record: Dict[str, Any], since: int) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Задачи целиком, изменённые после ревизии since, и id задач, удалённых после неё"""
+    ensure_index(record)
+    index = record["tasks"]
+    changed = [index[task_id] for task_id in changed_since(record.get("taskRevisions", {}), since) if task_id in index]
+    deleted = changed_since(record.get("tombstones", {}), since)
+    return changed, deleted
@@ -0,0 +1,151 @@
+"""
+Общие данные пользователей для API синхронизации и бота.
+
+Бот и webapp пишут задачи и статистику в один документ пользователя
+(user_state) по одним правилам слияния. Хранилище - WriteBehindStore, то
+же, что у sync_api; когда бот и API работают в одном процессе, правка из
+webapp сразу видна боту и наоборот. Слушатели узнают об изменённых
+задачах после каждого слияния (например, индекс напоминаний).
+
+В документе статистика только накопительная (totalSessions,
+totalFocusTime); если задан rollups, прирост сессий и минут фокуса при
+каждом слиянии записывается ещё и по дням (stats_rollup).
+"""
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from stats_rollup import StatsRollups
+from storage import WriteBehindStore
+from user_state import changed_tasks, merge_sync, now_ms, task_list
+
+logger = logging.getLogger(__name__)
+
+SyncListener = Callable[[int, List[Dict[str, Any]], List[str]], None]
+
+
+class UserStore:
+    """
+    Документы пользователей поверх хранилища синхронизации.
+
+    Args:
+        storage: хранилище документов по user_id
+        max_tombstones: сколько последних удалений помнить для дельта-синхронизации
+        rollups: статистика по дням, куда записывается прирост сессий
+    """
+
+    def __init__(
+        self,
+        storage: WriteBehindStore,
+        max_tombstones: int = 1000,
+        rollups: Optional[StatsRollups] = None,
+    ):
+        self.storage = storage
+        self.max_tombstones = max_tombstones
+        self.rollups = rollups
+        # listener(user_id, изменённые задачи целиком, id удалённых задач)
+        self.listeners: List[SyncListener] = []
+
+    def get(self, user_id: int) -> Dict[str, Any]:
+        """Документ пользователя (пустой, если данных ещё нет)"""
+        return self.storage.get(user_id) or {}
+
+    def tasks(self, user_id: int) -> List[Dict[str, Any]]:
+        """Задачи пользователя в порядке добавления"""
+        return task_list(self.get(user_id)) or []
+
+    def stats(self, user_id: int) -> Dict[str, Any]:
+        return self.get(user_id).get("stats") or {}
+
+    def apply(
+        self,
+        user_id: int,
+        settings: Optional[Dict[str, Any]] = None,
+        tasks: Optional[Iterable[Dict[str, Any]]] = None,
+        stats: Optional[Dict[str, Any]] = None,
+        deleted_task_ids: Optional[Iterable[Any]] = None,
+        client_time: Optional[int] = None,
+        settings_timestamps: Optional[Dict[str, int]] = None,
+        record_progress: bool = True,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Слить изменения в документ пользователя; возвращает документ и признак изменения.
+        record_progress=False - не записывать прирост статистики по дням (его записывает вызывающий)
+        """
+        record = self.get(user_id)
+        revision_before = record.get("revision", 0)
+        track = record_progress and stats is not None and self.rollups is not None
+        totals_before = _session_totals(record) if track else None
+        changed = merge_sync(
+            record,
+            settings=settings,
+            tasks=tasks,
+            stats=stats,
+            deleted_task_ids=deleted_task_ids,
+            client_time=client_time,
+            max_tombstones=self.max_tombstones,
+            settings_timestamps=settings_timestamps,
+        )
+        if changed:
+            self.storage[user_id] = record
+            self._notify(user_id, record, revision_before)
+            if totals_before is not None:
+                self._record_progress(user_id, totals_before, _session_totals(record), client_time)
+        return record, changed
+
+    def add_session(self, user_id: int, minutes: float, xp: int) -> Dict[str, Any]:
+        """Засчитать одну завершённую сессию: накопительная статистика, XP, уровень и статистика по дням"""
+        stats = self.stats(user_id)
+        new_xp = stats.get("xp", 0) + xp
+        record, _ = self.apply(user_id, stats={
+            "totalSessions": stats.get("totalSessions", 0) + 1,
+            "totalFocusTime": stats.get("totalFocusTime", 0) + round(minutes, 1),
+            "xp": new_xp,
+            "level": new_xp // 100 + 1,
+        }, record_progress=False)
+        if self.rollups is not None:
+            self.rollups.add(user_id, 1, minutes)
+        return record
+
+    def _record_progress(
+        self,
+        user_id: int,
+        before: Tuple[Optional[float], Optional[float]],
+        after: Tuple[Optional[float], Optional[float]],
+        client_time: Optional[int],
+    ) -> None:
+        """Прирост накопительной статистики из синхронизации - в статистику по дням"""
+        sessions_before, focus_before = before
+        sessions_after, focus_after = after
+        # первая статистика пользователя на сервере - точка отсчёта, а не сессии за сегодня
+        if sessions_before is None or sessions_after is None:
+            return
+        sessions = sessions_after - sessions_before
+        minutes = (focus_after or 0) - (focus_before or 0)
+        if sessions <= 0 and minutes <= 0:
+            return
+        at = min(client_time, now_ms()) / 1000 if client_time else time.time()
+        self.rollups.add(user_id, max(sessions, 0), max(minutes, 0), at=at)
+
+    def _notify(self, user_id: int, record: Dict[str, Any], since: int) -> None:
+        if not self.listeners:
+            return
+        changed, deleted = changed_tasks(record, since)
+        if not changed and not deleted:
+            return
+        for listener in self.listeners:
+            try:
+                listener(user_id, changed, deleted)
+            except Exception as e:
+                logger.error(f"Ошибка слушателя синхронизации для пользователя {user_id}: {e}", exc_info=True)
+
+
+def _session_totals(record: Dict[str, Any]) -> Tuple[Optional[float], Optional[float]]:
+    """Накопительные totalSessions и totalFocusTime документа (None, если их нет или это не числа)"""
+    stats = record.get("stats") or {}
+    sessions = stats.get("totalSessions")
+    focus = stats.get("totalFocusTime")
+    return (
+        sessions if isinstance(sessions, (int, float)) else None,
+        focus if isinstance(focus, (int, float)) else None,
+    )
@@ -0,0 +1,189 @@
+"""
+Приём обновлений MAX через вебхук.
+
+MAX присылает каждое обновление POST-запросом. Запрос проверяется по
+секрету (заголовок X-Max-Bot-Api-Secret, задаётся при подписке; без
+секрета приёмник не создаётся), тело
+разбирается в модель обновления и кладётся в очередь; ответ 200 уходит
+сразу, не дожидаясь обработчика. Обновления разбирает ограниченный пул
+обработчиков: обновления одного чата всегда попадают к одному и тому же
+обработчику, поэтому обрабатываются по порядку, как при long polling.
+Если очередь обработчика полна, запрос получает 503 с Retry-After, и MAX
+пришлёт обновление повторно.
+
+Приёмник - APIRouter, его можно подключить к любому приложению FastAPI,
+в том числе к sync_api.app:
+
+    receiver = create_receiver_from_env(dp, bot)
+    receiver.mount(sync_api.app)
+    ...
+    await receiver.start()   # при запуске приложения
+    await receiver.stop()    # при остановке
+"""
+import asyncio
+import hmac
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, List, Optional
+
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from maxapi import Bot, Dispatcher
+from maxapi.methods.types.getted_updates import UPDATE_MODEL_MAPPING
+from maxapi.utils.updates import enrich_event
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Max-Bot-Api-Secret"
+
+# Dispatcher.start_polling сам вызывает приватный __ready (on_started, имя бота);
+# публичного аналога для вебхука в maxapi нет, поэтому версия закреплена в requirements.txt
+MAXAPI_READY = "_Dispatcher__ready"
+
+
+class WebhookReceiver:
+    """
+    Приёмник вебхука: проверка, очередь и пул обработчиков для Dispatcher.
+
+    Args:
+        dp: диспетчер с зарегистрированными роутерами
+        bot: бот, от имени которого обрабатываются обновления
+        path: путь эндпоинта
+        secret: секрет вебхука (обязателен), проверяется в заголовке каждого запроса
+        url: публичный URL эндпоинта - если задан, бот подписывается на него при запуске
+        workers: сколько обновлений обрабатываются одновременно
+        max_queue: сколько обновлений могут ждать обработки (на весь пул)
+        wait_samples: сколько последних времён ожидания в очереди хранить для статистики
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        secret: str,
+        path: str = "/webhook",
+        url: Optional[str] = None,
+        workers: int = 8,
+        max_queue: int = 1000,
+        wait_samples: int = 1000,
+    ):
+        if not secret:
+            raise ValueError("Вебхук без секрета принимал бы обновления от кого угодно: задайте WEBHOOK_SECRET")
+        if not hasattr(dp, MAXAPI_READY):
+            raise RuntimeError(f"В этой версии maxapi нет Dispatcher.{MAXAPI_READY}: вебхук проверен с maxapi из requirements.txt")
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.url = url
+        self.queues: List[asyncio.Queue] = [
+            asyncio.Queue(maxsize=max(1, max_queue // workers)) for _ in range(workers)
+        ]
+        self.received = 0
+        self.rejected = 0
+        self.unauthorized = 0
+        self.handled = 0
+        self.waits: Deque[float] = deque(maxlen=wait_samples)
+        self._tasks: List[asyncio.Task] = []
+
+        self.router = APIRouter()
+        self.router.add_api_route(path, self.receive, methods=["POST"], include_in_schema=False)
+
+    def mount(self, app: FastAPI) -> None:
+        """Подключить эндпоинт к приложению"""
+        app.include_router(self.router)
+
+    def _check_secret(self, request: Request) -> None:
+        given = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(given.encode(), self.secret.encode()):
+            self.unauthorized += 1
+            raise HTTPException(status_code=403, detail="Неверный секрет вебхука")
+
+    async def receive(self, request: Request):
+        """POST от MAX: проверить, разобрать и поставить обновление в очередь"""
+        received_at = time.perf_counter()
+        self._check_secret(request)
+        try:
+            payload = await request.json()
+            event = UPDATE_MODEL_MAPPING[payload["update_type"]](**payload)
+            chat_id, user_id = event.get_ids()
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            raise HTTPException(status_code=400, detail="Некорректное обновление")
+
+        queue = self.queues[hash(chat_id if chat_id is not None else user_id) % len(self.queues)]
+        try:
+            queue.put_nowait((received_at, event))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"Очередь вебхука заполнена, обновление {payload['update_type']} отклонено")
+            return JSONResponse({"ok": False}, status_code=503, headers={"Retry-After": "1"})
+        self.received += 1
+        return {"ok": True}
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            received_at, event = await queue.get()
+            try:
+                self.waits.append(time.perf_counter() - received_at)
+                await self.dp.handle(await enrich_event(event, self.bot))
+                self.handled += 1
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления из вебхука: {e}", exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def start(self) -> None:
+        """Подготовить диспетчер (on_started), запустить обработчики и подписаться на вебхук"""
+        await getattr(self.dp, MAXAPI_READY)(self.bot)
+        self._tasks = [asyncio.create_task(self._work(queue)) for queue in self.queues]
+        if self.url:
+            result = await self.bot.subscribe_webhook(self.url, secret=self.secret)
+            logger.info(f"Подписка на вебхук {self.url}: {result}")
+        logger.info(f"Вебхук принимает обновления на {self.path}, обработчиков: {len(self.queues)}")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дообработать очередь (не дольше timeout) и остановить обработчики"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Очередь вебхука не разобрана, осталось обновлений: {self.depth}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def stats(self) -> dict[str, Any]:
+        """Счётчики и время от приёма до обработчика (медиана и 99-й перцентиль), с"""
+        waits = sorted(self.waits)
+        return {
+            "received": self.received,
+            "rejected": self.rejected,
+            "unauthorized": self.unauthorized,
+            "handled": self.handled,
+            "depth": self.depth,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_p99": waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0,
+        }
+
+
+def create_receiver_from_env(dp: Dispatcher, bot: Bot) -> WebhookReceiver:
+    """
+    Приёмник по переменным окружения: WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE
+    """
+    return WebhookReceiver(
+        dp,
+        bot,
+        secret=os.getenv("WEBHOOK_SECRET", ""),
+        path=os.getenv("WEBHOOK_PATH", "/webhook"),
+        url=os.getenv("WEBHOOK_URL") or None,
+        workers=int(os.getenv("WEBHOOK_WORKERS", 8)),
+        max_queue=int(os.getenv("WEBHOOK_QUEUE", 1000)),
+    )
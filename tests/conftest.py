@@ -0,0 +1,12 @@
+"""
+Модули бота импортируются так же, как при запуске из bot/, заглушки - из benchmarks/;
+данные синхронизации - в памяти
+"""
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bot"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+os.environ.setdefault("SYNC_STORAGE", "memory")
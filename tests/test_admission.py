@@ -0,0 +1,39 @@
+"""Очередь допуска к модели: глубина без обхода ожидающих и гистограмма времени ожидания"""
+import asyncio
+
+import pytest
+
+import admission
+from admission import AdmissionQueue, DeadlineExceeded
+
+
+def test_depth_follows_grants_timeouts_and_cancels():
+    async def scenario():
+        queue = AdmissionQueue(concurrency=1, max_queue=10)
+        waits_before = admission.WAIT_SECONDS._default.count
+        await queue.acquire()
+        assert queue.depth == 0
+
+        granted = asyncio.create_task(queue.acquire())
+        cancelled = asyncio.create_task(queue.acquire())
+        expiring = asyncio.create_task(queue.acquire(deadline=queue.deadline_for(0.05)))
+        await asyncio.sleep(0)
+        assert queue.depth == 3
+
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert queue.depth == 2
+        with pytest.raises(DeadlineExceeded):
+            await expiring
+        assert queue.depth == 1
+
+        queue.release()
+        await granted
+        assert queue.depth == 0
+        assert queue.stats()["active"] == 1
+        # ожидание допущенных запросов попадает в гистограмму: первый и granted
+        assert admission.WAIT_SECONDS._default.count - waits_before == 2
+        assert "focus_lm_queue_wait_seconds_count" in admission.WAIT_SECONDS.render()
+
+    asyncio.run(scenario())
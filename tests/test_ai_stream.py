@@ -0,0 +1,75 @@
+"""Потоковый ответ AI: длинный поток не обрезается общим таймаутом, оборвавшийся - помечается"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+from aiohttp import web
+
+import router
+from templates import AI_INTERRUPTED_TEXT
+
+
+async def _serve(chunks, delay: float, stall: bool) -> web.AppRunner:
+    """OpenRouter-подобный сервер: chunks с паузой delay, затем [DONE] или молчание"""
+
+    async def completions(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for text in chunks:
+            chunk = {"choices": [{"delta": {"content": text}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(delay)
+        if stall:
+            await asyncio.sleep(1)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    app = web.Application()
+    app.router.add_post("/chat/completions", completions)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message(self, message_id=None, text=None, attachments=None):
+        self.edits.append(text)
+
+
+def _answer(monkeypatch, chunks, delay: float, stall: bool) -> tuple:
+    async def scenario():
+        runner, port = await _serve(chunks, delay, stall)
+        monkeypatch.setattr(router, "OPENROUTER_URL", f"http://127.0.0.1:{port}/chat/completions")
+        event = SimpleNamespace(bot=FakeBot(), get_ids=lambda: (1, 1))
+        try:
+            answer = await router._stream_answer(event, "mid-1", "Как планировать день?", [])
+        finally:
+            await router.close_openrouter_session()
+            await runner.cleanup()
+        return answer, event.bot.edits
+
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test")
+    monkeypatch.setattr(router, "OPENROUTER_MODELS", ["stub/model"])
+    monkeypatch.setattr(router, "OPENROUTER_TIMEOUT", 0.3)
+    monkeypatch.setattr(router, "OPENROUTER_STREAM_READ_TIMEOUT", 0.3)
+    monkeypatch.setattr(router, "AI_STREAM_EDIT_INTERVAL", 0.0)
+    monkeypatch.setattr(router, "_outbox", None)
+    return asyncio.run(scenario())
+
+
+def test_stream_longer_than_total_timeout_is_complete(monkeypatch):
+    chunks = [f"часть {i}. " for i in range(8)]
+    answer, edits = _answer(monkeypatch, chunks, delay=0.1, stall=False)
+    assert answer == "".join(chunks)
+    assert edits[-1] == answer
+
+
+def test_stalled_stream_is_marked_incomplete(monkeypatch):
+    answer, edits = _answer(monkeypatch, ["Начало ", "ответа"], delay=0.05, stall=True)
+    assert answer == "Начало ответа" + AI_INTERRUPTED_TEXT
+    assert edits[-1] == answer
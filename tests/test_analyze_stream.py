@@ -0,0 +1,92 @@
+"""Потоковый разбор задачи: подзадачи приходят до конца ответа модели, слот очереди не утекает"""
+import asyncio
+import json
+import time
+
+import sync_api
+from lm_stub import LMStub
+
+
+async def _stream(description: str, disconnect_after: int = -1, timeout_ms=None) -> list:
+    """Вызвать POST /analyze_task/stream напрямую через ASGI; вернуть [(время, событие)]"""
+    body = {"userId": 1, "description": description}
+    if timeout_ms:
+        body["timeoutMs"] = timeout_ms
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/analyze_task/stream", "raw_path": b"/analyze_task/stream",
+        "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1), "server": ("test", 80),
+    }
+    events = []
+    disconnected = asyncio.Event()
+    if disconnect_after == 0:
+        disconnected.set()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await asyncio.sleep(0)  # как настоящий сервер: отправка - точка переключения
+        if message["type"] != "http.response.body" or not message.get("body"):
+            return
+        event = message["body"].decode().split("\n", 1)[0].removeprefix("event: ")
+        events.append((time.perf_counter(), event))
+        if len(events) == disconnect_after:
+            disconnected.set()
+
+    started = time.perf_counter()
+    await sync_api.app(scope, receive, send)
+    return [(at - started, event) for at, event in events]
+
+
+def _run(scenario, monkeypatch, **stub_args):
+    async def wrapped():
+        stub = LMStub(**stub_args)
+        await stub.start()
+        monkeypatch.setenv("LM_BASE_URL", stub.base_url)
+        try:
+            async with sync_api.app.router.lifespan_context(sync_api.app):
+                return await scenario()
+        finally:
+            await stub.stop()
+
+    return asyncio.run(wrapped())
+
+
+def test_first_subtask_arrives_before_model_finishes(monkeypatch):
+    events = _run(lambda: _stream("Подготовить доклад"), monkeypatch, token_delay_ms=10)
+    names = [event for _, event in events]
+    assert names[0] == "subtask" and names[-1] == "done"
+    first_subtask, done = events[0][0], events[-1][0]
+    assert first_subtask < done / 2
+
+
+def test_slot_released_when_client_disconnects(monkeypatch):
+    async def scenario():
+        # обрыв до первого события (генератор потока так и не начат) и после первой подзадачи
+        before = await _stream("Разобрать почту", disconnect_after=0)
+        after = await _stream("Разобрать входящие", disconnect_after=1)
+        return before, after, sync_api.lm_queue.stats()["active"]
+
+    before, after, active = _run(scenario, monkeypatch, token_delay_ms=10)
+    assert before == []
+    assert [event for _, event in after] == ["subtask"]
+    assert active == 0
+
+
+def test_stream_stops_at_deadline(monkeypatch):
+    async def scenario():
+        events = await _stream("Написать статью", timeout_ms=300)
+        return events, sync_api.lm_queue.stats()["active"]
+
+    events, active = _run(scenario, monkeypatch, token_delay_ms=50)
+    assert events[-1][1] == "error"
+    assert events[-1][0] < 1.0
+    assert active == 0
@@ -0,0 +1,37 @@
+"""Контексты диалогов: обработчик maxapi получает контекст из ContextStore"""
+import asyncio
+
+from maxapi import Router
+from maxapi.context import MemoryContext
+from maxapi.methods.types.getted_updates import UPDATE_MODEL_MAPPING
+from maxapi.types import BotStarted
+
+from context_store import ContextDispatcher, ContextStore, MemoryContextBackend, StoredContext
+
+
+def test_handler_gets_stored_context():
+    async def scenario():
+        store = ContextStore(MemoryContextBackend())
+        dp = ContextDispatcher(store)
+        router = Router()
+        dp.include_routers(router)
+        seen = []
+
+        @router.bot_started()
+        async def handler(event: BotStarted, context: MemoryContext):
+            seen.append(context)
+            await context.update_data(step="started")
+
+        event = UPDATE_MODEL_MAPPING["bot_started"](
+            update_type="bot_started",
+            timestamp=0,
+            chat_id=1,
+            user={"user_id": 10, "first_name": "Тест", "is_bot": False, "last_activity_time": 0},
+        )
+        await dp.handle(event)
+        return store, seen
+
+    store, seen = asyncio.run(scenario())
+    assert len(seen) == 1 and isinstance(seen[0], StoredContext)
+    assert seen[0] is store.get(1, 10)
+    assert store.dirty_count == 1
@@ -0,0 +1,76 @@
+"""Кэш разбора задач: одновременные одинаковые запросы идут в модель один раз"""
+import asyncio
+
+import pytest
+
+from lm_cache import AnalyzeCache, normalize_key
+
+PLAN = [{"title": "Составить план", "estimatedPomodoros": 1}]
+
+
+class SlowModel:
+    """Фабрика ответа модели: считает вызовы и отвечает, когда открыт gate"""
+
+    def __init__(self, result=PLAN):
+        self.calls = 0
+        self.result = result
+        self.gate = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.gate.wait()
+        return self.result
+
+
+def test_concurrent_callers_share_one_model_call():
+    async def scenario():
+        cache = AnalyzeCache()
+        model = SlowModel()
+        key = normalize_key("Написать отчёт", None)
+        callers = [asyncio.create_task(cache.get_or_compute(key, model)) for _ in range(10)]
+        await asyncio.sleep(0)
+        model.gate.set()
+        results = await asyncio.gather(*callers)
+        return cache, model, results
+
+    cache, model, results = asyncio.run(scenario())
+    assert model.calls == 1
+    assert results == [PLAN] * 10
+    assert (cache.misses, cache.coalesced) == (1, 9)
+    assert cache.get(normalize_key("  написать ОТЧЁТ. ", None)) == PLAN
+
+
+def test_cancelled_first_caller_does_not_cancel_others():
+    async def scenario():
+        cache = AnalyzeCache()
+        model = SlowModel()
+        first = asyncio.create_task(cache.get_or_compute("k", model))
+        await asyncio.sleep(0)
+        others = [asyncio.create_task(cache.get_or_compute("k", model)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        model.gate.set()
+        return cache, model, await asyncio.gather(*others)
+
+    cache, model, results = asyncio.run(scenario())
+    assert model.calls == 1
+    assert results == [PLAN] * 3
+    assert cache.get("k") == PLAN
+
+
+def test_result_rejected_by_should_store_is_not_cached():
+    async def scenario():
+        cache = AnalyzeCache()
+        model = SlowModel(result=[])
+        model.gate.set()
+        first = await cache.get_or_compute("k", model, should_store=bool)
+        second = await cache.get_or_compute("k", model, should_store=bool)
+        return cache, model, first, second
+
+    cache, model, first, second = asyncio.run(scenario())
+    assert first == second == []
+    assert model.calls == 2
+    assert cache.stats()["size"] == 0 and cache.stats()["inflight"] == 0
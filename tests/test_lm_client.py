@@ -0,0 +1,32 @@
+"""Пул соединений к LM: запросы переиспользуют одно keep-alive соединение, на остановке пул закрывается"""
+import asyncio
+
+import httpx
+
+import sync_api
+from lm_stub import LMStub
+
+
+def test_lm_requests_reuse_one_connection(monkeypatch):
+    async def scenario():
+        stub = LMStub()
+        await stub.start()
+        monkeypatch.setenv("LM_BASE_URL", stub.base_url)
+        try:
+            transport = httpx.ASGITransport(app=sync_api.app)
+            async with sync_api.app.router.lifespan_context(sync_api.app):
+                client = sync_api.lm_client
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+                    for _ in range(3):
+                        await sync_api._call_lm(sync_api._build_prompt("Написать отчёт", None))
+                        health = (await api.get("/lm/health")).json()
+                        assert health["ok"], health
+                assert not client.is_closed
+            return stub, client
+        finally:
+            await stub.stop()
+
+    stub, client = asyncio.run(scenario())
+    assert stub.requests == 6
+    assert len(stub.connections) == 1
+    assert client.is_closed
@@ -0,0 +1,40 @@
+"""Очередь исходящих: повтор после 429 не нарушает порядок сообщений чата, ожидание - в гистограмме"""
+import asyncio
+
+from maxapi.types.errors import Error
+
+import outbox
+from outbox import Outbox
+
+
+def test_retry_after_429_keeps_chat_order():
+    async def scenario():
+        queue = Outbox(rate=1000, chat_rate=1000, chat_burst=1000, backoff=0.01)
+        waits_before = outbox.WAIT_SECONDS._default.count
+        delivered = []
+        attempts = {"first": 0}
+
+        async def first():
+            attempts["first"] += 1
+            if attempts["first"] == 1:
+                return Error(code=429, raw={"code": "too.many.requests"})
+            delivered.append("first")
+            return "ok"
+
+        def later(text):
+            async def call():
+                delivered.append(text)
+                return "ok"
+            return call
+
+        futures = [queue.submit(1, first)] + [queue.submit(1, later(f"later {i}")) for i in range(3)]
+        results = await asyncio.gather(*futures)
+        return queue, delivered, results, outbox.WAIT_SECONDS._default.count - waits_before
+
+    queue, delivered, results, observed = asyncio.run(scenario())
+    assert delivered == ["first", "later 0", "later 1", "later 2"]
+    assert results == ["ok"] * 4
+    assert (queue.sent, queue.retries, queue.failed, queue.pending) == (4, 1, 0, 0)
+    # повтор не считается новым ожиданием в очереди
+    assert observed == 4
+    assert "focus_outbox_wait_seconds_count" in outbox.WAIT_SECONDS.render()
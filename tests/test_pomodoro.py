@@ -0,0 +1,51 @@
+"""Таймеры Pomodoro: остановка дожидается on_finish закончившихся сессий"""
+import asyncio
+
+from pomodoro import PomodoroTimers
+
+
+def test_stop_waits_for_pending_finish(tmp_path):
+    async def scenario():
+        finished = []
+        started = asyncio.Event()
+
+        async def on_finish(timer):
+            started.set()
+            await asyncio.sleep(0.05)  # отправка «время вышло» и зачёт сессии
+            finished.append(timer.chat_id)
+
+        timers = PomodoroTimers(on_finish, path=str(tmp_path / "timers.json"))
+        await timers.start_loop()
+        timers.start(1, 10, "Отчёт", duration=0.01)
+        await started.wait()
+        await timers.stop()
+        return timers, finished
+
+    timers, finished = asyncio.run(scenario())
+    assert finished == [1]
+    assert timers.finished == 1 and len(timers) == 0
+
+
+def test_stop_cancels_finish_after_drain_timeout():
+    async def scenario():
+        cancelled = []
+        started = asyncio.Event()
+
+        async def on_finish(timer):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(timer.chat_id)
+                raise
+
+        timers = PomodoroTimers(on_finish)
+        await timers.start_loop()
+        timers.start(1, 10, "Отчёт", duration=0.01)
+        await started.wait()
+        await timers.stop(drain_timeout=0.05)
+        return timers, cancelled
+
+    timers, cancelled = asyncio.run(scenario())
+    assert cancelled == [1]
+    assert not timers._finishing
@@ -0,0 +1,209 @@
+"""Планировщик напоминаний: переводы времени, /reminder и раннее пробуждение цикла на подменённых часах, связь чата с пользователем"""
+import asyncio
+from datetime import datetime, time, timezone
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+import router
+from maxapi.context import MemoryContext
+from scheduler import ReminderScheduler, next_fire_time
+from subscribers import SubscriberRegistry
+from task_index import IncompleteTaskIndex
+
+BERLIN = ZoneInfo("Europe/Berlin")
+
+
+def _utc(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+class FakeClock:
+    """Часы, которые двигаются только через advance(); sleeps - запрошенные паузы"""
+
+    def __init__(self, now: float):
+        self.now = now
+        self.sleeps = []
+        self._sleepers = []
+
+    def time(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        sleeper = (self.now + seconds, asyncio.get_running_loop().create_future())
+        self._sleepers.append(sleeper)
+        try:
+            await sleeper[1]
+        finally:
+            self._sleepers.remove(sleeper)
+
+    async def advance(self, seconds: float) -> None:
+        self.now += seconds
+        for until, future in list(self._sleepers):
+            if until <= self.now and not future.done():
+                future.set_result(None)
+        await _settle()
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id=None, user_id=None, text=None, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def _scheduler(now: float) -> ReminderScheduler:
+    return ReminderScheduler(FakeBot(), clock=FakeClock(now))
+
+
+def test_next_fire_time_in_spring_forward_gap():
+    # 29.03.2026 в Берлине часы переводят с 02:00 на 03:00: 02:30 нет - срабатываем в 03:30 CEST
+    after = _utc(2026, 3, 28, 23, 0)  # полночь по Берлину
+    fire_at = next_fire_time(BERLIN, time(2, 30), after)
+    assert fire_at == _utc(2026, 3, 29, 1, 30)
+    assert datetime.fromtimestamp(fire_at, BERLIN).strftime("%H:%M %Z") == "03:30 CEST"
+
+
+def test_next_fire_time_in_fall_back_hour_fires_once():
+    # 25.10.2026 02:30 по Берлину бывает дважды: срабатываем в первый раз, а следующий раз - назавтра
+    after = _utc(2026, 10, 24, 22, 0)  # полночь по Берлину
+    first = next_fire_time(BERLIN, time(2, 30), after)
+    assert first == _utc(2026, 10, 25, 0, 30)
+    assert next_fire_time(BERLIN, time(2, 30), first) == _utc(2026, 10, 26, 1, 30)
+
+
+def test_reminder_command_rearms_timer():
+    async def scenario():
+        now = _utc(2026, 10, 17, 3, 0)  # 06:00 по Москве
+        scheduler = _scheduler(now)
+        router.set_scheduler(scheduler)
+        await scheduler.start()
+        chat_id = 42
+        scheduler.add_user(chat_id, MemoryContext(chat_id, 7))
+        await _settle()
+        assert scheduler.clock.sleeps[-1] == 3 * 3600  # до 09:00 по Москве
+
+        event = SimpleNamespace(
+            get_ids=lambda: (chat_id, 7),
+            message=SimpleNamespace(body=SimpleNamespace(text="/reminder 08:30 Asia/Yekaterinburg")),
+            bot=scheduler.bot,
+        )
+        await router.reminder_command(event, MemoryContext(chat_id, 7))
+        await _settle()
+        assert scheduler.get_user_schedule(chat_id) == ("Asia/Yekaterinburg", time(8, 30))
+        # 08:30 по Екатеринбургу - 03:30 UTC: цикл перепланирован, не дожидаясь старого срока
+        assert scheduler.timers.when(chat_id) == _utc(2026, 10, 17, 3, 30)
+        assert scheduler.clock.sleeps[-1] == 30 * 60
+
+        await scheduler.clock.advance(30 * 60)
+        reminders = [text for sent_to, text in scheduler.bot.sent if sent_to == chat_id and "Доброе утро" in text]
+        assert len(reminders) == 1
+        assert scheduler.timers.when(chat_id) == _utc(2026, 10, 18, 3, 30)
+
+        await scheduler.stop()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        router.set_scheduler(None)
+
+
+def test_loop_wakes_early_when_schedule_changes():
+    async def scenario():
+        now = _utc(2026, 10, 17, 7, 0)  # 10:00 по Москве: ближайшее напоминание - завтра в 09:00
+        scheduler = _scheduler(now)
+        await scheduler.start()
+        await _settle()
+        assert scheduler.clock.sleeps == []  # таймеров нет - ждём только пробуждения
+
+        scheduler.add_user(1)
+        await _settle()
+        assert scheduler.clock.sleeps[-1] == 23 * 3600
+
+        # время не сдвинулось, но новое расписание раньше - цикл проснулся и спит меньше
+        scheduler.add_user(2)
+        scheduler.set_user_schedule(2, reminder_time=time(10, 5))
+        await _settle()
+        assert scheduler.clock.sleeps[-1] == 5 * 60
+        assert scheduler.bot.sent == []
+
+        await scheduler.clock.advance(5 * 60)
+        assert [chat_id for chat_id, _ in scheduler.bot.sent] == [2]
+
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+
+
+class BlockingBot(FakeBot):
+    """Отправка ждёт gate - рассылка идёт, пока её не отпустят"""
+
+    def __init__(self):
+        super().__init__()
+        self.gate = asyncio.Event()
+
+    async def send_message(self, chat_id=None, user_id=None, text=None, **kwargs):
+        await self.gate.wait()
+        await super().send_message(chat_id=chat_id, text=text)
+
+
+def test_stop_waits_for_in_flight_broadcast():
+    async def scenario():
+        scheduler = ReminderScheduler(BlockingBot(), clock=FakeClock(_utc(2026, 10, 17, 5, 59)))
+        await scheduler.start()
+        scheduler.add_user(1)
+        await scheduler.clock.advance(60)  # 09:00 по Москве - рассылка началась и ждёт отправки
+        assert len(scheduler._sends) == 1 and scheduler.bot.sent == []
+
+        stopping = asyncio.create_task(scheduler.stop())
+        await _settle()
+        assert not stopping.done()
+        scheduler.bot.gate.set()
+        await stopping
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert [chat_id for chat_id, _ in scheduler.bot.sent] == [1]
+    assert scheduler._task is None and not scheduler._sends
+
+
+def test_stop_cancels_broadcast_after_drain_timeout():
+    async def scenario():
+        scheduler = ReminderScheduler(BlockingBot(), clock=FakeClock(_utc(2026, 10, 17, 5, 59)))
+        await scheduler.start()
+        scheduler.add_user(1)
+        await scheduler.clock.advance(60)
+        await scheduler.stop(drain_timeout=0.05)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.bot.sent == [] and not scheduler._sends
+
+
+def test_chat_user_link_survives_restart_and_routes_sync(tmp_path):
+    path = str(tmp_path / "subscribers")
+    now = _utc(2026, 10, 17, 7, 0)
+    first = ReminderScheduler(FakeBot(), clock=FakeClock(now), registry=SubscriberRegistry(path))
+    first.add_user(500, user_id=77)  # bot_started: chat_id и user_id различаются
+    first.registry.close()
+
+    index = IncompleteTaskIndex()
+    restarted = ReminderScheduler(
+        FakeBot(), clock=FakeClock(now), task_index=index, registry=SubscriberRegistry(path)
+    )
+    restarted.load_subscribers()
+    assert restarted.user_by_chat == {500: 77}
+
+    task = {"id": "t1", "title": "Отчёт", "subTasks": [{"title": "План", "completed": False}]}
+    restarted.on_sync(77, [task], [])
+    # chat_id не принимается за user_id: синхронизация неизвестного пользователя никуда не попадает
+    restarted.on_sync(500, [dict(task, id="t2", title="Чужая")], [])
+    assert asyncio.run(index.summary(500)) == (1, ["Отчёт"])
+    assert len(index) == 1
+    restarted.registry.close()
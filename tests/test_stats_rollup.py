@@ -0,0 +1,103 @@
+"""Статистика по дням: ошибка записи при вытеснении, запоздалые дни, обрезка истории, недельные корзины"""
+import asyncio
+import threading
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from stats_rollup import DailySeries, MemoryStatsBackend, StatsRollups
+
+TZ = "Europe/Moscow"
+
+
+class FailingBackend(MemoryStatsBackend):
+    """Первая запись ждёт gate и падает, следующие проходят"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.writes = 0
+
+    def write_many(self, rows):
+        self.writes += 1
+        if self.writes == 1:
+            self.started.set()
+            self.gate.wait(5)
+            raise OSError("диск отвалился")
+        super().write_many(rows)
+
+
+def _at(rollups: StatsRollups, day: date) -> float:
+    return datetime.combine(day, time(12, 0), rollups.tz).timestamp()
+
+
+def test_series_in_failed_flush_is_not_evicted():
+    async def scenario():
+        backend = FailingBackend()
+        rollups = StatsRollups(backend, tz=TZ, max_bytes=8)
+        today = rollups.today()
+        rollups.add(1, sessions=2, focus_minutes=50)
+        flush = asyncio.create_task(rollups.flush())
+        await asyncio.to_thread(backend.started.wait, 5)
+        rollups.add(2, sessions=1, focus_minutes=25)  # бюджет превышен посреди записи
+        backend.gate.set()
+        with pytest.raises(OSError):
+            await flush
+        assert await rollups.flush() == 2
+        return rollups, backend, today
+
+    rollups, backend, today = asyncio.run(scenario())
+    assert rollups.query(1, today, today) == [(today, 2, 3000)]
+    assert rollups.query(2, today, today) == [(today, 1, 1500)]
+    assert set(backend._rows) == {1, 2}
+
+
+def test_late_day_is_prepended():
+    rollups = StatsRollups(MemoryStatsBackend(), tz=TZ)
+    day = date(2026, 3, 10)
+    rollups.add(1, 1, 25, at=_at(rollups, day))
+    rollups.add(1, 2, 50, at=_at(rollups, day - timedelta(days=3)))  # синхронизация пришла позже
+    rollups.add(1, 1, 25, at=_at(rollups, day - timedelta(days=1)))
+
+    result = rollups.query(1, day - timedelta(days=4), day)
+    assert [(sessions, focus) for _, sessions, focus in result] == [(0, 0), (2, 3000), (0, 0), (1, 1500), (1, 1500)]
+
+
+def test_day_older_than_max_days_is_dropped():
+    series = DailySeries()
+    series.add(1000, 1, 60, max_days=10)
+    series.add(995, 1, 60, max_days=10)
+    series.add(990, 1, 60, max_days=10)  # дальше max_days от последнего дня
+    assert series.start == 995
+    assert series.totals([990, 996, 1001]) == ([1, 1], [60, 60])
+
+
+def test_trim_keeps_recent_totals():
+    series = DailySeries()
+    for day in range(100):
+        series.add(day, 1, 60, max_days=50)
+    # обрезка с запасом: история не длиннее max_days, последние дни на месте
+    assert series.days <= 50
+    assert series.start + series.days == 100
+    assert series.sessions[0] == 0 and series.focus[0] == 0
+    sessions, focus = series.totals([70, 100])
+    assert (sessions, focus) == ([30], [1800])
+    assert series.totals([0, series.start]) == ([0], [0])
+
+
+def test_week_buckets_start_on_monday_and_are_clipped():
+    rollups = StatsRollups(MemoryStatsBackend(), tz=TZ)
+    first, last = date(2026, 3, 4), date(2026, 3, 17)  # среда .. вторник
+    day = first
+    while day <= last:
+        rollups.add(1, 1, 10, at=_at(rollups, day))
+        day += timedelta(days=1)
+
+    result = rollups.query(1, first, last, bucket="week")
+    assert [start for start, _, _ in result] == [date(2026, 3, 4), date(2026, 3, 9), date(2026, 3, 16)]
+    assert [sessions for _, sessions, _ in result] == [5, 7, 2]
+
+    # first в понедельник - первая корзина полная неделя, без пустой корзины перед ней
+    result = rollups.query(1, date(2026, 3, 9), date(2026, 3, 15), bucket="week")
+    assert result == [(date(2026, 3, 9), 7, 7 * 600)]
@@ -0,0 +1,69 @@
+"""Отложенная запись данных синхронизации: ошибка записи не теряет правки, чтение не ждёт записи"""
+import asyncio
+import json
+import threading
+
+import pytest
+
+from storage import MemoryStorage, SQLiteStorage, WriteBehindStore
+
+
+class GatedStorage(MemoryStorage):
+    """Первая запись ждёт release и падает; следующие проходят"""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def write_many(self, rows):
+        self.calls += 1
+        if self.calls == 1:
+            self.entered.set()
+            self.release.wait(5)
+            raise OSError("диск недоступен")
+        super().write_many(rows)
+
+
+def test_failed_flush_keeps_in_flight_users_cached():
+    async def scenario():
+        backend = GatedStorage()
+        store = WriteBehindStore(backend, max_cached=2)
+        store[1] = {"title": "первая правка"}
+        flush = asyncio.create_task(store.flush())
+        await asyncio.to_thread(backend.entered.wait, 5)
+
+        # пока запись идёт, кэш переполняется: пользователь 1 в записи и не должен вытесняться
+        store[2] = {"title": "вторая"}
+        store[3] = {"title": "третья"}
+        backend.release.set()
+        with pytest.raises(OSError):
+            await flush
+
+        assert await store.flush() == 3
+        return backend, store
+
+    backend, store = asyncio.run(scenario())
+    assert json.loads(backend.read(1)) == {"title": "первая правка"}
+    assert store.get(1) == {"title": "первая правка"}
+
+
+def test_sqlite_read_does_not_wait_for_write_transaction(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "sync.db"))
+    storage.write_many([(1, '{"v": 1}')])
+
+    # запись в процессе: транзакция открыта и блокировка записи занята
+    with storage._lock:
+        storage._conn.execute("BEGIN IMMEDIATE")
+        storage._conn.execute("UPDATE users SET data = '{\"v\": 2}' WHERE user_id = 1")
+        result = []
+        reader = threading.Thread(target=lambda: result.append(storage.read(1)))
+        reader.start()
+        reader.join(2)
+        assert not reader.is_alive(), "чтение ждёт транзакцию записи"
+        storage._conn.execute("COMMIT")
+
+    assert result == ['{"v": 1}']
+    assert storage.read(1) == '{"v": 2}'
+    storage.close()
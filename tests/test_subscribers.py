@@ -0,0 +1,96 @@
+"""Реестр подписчиков: снимок и журнал, недописанная строка, снимок в фоне"""
+import asyncio
+import threading
+from datetime import time
+
+from scheduler import ReminderScheduler
+from subscribers import SubscriberRegistry
+
+MSK = "Europe/Moscow"
+
+
+def _state(path: str) -> dict:
+    registry = SubscriberRegistry(path)
+    rows = {row[0]: row for row in registry.load()}
+    registry.close()
+    return rows
+
+
+def test_snapshot_and_log_replay(tmp_path):
+    path = str(tmp_path / "subscribers")
+    registry = SubscriberRegistry(path)
+    registry.compact([(1, 10, MSK, time(9, 0)), (2, None, MSK, time(9, 0)), (3, 30, "Asia/Tokyo", time(7, 30))])
+    registry.add(2, 20, MSK, time(8, 15))  # изменение поверх снимка
+    registry.remove(3)
+    registry.add(4, 40, "Europe/Berlin", time(6, 0))
+    registry.close()
+
+    assert _state(path) == {
+        1: (1, 10, MSK, time(9, 0)),
+        2: (2, 20, MSK, time(8, 15)),
+        4: (4, 40, "Europe/Berlin", time(6, 0)),
+    }
+
+
+def test_torn_last_line_is_skipped_and_not_glued(tmp_path):
+    path = str(tmp_path / "subscribers")
+    registry = SubscriberRegistry(path)
+    registry.add(1, 10, MSK, time(9, 0))
+    registry.close()
+    with open(f"{path}.log", "ab") as f:
+        f.write(b"+ 2 20 08:")  # процесс упал посреди записи
+
+    assert set(_state(path)) == {1}
+
+    registry = SubscriberRegistry(path)
+    list(registry.load())
+    registry.add(3, 30, MSK, time(7, 0))
+    registry.close()
+    assert _state(path) == {1: (1, 10, MSK, time(9, 0)), 3: (3, 30, MSK, time(7, 0))}
+
+
+def test_crash_during_compaction_replays_both_logs(tmp_path):
+    path = str(tmp_path / "subscribers")
+    registry = SubscriberRegistry(path)
+    registry.add(1, 10, MSK, time(9, 0))
+    registry.add(2, 20, MSK, time(9, 0))
+    registry.rotate_log()  # снимок начат, но не записан
+    registry.remove(2)
+    registry.add(3, 30, MSK, time(9, 0))
+    registry.close()
+    assert set(_state(path)) == {1, 3}
+
+    # следующий снимок забирает и отложенный журнал
+    registry = SubscriberRegistry(path)
+    rows = list(registry.load())
+    registry.compact(rows)
+    registry.close()
+    assert set(_state(path)) == {1, 3}
+    assert not (tmp_path / "subscribers.log.old").exists()
+
+
+def test_scheduler_compacts_in_background_thread(tmp_path):
+    path = str(tmp_path / "subscribers")
+
+    async def scenario():
+        registry = SubscriberRegistry(path, compact_after=5)
+        threads = []
+        write_snapshot = registry.write_snapshot
+
+        def recording(rows):
+            threads.append(threading.current_thread())
+            return write_snapshot(rows)
+
+        registry.write_snapshot = recording
+        scheduler = ReminderScheduler(None, registry=registry)
+        for chat_id in range(12):
+            scheduler.add_user(chat_id, user_id=chat_id + 100)
+        scheduler.set_user_schedule(3, reminder_time=time(7, 45))
+        await scheduler.stop()
+        return threads
+
+    threads = asyncio.run(scenario())
+    assert threads and all(thread is not threading.main_thread() for thread in threads)
+    state = _state(path)
+    assert set(state) == set(range(12))
+    assert state[3] == (3, 103, MSK, time(7, 45))
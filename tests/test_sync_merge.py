@@ -0,0 +1,58 @@
+"""Слияние синхронизации: побеждает время правки на клиенте, а не время синхронизации"""
+import asyncio
+
+import httpx
+
+import sync_api
+from user_state import merge_sync, now_ms
+
+
+def test_stale_device_does_not_overwrite_newer_edits():
+    record = {}
+    edited_a = now_ms() - 60_000
+    edited_b = edited_a + 30_000
+    merge_sync(
+        record,
+        settings={"pomodoroLength": 50},
+        tasks=[{"id": 1, "title": "B-newer", "fieldTimestamps": {"title": edited_b}}],
+        settings_timestamps={"pomodoroLength": edited_b},
+        client_time=edited_b,
+    )
+    # устройство A правило раньше, а синхронизируется позже
+    merge_sync(
+        record,
+        settings={"pomodoroLength": 25},
+        tasks=[{"id": 1, "title": "A", "fieldTimestamps": {"title": edited_a}}],
+        settings_timestamps={"pomodoroLength": edited_a},
+        client_time=now_ms(),
+    )
+    assert record["tasks"]["1"]["title"] == "B-newer"
+    assert record["settings"]["pomodoroLength"] == 50
+
+
+def test_newer_edit_wins_and_future_time_is_clamped():
+    record = {}
+    merge_sync(record, settings={"theme": "dark"}, settings_timestamps={"theme": now_ms() - 1000})
+    merge_sync(record, settings={"theme": "light"}, settings_timestamps={"theme": now_ms() + 3_600_000})
+    assert record["settings"]["theme"] == "light"
+    assert record["settingsClocks"]["theme"][0] <= now_ms()
+
+
+def test_sync_endpoint_uses_settings_timestamps():
+    async def scenario():
+        transport = httpx.ASGITransport(app=sync_api.app)
+        async with sync_api.app.router.lifespan_context(sync_api.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                edited = now_ms() - 60_000
+                await client.post("/sync", json={
+                    "userId": 9001, "settings": {"pomodoroLength": 50},
+                    "settingsTimestamps": {"pomodoroLength": edited},
+                })
+                response = await client.post("/sync", json={
+                    "userId": 9001, "settings": {"pomodoroLength": 25},
+                    "settingsTimestamps": {"pomodoroLength": edited - 1000}, "clientTime": now_ms(),
+                })
+                return response.json()
+
+    data = asyncio.run(scenario())
+    assert data["settings"]["pomodoroLength"] == 50
@@ -0,0 +1,35 @@
+"""Вебхук: без секрета не запускается, запрос с чужим секретом отклоняется"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from maxapi import Dispatcher
+
+import webhook
+from webhook import SECRET_HEADER, WebhookReceiver, create_receiver_from_env
+
+
+def test_receiver_requires_secret(monkeypatch):
+    monkeypatch.delenv("WEBHOOK_SECRET", raising=False)
+    with pytest.raises(ValueError):
+        create_receiver_from_env(Dispatcher(), None)
+    with pytest.raises(ValueError):
+        WebhookReceiver(Dispatcher(), None, secret="")
+
+
+def test_wrong_secret_is_rejected():
+    receiver = WebhookReceiver(Dispatcher(), None, secret="s3cret")
+    app = FastAPI()
+    receiver.mount(app)
+    client = TestClient(app)
+
+    assert client.post("/webhook", json={}).status_code == 403
+    assert client.post("/webhook", json={}, headers={SECRET_HEADER: "other"}).status_code == 403
+    # с верным секретом запрос доходит до разбора обновления
+    assert client.post("/webhook", json={}, headers={SECRET_HEADER: "s3cret"}).status_code == 400
+    assert receiver.unauthorized == 2
+
+
+def test_missing_dispatcher_hook_fails_loudly(monkeypatch):
+    monkeypatch.setattr(webhook, "MAXAPI_READY", "_Dispatcher__missing")
+    with pytest.raises(RuntimeError):
+        WebhookReceiver(Dispatcher(), None, secret="s3cret")
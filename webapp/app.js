@@ -21,6 +21,15 @@ class FocusHelperApp {
             isOnboarded: false
         };
         this.tasks = [];
+        this.syncRevision = null;
+        // Последние синхронизированные задачи и настройки: с ними сравниваем, что отправить
+        this.syncedTaskSnapshot = null;
+        this.syncedSettings = null;
+        // Последние сохранённые локально задачи и настройки: с ними сравниваем, какие поля правили
+        this.savedTaskSnapshot = null;
+        this.savedSettingsSnapshot = null;
+        // Время правки каждого ключа настроек, мс (у задач - поле fieldTimestamps)
+        this.settingsTimestamps = {};
         this.stats = {
             totalSessions: 0,
             totalFocusTime: 0,
@@ -93,6 +102,19 @@ class FocusHelperApp {
             this.settings.pomodoroLength = 0.5;
             this.tasks = JSON.parse(localStorage.getItem('focus_tasks') || '[]');
             this.stats = JSON.parse(localStorage.getItem('focus_stats') || '{}');
+            const savedRevision = localStorage.getItem('focus_sync_revision');
+            this.syncRevision = savedRevision !== null ? Number(savedRevision) : null;
+            this.settingsTimestamps = JSON.parse(localStorage.getItem('focus_settings_ts') || '{}');
+            this.savedSettingsSnapshot = { ...this.settings };
+            this.savedTaskSnapshot = new Map(this.tasks.map(t => [String(t.id), JSON.stringify(this.taskFields(t))]));
+            // Снимок синхронизированных данных хранится вместе с ревизией: после перезагрузки
+            // отправляются только изменения, а не все задачи заново
+            const syncedTasks = localStorage.getItem('focus_synced_tasks');
+            const syncedSettings = localStorage.getItem('focus_synced_settings');
+            if (this.syncRevision !== null && syncedTasks !== null) {
+                this.syncedTaskSnapshot = new Map(Object.entries(JSON.parse(syncedTasks)));
+                this.syncedSettings = syncedSettings !== null ? JSON.parse(syncedSettings) : null;
+            }
 
             if (!this.stats || typeof this.stats !== 'object') {
                 this.stats = {
@@ -138,16 +160,50 @@ class FocusHelperApp {
         }
     }
 
-    saveSettings(newSettings) {
+    saveSettings(newSettings, fromServer = false) {
         this.settings = { ...this.settings, ...newSettings };
+        // Правка на этом устройстве: запоминаем время для изменившихся ключей
+        const now = Date.now();
+        for (const [key, value] of Object.entries(this.settings)) {
+            if (!fromServer && JSON.stringify(this.savedSettingsSnapshot?.[key]) !== JSON.stringify(value)) {
+                this.settingsTimestamps[key] = now;
+            }
+        }
+        this.savedSettingsSnapshot = { ...this.settings };
         localStorage.setItem('focus_settings', JSON.stringify(this.settings));
+        localStorage.setItem('focus_settings_ts', JSON.stringify(this.settingsTimestamps));
     }
 
-    saveTasks(newTasks) {
+    saveTasks(newTasks, fromServer = false) {
         this.tasks = newTasks;
+        // Правка на этом устройстве: время изменившихся полей задачи - в её fieldTimestamps
+        const now = Date.now();
+        const snapshot = new Map();
+        for (const task of newTasks) {
+            const id = String(task.id);
+            const json = JSON.stringify(this.taskFields(task));
+            const saved = this.savedTaskSnapshot?.get(id);
+            if (!fromServer && saved !== json) {
+                const previous = saved !== undefined ? JSON.parse(saved) : {};
+                const timestamps = { ...(task.fieldTimestamps || {}) };
+                for (const [key, value] of Object.entries(this.taskFields(task))) {
+                    if (JSON.stringify(previous[key]) !== JSON.stringify(value)) {
+                        timestamps[key] = now;
+                    }
+                }
+                task.fieldTimestamps = timestamps;
+            }
+            snapshot.set(id, json);
+        }
+        this.savedTaskSnapshot = snapshot;
         localStorage.setItem('focus_tasks', JSON.stringify(newTasks));
     }
 
+    taskFields(task) {
+        const { fieldTimestamps, ...fields } = task;
+        return fields;
+    }
+
     saveStats(newStats) {
         this.stats = newStats;
         try {
@@ -195,23 +251,43 @@ class FocusHelperApp {
             return;
         }
 
+        // Время каждого поля - время его правки (fieldTimestamps, settingsTimestamps);
+        // clientTime - только верхняя граница, чтобы сервер обрезал время из будущего
+        const payload = {
+            userId: userId,
+            stats: this.stats,
+            clientTime: Date.now()
+        };
+        const { settings, timestamps } = this.collectSettingsChanges();
+        if (Object.keys(settings).length > 0) {
+            payload.settings = settings;
+            payload.settingsTimestamps = timestamps;
+        }
+        // Отправляем только изменённые с прошлой синхронизации задачи
+        const { changed, deleted } = this.collectTaskChanges();
+        payload.tasks = changed;
+        if (this.syncRevision !== null) {
+            payload.sinceRevision = this.syncRevision;
+            payload.deletedTaskIds = deleted;
+        }
+
         try {
             const response = await fetch(`${this.apiBaseUrl}/sync`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    userId: userId,
-                    settings: this.settings,
-                    tasks: this.tasks,
-                    stats: this.stats
-                })
+                body: JSON.stringify(payload)
             });
 
             if (response.ok) {
                 const data = await response.json();
-                if (data.settings) this.saveSettings(data.settings);
-                if (data.tasks) this.saveTasks(data.tasks);
+                if (data.settings) this.saveSettings(data.settings, true);
+                if (data.isDelta) {
+                    this.applyTaskDelta(data.tasks || [], data.deletedTaskIds || []);
+                } else if (data.tasks) {
+                    this.saveTasks(data.tasks, true);
+                }
                 if (data.stats) this.saveStats(data.stats);
+                this.rememberSynced(data.revision);
                 console.log('✅ Данные синхронизированы с сервером');
             } else {
                 console.warn('⚠️ Синхронизация не удалась, данные сохранены локально');
@@ -221,6 +297,75 @@ class FocusHelperApp {
         }
     }
 
+    collectSettingsChanges() {
+        // Ключ без записанного времени правки (данные до обновления) отправляется со временем 0:
+        // он не затрёт значение, которое кто-то уже менял
+        const settings = {};
+        const timestamps = {};
+        for (const [key, value] of Object.entries(this.settings)) {
+            if (this.syncedSettings && JSON.stringify(this.syncedSettings[key]) === JSON.stringify(value)) continue;
+            settings[key] = value;
+            timestamps[key] = this.settingsTimestamps[key] ?? 0;
+        }
+        return { settings, timestamps };
+    }
+
+    collectTaskChanges() {
+        const synced = this.syncedTaskSnapshot || new Map();
+        const changed = [];
+        const seen = new Set();
+        for (const task of this.tasks) {
+            const id = String(task.id);
+            seen.add(id);
+            const current = this.taskFields(task);
+            const json = synced.get(id);
+            if (json === JSON.stringify(current)) continue;
+            // Отправляем только изменённые поля, чтобы не затереть правки с других устройств
+            const previous = json !== undefined ? JSON.parse(json) : {};
+            const fields = { id: task.id };
+            const fieldTimestamps = {};
+            for (const [key, value] of Object.entries(current)) {
+                if (key === 'id' || JSON.stringify(previous[key]) === JSON.stringify(value)) continue;
+                fields[key] = value;
+                fieldTimestamps[key] = task.fieldTimestamps?.[key] ?? 0;
+            }
+            fields.fieldTimestamps = fieldTimestamps;
+            changed.push(fields);
+        }
+        const deleted = [];
+        for (const id of synced.keys()) {
+            if (!seen.has(id)) deleted.push(id);
+        }
+        return { changed, deleted };
+    }
+
+    applyTaskDelta(changedTasks, deletedTaskIds) {
+        const deleted = new Set(deletedTaskIds.map(String));
+        const changed = new Map(changedTasks.map(t => [String(t.id), t]));
+        const tasks = [];
+        for (const task of this.tasks) {
+            const id = String(task.id);
+            if (deleted.has(id)) continue;
+            if (changed.has(id)) {
+                tasks.push({ ...task, ...changed.get(id) });
+                changed.delete(id);
+            } else {
+                tasks.push(task);
+            }
+        }
+        tasks.push(...changed.values());
+        this.saveTasks(tasks, true);
+    }
+
+    rememberSynced(revision) {
+        this.syncRevision = revision;
+        this.syncedTaskSnapshot = new Map(this.tasks.map(t => [String(t.id), JSON.stringify(this.taskFields(t))]));
+        this.syncedSettings = { ...this.settings };
+        localStorage.setItem('focus_sync_revision', String(revision));
+        localStorage.setItem('focus_synced_tasks', JSON.stringify(Object.fromEntries(this.syncedTaskSnapshot)));
+        localStorage.setItem('focus_synced_settings', JSON.stringify(this.syncedSettings));
+    }
+
     navigateTo(view) {
         console.log('navigateTo called with view:', view, 'current view:', this.currentView);
         this.currentView = view;